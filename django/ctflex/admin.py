@@ -1,10 +1,16 @@
 """Register models with the admin interface"""
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.paginator import Paginator
+from django.template.defaultfilters import pluralize
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 
+from ctflex import caches
+from ctflex import commands
 from ctflex import models
 from ctflex import queries
 
@@ -22,6 +28,42 @@ class AllFieldModelAdmin(admin.ModelAdmin):
         super(AllFieldModelAdmin, self).__init__(model, admin_site)
 
 
+class LimitedCountPaginator(Paginator):
+    """Count at most `COUNT_LIMIT` objects
+
+    Purpose:
+        Counting millions of submissions for every changelist page takes
+        seconds. Past the limit, older rows are reached through the keyset
+        link of `KEYSET_CHANGE_LIST_TEMPLATE` instead of page numbers.
+    """
+
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list[:self.COUNT_LIMIT].count()
+
+
+# (Changelist template adding a link to the rows older than the last one shown)
+KEYSET_CHANGE_LIST_TEMPLATE = 'admin/ctflex/keyset_change_list.html'
+
+
+class LargeTableModelAdmin(AllFieldModelAdmin):
+    """Keep the changelist of a table with millions of rows fast
+
+    Implementation Notes:
+        - Rows are ordered by descending ID so that the primary key index
+          serves both the ordering and keyset links (which filter on `id__lt`).
+        - Dates are filtered by ranges instead of with a date hierarchy, which
+          would scan the whole table for the distinct years, months or days.
+    """
+
+    paginator = LimitedCountPaginator
+    show_full_result_count = False
+    change_list_template = KEYSET_CHANGE_LIST_TEMPLATE
+    ordering = ('-id',)
+
+
 # endregion
 
 # region Admin Filters
@@ -37,30 +79,96 @@ class EligibileFilter(admin.SimpleListFilter):
         )
 
     def queryset(self, request, queryset):
-        if self.value() in ('0', '1'):
-            result = [team.id for team in queryset
-                      if queries.eligible(team)
-                      == (self.value() == '1')]
-            return queryset.filter(id__in=result)
-
-
-# TODO(Yatharth): Speed up
-# class ParticipationFilter(admin.SimpleListFilter):
-#     title = 'participation'
-#     parameter_name = 'participation'
-#
-#     def lookups(self, request, model_admin):
-#         return (
-#             ('1', 'Participated'),
-#             ('0', 'Only Registered'),
-#         )
-#
-#     def queryset(self, request, queryset):
-#         if self.value() in ('0', '1'):
-#             result = [team.id for team in queryset
-#                       if bool(queries.score(team=team, window=None))
-#                       == (self.value() == '1')]
-#             return queryset.filter(id__in=result)
+        if self.value() == '1':
+            return queryset.filter(queries.eligible_q())
+        elif self.value() == '0':
+            return queryset.exclude(queries.eligible_q())
+
+
+class SharedIpFilter(admin.SimpleListFilter):
+    title = 'IP sharing'
+    parameter_name = 'shares_ip'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('1', 'Shares an IP with another team'),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() == '1':
+            team_ids = set().union(*queries.shared_ips().values())
+            return queryset.filter(id__in=team_ids)
+
+
+class ParticipationFilter(admin.SimpleListFilter):
+    title = 'participation'
+    parameter_name = 'participation'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('1', 'Participated'),
+            ('0', 'Only Registered'),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() == '1':
+            return queryset.filter(queries.participated_q())
+        elif self.value() == '0':
+            return queryset.exclude(queries.participated_q())
+
+
+class SubmissionWindowFilter(admin.SimpleListFilter):
+    """Filter submissions by window through their problems’ IDs
+
+    Filtering on `problem__window` joins the problem table, which no index on
+    submissions covers. Looking up the window’s problems in the catalog turns
+    the filter into `problem_id IN (…)`, which the (problem, flag) index serves.
+    """
+
+    title = 'window'
+    parameter_name = 'window'
+
+    def lookups(self, request, model_admin):
+        return tuple((window.codename, window.verbose_name) for window in queries.all_windows())
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                window = queries.get_window(self.value())
+            except models.Window.DoesNotExist:
+                return queryset.none()
+            return queryset.filter(problem_id__in=[problem.id for problem in caches.catalog.problems(window)])
+
+
+class SubmissionTeamFilter(admin.SimpleListFilter):
+    """Filter submissions by team ID
+
+    Purpose:
+        Listing every team in the sidebar would load thousands of them, so
+        only the selected one is listed; `SubmissionAdmin` links each row’s
+        team to this filter instead.
+
+    Implementation Notes:
+        - `competitor__team_id` joins competitors through their team index and
+          then submissions through their competitor index.
+    """
+
+    title = 'team'
+    parameter_name = 'team'
+
+    def lookups(self, request, model_admin):
+        if self.value() and self.value().isdigit():
+            return tuple(models.Team.objects.filter(id=self.value()).values_list('id', 'name'))
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            if not self.value().isdigit():
+                return queryset.none()
+            return queryset.filter(competitor__team_id=self.value())
 
 
 # endregion
@@ -69,22 +177,33 @@ class EligibileFilter(admin.SimpleListFilter):
 # region Admin Actions
 
 
+def _set_standing(modeladmin, request, queryset, standing, verb):
+    count = commands.set_standing(team_ids=list(queryset.values_list('id', flat=True)), standing=standing)
+    modeladmin.message_user(request, "{} {} team{}.".format(verb, count, pluralize(count)))
+
+
 def requalify(modeladmin, request, queryset):
-    for object in queryset:
-        object.standing = models.Team.GOOD_STANDING
-        object.save()
+    _set_standing(modeladmin, request, queryset, models.Team.GOOD_STANDING, "Requalified")
 
 
 def disqualify(modeladmin, request, queryset):
-    for object in queryset:
-        object.standing = models.Team.DISQUALIFIED_STANDING
-        object.save()
+    _set_standing(modeladmin, request, queryset, models.Team.DISQUALIFIED_STANDING, "Disqualified")
 
 
 def make_invisible(modeladmin, request, queryset):
-    for object in queryset:
-        object.standing = models.Team.INVISIBLE_STANDING
-        object.save()
+    _set_standing(modeladmin, request, queryset, models.Team.INVISIBLE_STANDING, "Made invisible")
+
+
+def reset_current_timers(modeladmin, request, queryset):
+    window = queries.get_window()
+    if window is None:
+        modeladmin.message_user(request, "There is no window to reset timers for.", messages.ERROR)
+        return
+    count = commands.reset_timers(team_ids=list(queryset.values_list('id', flat=True)), window=window)
+    modeladmin.message_user(request, "Reset {} timer{} for {}.".format(count, pluralize(count), window.verbose_name))
+
+
+reset_current_timers.short_description = "Reset timers for the current window"
 
 
 # endregion
@@ -121,20 +240,30 @@ class UserAdmin(BaseUserAdmin):
 
 class TeamAdmin(AllFieldModelAdmin):
     EXCLUDE = ('id', 'passphrase',)
-    INCLUDE = ('size', 'eligible',)
+    INCLUDE = ('size', 'eligible', 'participated', 'score')
     date_hierarchy = 'created_at'
-    actions = [requalify, disqualify, make_invisible]
-    list_filter = (EligibileFilter, 'standing')
+    actions = [requalify, disqualify, make_invisible, reset_current_timers]
+    list_filter = (EligibileFilter, ParticipationFilter, SharedIpFilter, 'standing')
     inlines = (CompetitorInline,)
     search_fields = ('name', 'school')
 
+    def get_queryset(self, request):
+        return queries.with_standings(super().get_queryset(request))
+
     def eligible(self, team):
-        return queries.eligible(team)
+        return team.is_eligible
+
+    def participated(self, team):
+        return team.solve_count > 0
 
     def score(self, team):
-        return queries.score(team=team, window=None)
+        return int(team.overall_score)
 
     eligible.boolean = True
+    eligible.admin_order_field = 'is_eligible'
+    participated.boolean = True
+    participated.admin_order_field = 'solve_count'
+    score.admin_order_field = 'overall_score'
 
 
 class WindowAdmin(AllFieldModelAdmin):
@@ -154,30 +283,27 @@ class CtfProblemAdmin(AllFieldModelAdmin):
     list_filter = ('window',)
 
 
-class SolveAdmin(AllFieldModelAdmin):
-    INCLUDE = ('window',)
+class SolveAdmin(LargeTableModelAdmin):
     EXCLUDE = ()
-    list_filter = ('problem__window',)
-    date_hierarchy = 'date'
+    list_filter = (('date', admin.DateFieldListFilter), 'window')
+    list_select_related = ('problem', 'competitor__user', 'competitor__team', 'team', 'window')
     search_fields = (
         'problem__name',
-        'problem__window__codename',
+        'window__codename',
         'competitor__user__username',
-        'competitor__team__name',
+        'team__name',
         'date',
         'flag',
     )
 
-    def window(self, solve):
-        return solve.problem.window
 
-
-class SubmissionAdmin(AllFieldModelAdmin):
+class SubmissionAdmin(LargeTableModelAdmin):
     EXCLUDE = ('id', 'p_id')
-    date_hierarchy = 'date'
+    INCLUDE = ('team',)
     readonly_fields = ('date',)
     list_display_links = ('date',)
-    list_filter = ('correct',)
+    list_filter = (('date', admin.DateFieldListFilter), 'correct', SubmissionWindowFilter, SubmissionTeamFilter)
+    list_select_related = ('problem', 'competitor__user', 'competitor__team')
     search_fields = (
         'problem__name',
         'competitor__user__username',
@@ -186,12 +312,16 @@ class SubmissionAdmin(AllFieldModelAdmin):
         'flag',
     )
 
+    def team(self, submission):
+        team = submission.competitor.team
+        return format_html('<a href="?{}={}">{}</a>', SubmissionTeamFilter.parameter_name, team.id, team.name)
+
 
 class AnnouncementAdmin(admin.ModelAdmin):
     list_display = ('title', 'date', 'window')
     date_hierarchy = 'date'
     list_display_links = ('title',)
-    filter_horizontal = ('competitors', 'problems')
+    filter_horizontal = ('problems',)
     list_filter = ('window',)
     search_fields = (
         'title',
@@ -199,6 +329,30 @@ class AnnouncementAdmin(admin.ModelAdmin):
     )
 
 
+class IpObservationAdmin(admin.ModelAdmin):
+    list_display = ('ip', 'team', 'competitor', 'browser', 'count', 'first_seen', 'last_seen')
+    list_select_related = ('team', 'competitor__user', 'competitor__team')
+    list_filter = ('browser',)
+    date_hierarchy = 'last_seen'
+    search_fields = (
+        'ip',
+        'team__name',
+        'competitor__user__username',
+    )
+    readonly_fields = list_display
+
+
+class ProblemAccessAdmin(LargeTableModelAdmin):
+    EXCLUDE = ('id',)
+    list_filter = (('date', admin.DateFieldListFilter),)
+    list_select_related = ('problem',)
+    search_fields = (
+        'ip',
+        'server',
+        'problem__name',
+    )
+
+
 # endregion
 
 
@@ -216,5 +370,7 @@ admin.site.register(models.Solve, SolveAdmin)
 admin.site.register(models.Submission, SubmissionAdmin)
 
 admin.site.register(models.Announcement, AnnouncementAdmin)
+admin.site.register(models.IpObservation, IpObservationAdmin)
+admin.site.register(models.ProblemAccess, ProblemAccessAdmin)
 
 # endregion
@@ -0,0 +1,362 @@
+"""Define versioned caching and its invalidation
+
+Version counters are stored in the shared cache. Cached values include the
+version(s) they were computed for in their keys, so bumping a version
+invalidates every dependent value at once without knowing their keys.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from ctflex import constants
+from ctflex import events
+from ctflex import metrics
+from ctflex import models
+from ctflex import settings
+
+logger = logging.getLogger(constants.BASE_LOGGER_NAME + '.' + __name__)
+
+
+# region Backend
+
+# Cache backends that keep values within one process
+_PER_PROCESS_BACKENDS = frozenset((
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+))
+
+
+def is_shared():
+    """Return whether all server processes share the default cache
+
+    Bumping a version counter only invalidates other processes’ values if they do.
+    """
+    return settings.CACHES.get('default', {}).get('BACKEND') not in _PER_PROCESS_BACKENDS
+
+
+# endregion
+
+
+# region Versions
+
+def _initial_version():
+    """Return a fresh starting value for a version counter
+
+    Purpose:
+        If a version counter is evicted from the cache, restarting it at a
+        small constant could make values cached for the old counter valid
+        again. Starting from the current time in milliseconds avoids that.
+    """
+    return int(time.time() * 1000)
+
+
+def get_versions(*keys):
+    """Return a tuple of the current values of the given version counters"""
+    versions = cache.get_many(keys)
+    missing = {key: _initial_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return tuple(versions[key] for key in keys)
+
+
+def get_version(key):
+    return get_versions(key)[0]
+
+
+def bump_version(key):
+    """Increment a version counter, invalidating values cached for it"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), None)
+
+
+# endregion
+
+
+# region Game Page
+
+def _team_version_key(team_id):
+    return constants.TEAM_VERSION_KEY_PREFIX + str(team_id)
+
+
+def game_version(team):
+    """Return the version of the game page’s problem list for a team"""
+    return '{}.{}'.format(*get_versions(constants.PROBLEMS_VERSION_KEY, _team_version_key(team.id)))
+
+
+def game_cache_duration():
+    """Return how long to cache the game page’s problem list for
+
+    With a per-process cache backend, a solve only invalidates the problem
+    list in the process that graded it, so other processes must not keep it
+    for long.
+    """
+    return settings.GAME_CACHE_DURATION if is_shared() else settings.UNSHARED_GAME_CACHE_DURATION
+
+
+def invalidate_problems():
+    """Invalidate cached problem lists for all teams"""
+    bump_version(constants.PROBLEMS_VERSION_KEY)
+
+
+def invalidate_team(team_id):
+    """Invalidate cached problem lists for one team"""
+    bump_version(_team_version_key(team_id))
+
+
+# endregion
+
+
+# region Announcements
+
+def announcements_version(window):
+    """Return a version that changes whenever unread counts for a window might
+
+    Unread counts also change when a competitor reads announcements, but that
+    happens on a page load, which makes the client start over without a version.
+    """
+    return '{}.{}'.format(get_version(constants.ANNOUNCEMENTS_VERSION_KEY),
+                          window.id if window is not None else '')
+
+
+def invalidate_announcements():
+    bump_version(constants.ANNOUNCEMENTS_VERSION_KEY)
+
+
+# endregion
+
+
+# region Boards
+
+def board_cache_key(window):
+    return constants.BOARD_CACHE_KEY_PREFIX + (window.codename if window is not None
+                                               else settings.OVERALL_WINDOW_CODENAME)
+
+
+def invalidate_boards():
+    """Drop every cached board so that each is recomputed on its next view"""
+    cache.delete_many([board_cache_key(window) for window in catalog.windows()] + [board_cache_key(None)])
+
+
+# endregion
+
+
+# region Timers
+
+# (Stored for teams without a timer, as the cache returns None for misses.)
+_NO_TIMER = 'none'
+
+
+def _timer_key(team_id, window_id):
+    return '{}{}_{}'.format(constants.TIMER_CACHE_KEY_PREFIX, team_id, window_id)
+
+
+def get_timer(*, team, window):
+    """Return a team’s timer for a window or None, preferring the cache
+
+    Implementation Notes:
+      - A miss is filled with `add()`, not `set()`, so that a value read before
+        a teammate’s timer committed cannot overwrite the timer `set_timer`
+        stored after the commit.
+      - The absence of a timer is only cached for `NO_TIMER_CACHE_DURATION`,
+        since with a per-process cache backend `set_timer` only reaches the
+        process that started the timer.
+    """
+    key = _timer_key(team.id, window.id)
+    timer = cache.get(key)
+    metrics.timer_cache.inc(result='miss' if timer is None else 'hit')
+    if timer is None:
+        timer = models.Timer.objects.filter(team=team, window=window).first()
+        if timer is not None:
+            cache.add(key, timer, settings.TIMER_CACHE_DURATION)
+        else:
+            cache.add(key, _NO_TIMER, settings.NO_TIMER_CACHE_DURATION)
+    return timer if isinstance(timer, models.Timer) else None
+
+
+def set_timer(timer):
+    cache.set(_timer_key(timer.team_id, timer.window_id), timer, settings.TIMER_CACHE_DURATION)
+
+
+def invalidate_timer(*, team_id, window_id):
+    cache.delete(_timer_key(team_id, window_id))
+
+
+# endregion
+
+
+# region Catalog
+
+class _Snapshot:
+    """Hold an immutable view of all windows and problems"""
+
+    def __init__(self, version):
+        self.version = version
+        self.loaded_at = self.checked_at = time.monotonic()
+
+        self.windows = tuple(models.Window.objects.order_by('start'))
+        for number, window in enumerate(self.windows, start=1):
+            window._number = number
+        self.windows_by_codename = {window.codename: window for window in self.windows}
+
+        problems = defaultdict(list)
+        for problem in models.CtfProblem.objects.all():
+            problems[problem.window_id].append(problem)
+        self.problems = {window_id: tuple(problems_) for window_id, problems_ in problems.items()}
+
+
+class Catalog:
+    """Keep windows and problems in memory, reloading them when they change
+
+    Purpose:
+        Windows and problems are read on nearly every request but change only
+        when an admin edits them or problems are (re)loaded. This class lets
+        queries resolve them without touching the database.
+
+    Implementation Notes:
+        - Saving or deleting a window or problem bumps a version counter in the
+          shared cache (see the signal handlers below). Every process compares its
+          snapshot against that counter at most every `CATALOG_CHECK_INTERVAL`
+          seconds and reloads everything if it moved.
+        - The version is read before the snapshot is loaded so that a
+          concurrent bump at worst causes an extra reload.
+        - Snapshots older than `CATALOG_MAX_AGE` seconds are reloaded even if
+          the version did not move, since with a per-process cache backend
+          bumps made by other processes never arrive.
+        - Snapshots are replaced, never mutated, so no locking is needed for
+          reading; the lock only prevents threads from reloading redundantly.
+
+    Limitations:
+        - Instances are shared between requests, so they MUST NOT be modified.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - snapshot.checked_at < settings.CATALOG_CHECK_INTERVAL:
+            return snapshot
+
+        with self._lock:
+            version = get_version(constants.CATALOG_VERSION_KEY)
+            snapshot = self._snapshot
+            if (snapshot is not None and snapshot.version == version
+                    and time.monotonic() - snapshot.loaded_at < settings.CATALOG_MAX_AGE):
+                snapshot.checked_at = time.monotonic()
+            else:
+                logger.debug("loading catalog version {}".format(version))
+                snapshot = self._snapshot = _Snapshot(version)
+            return snapshot
+
+    def clear(self):
+        """Forget the local snapshot so the next access checks the version"""
+        self._snapshot = None
+
+    def windows(self):
+        """Return all windows sorted by start"""
+        return self._current().windows
+
+    def window(self, codename):
+        try:
+            return self._current().windows_by_codename[codename]
+        except KeyError:
+            raise models.Window.DoesNotExist("No window with codename {!r}".format(codename))
+
+    def current_window(self):
+        """Return the 'current' window as defined by `WindowManager.current`"""
+        now = timezone.now()
+        windows = self.windows()
+        for window in windows:
+            if window.start <= now <= window.end:
+                return window
+        for window in windows:
+            if window.start >= now:
+                return window
+        return windows[-1] if windows else None
+
+    def problems(self, window):
+        """Return all problems of a window"""
+        return self._current().problems.get(window.id, ())
+
+
+catalog = Catalog()
+
+
+def invalidate_catalog():
+    """Make all processes reload the catalog"""
+    bump_version(constants.CATALOG_VERSION_KEY)
+    catalog.clear()
+
+
+# endregion
+
+
+# region Signal Handlers
+#
+# (Invalidation is deferred until the transaction commits, since otherwise
+#  another process could cache the old data again under the new version.)
+
+def solve_changed_handler(sender, instance, **kwargs):
+    team_id = instance.team_id
+    transaction.on_commit(lambda: invalidate_team(team_id))
+
+
+def competitor_saved_handler(sender, instance, **kwargs):
+    # (Set if the competitor changed teams and their solves were moved along.)
+    team_ids = getattr(instance, '_moved_from_team_ids', None)
+    if team_ids:
+        team_ids = set(team_ids) | {instance.team_id}
+
+        def invalidate():
+            for team_id in team_ids:
+                invalidate_team(team_id)
+            invalidate_boards()
+
+        transaction.on_commit(invalidate)
+
+
+def timer_saved_handler(sender, instance, **kwargs):
+    transaction.on_commit(lambda: set_timer(instance))
+
+
+def timer_deleted_handler(sender, instance, **kwargs):
+    team_id, window_id = instance.team_id, instance.window_id
+    transaction.on_commit(lambda: invalidate_timer(team_id=team_id, window_id=window_id))
+
+
+def window_changed_handler(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_catalog)
+
+    # (Set if saving the window recomputed its timers.)
+    team_ids = getattr(instance, '_resynced_team_ids', None)
+    if team_ids:
+        window_id = instance.id
+        transaction.on_commit(lambda: cache.delete_many([_timer_key(team_id, window_id) for team_id in team_ids]))
+
+
+def problem_changed_handler(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_catalog)
+    transaction.on_commit(invalidate_problems)
+
+
+def announcement_changed_handler(sender, instance, created=False, **kwargs):
+    transaction.on_commit(invalidate_announcements)
+    if created:
+        transaction.on_commit(lambda: events.publish_announcement(instance))
+
+
+def announcement_problems_changed_handler(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(invalidate_problems)
+
+# endregion
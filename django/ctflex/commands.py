@@ -5,10 +5,14 @@ from itertools import chain
 from os.path import join
 
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.template.loader import render_to_string
+from django.utils import timezone
 from post_office import mail
 
+from ctflex import caches
 from ctflex import hashers
+from ctflex import metrics
 from ctflex import models
 from ctflex import queries
 from ctflex import settings
@@ -49,25 +53,49 @@ def confirm_registration(user):
 # region Misc
 
 def start_timer(*, team, window):
+    """Start a team’s timer, returning whether a new timer was started
+
+    Implementation Notes:
+      - Instead of checking for an existing timer first, the insert relies on
+        the unique constraint on (window, team), so that concurrent requests
+        from teammates cannot both create a timer.
+      - As the window is ongoing, the timer lies within it, which is all that
+        validating the timer would check.
+      - If the insert fails, the cached timer is dropped, so that the next read
+        finds the teammate’s timer even if a stale absence of it was cached.
+    """
     # XXX(Yatharth): Email other team members
 
-    if not window.started() or window.ended() or team.has_timer(window):
+    if not window.started() or window.ended():
         return False
 
-    timer = models.Timer(team=team, window=window)
+    # (Set what `Timer`’s cleaners would, so the timer can skip full cleaning.)
+    start = timezone.now()
+    timer = models.Timer(team=team, window=window, start=start,
+                         end=min(start + window.personal_timer_duration, window.end))
 
     try:
-        timer.save()
-
-    except ValidationError:
+        with transaction.atomic():
+            models.trusted_save(timer)
+
+    except (ValidationError, IntegrityError):
+        # (A teammate started the timer, so any cached absence of it is stale.)
+        team_id, window_id = team.id, window.id
+        transaction.on_commit(lambda: caches.invalidate_timer(team_id=team_id, window_id=window_id))
+        metrics.timer_starts.inc(result='failed')
         return False
 
+    metrics.timer_starts.inc(result='started')
     return True
 
 
 def mark_announcements_read(user):
-    if queries.is_competitor(user):
-        user.competitor.unread_announcements.clear()
+    competitor = queries.get_competitor(user)
+    if competitor is not None:
+        competitor.announcements_read_at = timezone.now()
+        (models.Competitor.objects
+         .filter(id=competitor.id)
+         .update(announcements_read_at=competitor.announcements_read_at))
 
 
 def refresh_boards():
@@ -78,6 +106,44 @@ def refresh_boards():
 # endregion
 
 
+# region Bulk Team Management
+
+def set_standing(*, team_ids, standing):
+    """Set the standing of teams with one UPDATE, returning how many teams changed
+
+    Implementation Notes:
+      - `update()` skips full cleaning, which validates nothing about standings
+        besides them being one of the choices.
+      - Standings decide which teams boards list and how, so cached boards are
+        dropped once the transaction commits.
+    """
+    count = (models.Team.objects
+             .filter(id__in=team_ids)
+             .exclude(standing=standing)
+             .update(standing=standing))
+    if count:
+        transaction.on_commit(caches.invalidate_boards)
+    return count
+
+
+def reset_timers(*, team_ids, window):
+    """Delete teams’ timers for a window so they can start them anew, returning how many were deleted
+
+    Implementation Notes:
+      - The timers are deleted with one DELETE. Deleting still sends a
+        `post_delete` signal per timer, which invalidates each cached timer.
+      - Solves are kept, but as they no longer lie within a timer, cached
+        boards are dropped.
+    """
+    count, _ = models.Timer.objects.filter(team_id__in=team_ids, window=window).delete()
+    if count:
+        transaction.on_commit(caches.invalidate_boards)
+    return count
+
+
+# endregion
+
+
 # region Flag Submission
 
 def _grade(*, problem, flag, team):
@@ -86,7 +152,8 @@ def _grade(*, problem, flag, team):
     grader = importlib.machinery.SourceFileLoader('grader', grader_path).load_module()
 
     # XXX(Yatharth): Handle no such function or signature or anything, logging appropriate error messages
-    correct, message = grader.grade(hashers.dyanamic_problem_key(team), flag)
+    with metrics.grade_seconds.time():
+        correct, message = grader.grade(hashers.dyanamic_problem_key(team), flag)
     # logger.info('_grade: Flag by team ' + team.id + ' for problem ' + problem.id + ' is ' + correct + '.')
     return correct, message
 
@@ -111,17 +178,39 @@ class FlagTooLongException(ValueError):
     pass
 
 
+# (Labels of the submissions metric for each way a submission can be rejected)
+_SUBMISSION_RESULTS = {
+    FlagSubmissionNotAllowedException: 'not_allowed',
+    ProblemAlreadySolvedException: 'already_solved',
+    FlagAlreadyTriedException: 'already_tried',
+    EmptyFlagException: 'empty',
+    FlagTooLongException: 'too_long',
+}
+
+
 def submit_flag(*, prob_id, competitor, flag):
+    try:
+        correct, message, solve = _submit_flag(prob_id=prob_id, competitor=competitor, flag=flag)
+    except tuple(_SUBMISSION_RESULTS) as err:
+        metrics.submissions.inc(result=_SUBMISSION_RESULTS[type(err)])
+        raise
+
+    metrics.submissions.inc(result='correct' if correct else 'incorrect')
+    return correct, message, solve
+
+
+def _submit_flag(*, prob_id, competitor, flag):
     problem = models.CtfProblem.objects.get(pk=prob_id)
 
     # Confirm that the team can submit flags
     window = problem.window
-    if (not competitor.user.is_superuser and not window.ended()
-        and not competitor.team.has_active_timer(window)):
-        raise FlagSubmissionNotAllowedException()
+    if not competitor.user.is_superuser and not window.ended():
+        timer = caches.get_timer(team=competitor.team, window=window)
+        if timer is None or not timer.active():
+            raise FlagSubmissionNotAllowedException()
 
     # Check if the problem has already been solved
-    if models.Solve.objects.filter(problem=problem, competitor__team=competitor.team).exists():
+    if models.Solve.objects.filter(problem=problem, team_id=competitor.team_id).exists():
         raise ProblemAlreadySolvedException()
 
     # Validate some basic things
@@ -134,9 +223,17 @@ def submit_flag(*, prob_id, competitor, flag):
     correct, message = _grade(problem=problem, flag=flag, team=competitor.team)
 
     # If correct, create solve, effectively updating the score too
+    # (The team was checked not to have solved the problem above, so the solve is
+    #  saved without validating that again. A teammate may still have solved it
+    #  concurrently, in which case the unique constraint on (problem, team) fails.)
     if correct:
-        solve = models.Solve(problem=problem, competitor=competitor, flag=flag)
-        solve.save()
+        solve = models.Solve(problem=problem, competitor=competitor, flag=flag, date=timezone.now())
+        try:
+            with transaction.atomic():
+                models.trusted_save(solve)
+        except IntegrityError:
+            _log_submission(problem=problem, competitor=competitor, flag=flag, correct=correct)
+            raise ProblemAlreadySolvedException()
 
     # Inform the user if they had already tried the same flag
     # (This check must come after actually grading as a team might have submitted a flag
@@ -149,8 +246,14 @@ def submit_flag(*, prob_id, competitor, flag):
         solve = None
 
     # Log submission
-    models.Submission(p_id=problem.id, competitor=competitor, flag=flag, correct=correct).save()
-
+    _log_submission(problem=problem, competitor=competitor, flag=flag, correct=correct)
     return correct, message, solve
 
+
+def _log_submission(*, problem, competitor, flag, correct):
+    # (The problem is known, so the submission need not be cleaned to look it up.)
+    submission = models.Submission(p_id=problem.id, problem=problem, competitor=competitor,
+                                   flag=flag, correct=correct)
+    models.trusted_save(submission)
+
 # endregion
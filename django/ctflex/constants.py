@@ -25,6 +25,11 @@ API_NAMESPACE = 'api'
 ''' Caching '''
 
 BOARD_CACHE_KEY_PREFIX = 'ctflex_board_'
+PROBLEMS_VERSION_KEY = 'ctflex_problems_version'
+TEAM_VERSION_KEY_PREFIX = 'ctflex_team_version_'
+CATALOG_VERSION_KEY = 'ctflex_catalog_version'
+TIMER_CACHE_KEY_PREFIX = 'ctflex_timer_'
+ANNOUNCEMENTS_VERSION_KEY = 'ctflex_announcements_version'
 
 ''' Problems '''
 
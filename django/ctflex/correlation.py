@@ -0,0 +1,138 @@
+"""Feed requests into an index of which IPs and browsers competitors use
+
+Observations are aggregated in memory and upserted into `IpObservation` in
+batches, so indexing costs a dictionary update per request. The index is
+read with the queries in the 'IP Correlation' region of `ctflex.queries`.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from django.db import connection
+from django.utils import timezone
+
+from ctflex import constants
+from ctflex import models
+from ctflex import queries
+from ctflex import settings
+from ctflex.middleware.utils import browsers
+
+logger = logging.getLogger(constants.BASE_LOGGER_NAME + '.' + __name__)
+
+# How many distinct user agents to remember the browser family of
+BROWSER_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=BROWSER_CACHE_SIZE)
+def browser_family(user_agent):
+    """Return the name of the browser family a user agent belongs to
+
+    Purpose:
+        `browsers` tries dozens of regexes one after another, but a contest
+        sees only a few thousand distinct user agents, so results are memoized.
+    """
+    return browsers.resolve(user_agent)[0]
+
+
+class ObservationBuffer:
+    """Aggregate observations in memory and write them out in batches
+
+    Implementation Notes:
+        - Observations are keyed like the unique constraint of `IpObservation`
+          so each batch upserts any row at most once.
+        - The buffer is swapped out under the lock and written outside it, so
+          only the request that triggers a flush waits for the database.
+        - Observations that fail to be written are logged and dropped.
+    """
+
+    UPSERT_SQL = '''
+        INSERT INTO {table} (ip, competitor_id, browser, team_id, count, first_seen, last_seen)
+        VALUES {values}
+        ON CONFLICT (ip, competitor_id, browser) DO UPDATE SET
+            team_id = EXCLUDED.team_id,
+            count = {table}.count + EXCLUDED.count,
+            last_seen = GREATEST({table}.last_seen, EXCLUDED.last_seen)
+    '''
+
+    def __init__(self):
+        self._observations = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def add(self, *, ip, competitor_id, team_id, browser):
+        now = timezone.now()
+        key = (ip, competitor_id, browser)
+
+        with self._lock:
+            observation = self._observations.get(key)
+            if observation is None:
+                self._observations[key] = [team_id, 1, now, now]
+            else:
+                observation[0] = team_id
+                observation[1] += 1
+                observation[3] = now
+
+            due = (len(self._observations) >= settings.IP_INDEX_FLUSH_SIZE
+                   or time.monotonic() - self._flushed_at >= settings.IP_INDEX_FLUSH_INTERVAL)
+            if not due:
+                return
+            observations = self._take()
+
+        self._write(observations)
+
+    def _take(self):
+        """Empty the buffer and return its contents (the caller must hold the lock)"""
+        observations, self._observations = self._observations, {}
+        self._flushed_at = time.monotonic()
+        return observations
+
+    def _write(self, observations):
+        if not observations:
+            return
+
+        params = []
+        for (ip, competitor_id, browser), (team_id, count, first_seen, last_seen) in observations.items():
+            params.extend((ip, competitor_id, browser, team_id, count, first_seen, last_seen))
+        sql = self.UPSERT_SQL.format(
+            table=connection.ops.quote_name(models.IpObservation._meta.db_table),
+            values=', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(observations)),
+        )
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+        except Exception:
+            logger.error("could not write {} IP observations".format(len(observations)), exc_info=True)
+
+    def flush(self):
+        with self._lock:
+            observations = self._take()
+        self._write(observations)
+
+
+buffer = ObservationBuffer()
+atexit.register(buffer.flush)
+
+
+def observe(request):
+    """Record the IP and browser of an authenticated competitor’s request
+
+    Only requests whose handling already loaded the competitor are recorded,
+    so that requests answered without the session, user or database (like
+    polls for unread announcements) stay that way. Every page load of a
+    competitor loads it, so the index still sees every IP and browser.
+    """
+    ip = request.META.get('REMOTE_ADDR', '')
+    if not ip:
+        return
+
+    competitor = queries.request_state(request).loaded_competitor()
+    if competitor is None:
+        return
+
+    user_agent = request.META.get('HTTP_USER_AGENT', '')[:255]
+    buffer.add(ip=ip[:45], competitor_id=competitor.id, team_id=competitor.team_id,
+               browser=browser_family(user_agent)[:50])
@@ -0,0 +1,138 @@
+"""Detect slow and repeated database queries
+
+Purpose:
+    Hot paths can hide per-row queries (N+1 patterns) that only hurt at
+    contest scale. `QueryDiagnostics` logs queries slower than
+    `CTFLEX_SLOW_QUERY_SECONDS` with the code that ran them, as well as
+    statements of the same shape run more than
+    `CTFLEX_REPEATED_QUERY_THRESHOLD` times in one request.
+
+Usage:
+    Enable `QueryDiagnosticsMiddleware` with `CTFLEX_QUERY_DIAGNOSTICS`, or
+    wrap any code in `with diagnose_queries(label):`. `explain` returns how
+    PostgreSQL plans a queryset.
+"""
+
+import json
+import logging
+import os
+import re
+import statistics
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+import django
+from django.db import connection
+
+from ctflex import constants
+from ctflex import instrumentation
+from ctflex import settings
+
+logger = logging.getLogger(constants.BASE_LOGGER_NAME + '.' + __name__)
+
+# How many frames of the project’s own code to show for a query
+STACK_DEPTH = 8
+
+# Paths of frames not to show in stacks (the standard library, installed packages and this module)
+_IGNORED_PATHS = (
+    os.path.dirname(os.path.dirname(logging.__file__)),
+    os.path.dirname(os.path.dirname(django.__file__)),
+    os.path.dirname(__file__) + os.sep + 'instrumentation.py',
+    __file__,
+)
+
+_NUMBER_PATTERN = re.compile(r'\b\d+\b')
+_STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDERS_PATTERN = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+
+def query_shape(sql):
+    """Return a SQL statement with literals and lists of parameters collapsed"""
+    sql = _STRING_PATTERN.sub('?', sql)
+    sql = _NUMBER_PATTERN.sub('?', sql)
+    return _PLACEHOLDERS_PATTERN.sub('(...)', sql)
+
+
+def _stack():
+    """Return the innermost frames of the calling code outside installed packages"""
+    frames = [frame for frame in traceback.extract_stack()[:-1]
+              if not frame[0].startswith(_IGNORED_PATHS)]
+    return ''.join(traceback.format_list(frames[-STACK_DEPTH:]))
+
+
+class QueryDiagnostics:
+    """Observe the queries of one request (or other unit of work)"""
+
+    def __init__(self, label):
+        self.label = label
+        self.shapes = Counter()
+        self.durations = Counter()
+        self.stacks = {}
+
+    def __call__(self, kind, duration, sql):
+        if kind != instrumentation.QUERY:
+            return
+
+        if duration >= settings.SLOW_QUERY_SECONDS:
+            logger.warning("slow query ({:.0f} ms) in {}: {}\n{}".format(
+                duration * 1000, self.label, sql, _stack()))
+
+        shape = query_shape(sql)
+        self.shapes[shape] += 1
+        self.durations[shape] += duration
+        if self.shapes[shape] == settings.REPEATED_QUERY_THRESHOLD + 1:
+            self.stacks[shape] = _stack()
+
+    def report(self):
+        """Log statements repeated too often"""
+        for shape, count in self.shapes.most_common():
+            if count <= settings.REPEATED_QUERY_THRESHOLD:
+                break
+            logger.warning("query repeated {} times ({:.0f} ms in total) in {}: {}\n{}".format(
+                count, self.durations[shape] * 1000, self.label, shape, self.stacks[shape]))
+
+
+@contextmanager
+def diagnose_queries(label):
+    """Log slow and repeated queries made inside the block"""
+    diagnostics = QueryDiagnostics(label)
+    instrumentation.add_observer(diagnostics)
+    try:
+        yield diagnostics
+    finally:
+        instrumentation.remove_observer(diagnostics)
+        diagnostics.report()
+
+
+def explain(queryset, *, analyze=True, format='JSON'):
+    """Return Postgres’s plan for a queryset"""
+    sql, params = queryset.query.sql_with_params()
+    options = ['ANALYZE', 'BUFFERS'] if analyze else []
+    options.append('FORMAT ' + format)
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ({}) {}'.format(', '.join(options), sql), params)
+        rows = cursor.fetchall()
+    if format == 'JSON':
+        plan = rows[0][0]
+        return json.loads(plan)[0] if isinstance(plan, str) else plan[0]
+    return '\n'.join(row[0] for row in rows)
+
+
+def scan_nodes(plan):
+    """Return the scan nodes of a plan as strings like 'Index Scan using … on …'"""
+    nodes = []
+    if 'Relation Name' in plan:
+        description = plan['Node Type']
+        if 'Index Name' in plan:
+            description += ' using ' + plan['Index Name']
+        nodes.append(description + ' on ' + plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        nodes.extend(scan_nodes(child))
+    return nodes
+
+
+def measure(queryset, repeat):
+    """Run a queryset under EXPLAIN ANALYZE and return its median time in ms and its last plan"""
+    plans = [explain(queryset) for _ in range(repeat)]
+    return statistics.median(plan['Execution Time'] for plan in plans), plans[-1]['Plan']
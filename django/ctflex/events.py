@@ -0,0 +1,382 @@
+"""Define a lightweight publish/subscribe mechanism for pushing events to clients
+
+Events are published to named channels and streamed to browsers as
+Server-Sent Events by `views.events`. Each process keeps one buffer of recent
+events and wakes all of its listeners when a new one arrives, so one event is
+fanned out to any number of connections without extra work per connection.
+
+Two brokers exist:
+- `LocalBroker` only delivers events published within the same process. It is
+  meant for development and tests.
+- `FileBroker` appends events to a spool file that every process tails, so it
+  works across Gunicorn workers on one host. It is used if the setting
+  `CTFLEX_EVENTS_SPOOL_PATH` is set, and it starts a new spool whenever one
+  reaches `CTFLEX_EVENTS_SPOOL_MAX_BYTES`.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from os.path import dirname
+
+from ctflex import constants
+from ctflex import settings
+
+logger = logging.getLogger(constants.BASE_LOGGER_NAME + '.' + __name__)
+
+Event = namedtuple('Event', ('id', 'channel', 'type', 'data'))
+
+ANNOUNCEMENTS_CHANNEL = 'announcements'
+ANNOUNCEMENT_EVENT = 'announcement'
+SOLVE_EVENT = 'solve'
+
+
+def team_channel(team_id):
+    return 'team.{}'.format(team_id)
+
+
+# region Brokers
+
+class LocalBroker:
+    """Fan events out to listeners within this process"""
+
+    # How many recent events to keep for listeners that are catching up
+    BACKLOG = 1000
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=self.BACKLOG)
+        self._next_id = 1
+
+    def _add(self, event):
+        """Buffer an event and wake listeners (the caller must hold the condition)"""
+        self._events.append(event)
+        self._condition.notify_all()
+
+    def _since(self, after):
+        """Return buffered events with IDs greater than `after` (the caller must hold the condition)"""
+        events = []
+        for event in reversed(self._events):
+            if event.id <= after:
+                break
+            events.append(event)
+        events.reverse()
+        return events
+
+    def publish(self, channel, type, data):
+        with self._condition:
+            self._add(Event(self._next_id, channel, type, data))
+            self._next_id += 1
+
+    def last_id(self):
+        """Return the ID of the latest event, which new listeners should start after"""
+        with self._condition:
+            return self._events[-1].id if self._events else 0
+
+    def listen(self, channels, after, timeout):
+        """Wait up to `timeout` seconds for events on some channels
+
+        Returns a tuple of the list of events (possibly empty) on the given
+        channels with IDs greater than `after` and the ID to pass as `after`
+        next time.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                events = self._since(after)
+                if events:
+                    after = events[-1].id
+                    matching = [event for event in events if event.channel in channels]
+                    if matching:
+                        return matching, after
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], after
+                self._condition.wait(remaining)
+
+
+class FileBroker(LocalBroker):
+    """Fan events out to listeners in all processes through a spool file
+
+    Implementation Notes:
+        - Publishing appends one JSON line to the file while holding an
+          exclusive `flock` on it, so long lines from different processes
+          cannot interleave. Every process runs a single thread tailing the
+          file and buffering what it reads, so even events published by this
+          process reach its listeners that way.
+        - The first line of a spool records its generation. Once a spool would
+          grow past `max_bytes`, the publisher holding the lock moves it to
+          `<path>.1` (replacing the one before) and starts a new one with a
+          higher generation.
+        - Event IDs are the generation times `GENERATION_SIZE` plus the file
+          offset after each line, so they agree between processes and only
+          increase, even across rotations and restarts. Generations start
+          from the current time, so that holds even if the spool is deleted.
+        - On starting, the tailer reads the previous and current spool into
+          the backlog, so a client reconnecting with the ID of the last event
+          it saw is sent what it missed as long as that is still buffered.
+    """
+
+    # How often to check the spool file for new events, in seconds
+    POLL_INTERVAL = 0.25
+
+    # Factor of the generation in event IDs (bounding spool sizes)
+    GENERATION_SIZE = 2 ** 40
+
+    def __init__(self, path, max_bytes=None):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._tailer = None
+        self._tailer_lock = threading.Lock()
+
+    ''' Spool Files '''
+
+    @property
+    def previous_path(self):
+        return self.path + '.1'
+
+    @staticmethod
+    def _read_generation(spool):
+        """Return the generation in the header of an open spool, leaving it positioned after the header"""
+        spool.seek(0)
+        line = spool.readline()
+        try:
+            return json.loads(line.decode('utf-8'))['generation']
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    @staticmethod
+    def _write_header(spool, generation):
+        spool.write(json.dumps({'generation': generation}).encode('utf-8') + b'\n')
+        spool.flush()
+
+    def _open_locked(self):
+        """Open the current spool for appending and lock it, creating it if necessary"""
+        os.makedirs(dirname(self.path), exist_ok=True)
+        while True:
+            spool = open(self.path, 'a+b')
+            fcntl.flock(spool, fcntl.LOCK_EX)
+
+            # (Another process may have rotated the spool while this one waited for the lock.)
+            try:
+                current = os.stat(self.path).st_ino == os.fstat(spool.fileno()).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                if os.fstat(spool.fileno()).st_size == 0:
+                    self._write_header(spool, int(time.time()))
+                return spool
+
+            spool.close()
+
+    def _rotate(self, spool):
+        """Replace the locked current spool with an empty one of the next generation"""
+        generation = self._read_generation(spool) or 0
+        temporary = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temporary, 'wb') as new:
+            self._write_header(new, max(generation + 1, int(time.time())))
+
+        # (The current spool is linked rather than moved so that the path never goes missing.)
+        try:
+            os.remove(self.previous_path)
+        except FileNotFoundError:
+            pass
+        os.link(self.path, self.previous_path)
+        os.replace(temporary, self.path)
+
+    ''' Publishing '''
+
+    def publish(self, channel, type, data):
+        line = (json.dumps([channel, type, data]) + '\n').encode('utf-8')
+        spool = self._open_locked()
+        try:
+            if self.max_bytes and os.fstat(spool.fileno()).st_size + len(line) > self.max_bytes:
+                self._rotate(spool)
+                spool.close()
+                spool = self._open_locked()
+            spool.write(line)
+            spool.flush()
+        finally:
+            spool.close()
+
+    ''' Tailing '''
+
+    def _ensure_tailer(self):
+        if self._tailer is not None:
+            return
+        with self._tailer_lock:
+            if self._tailer is None:
+                self._open_locked().close()
+                self._tailer = threading.Thread(target=self._tail, name='ctflex-events', daemon=True)
+                self._tailer.start()
+
+    def _open_for_tailing(self):
+        """Open the current spool, waiting for its header, and return it with its generation"""
+        while True:
+            spool = open(self.path, 'rb')
+            generation = self._read_generation(spool)
+            if generation is not None:
+                return spool, generation
+            spool.close()
+            time.sleep(self.POLL_INTERVAL)
+
+    def _read_available(self, spool, generation):
+        """Buffer the complete lines after the spool’s position, stopping before any incomplete one"""
+        while True:
+            start = spool.tell()
+            line = spool.readline()
+            if not line.endswith(b'\n'):
+                spool.seek(start)
+                return
+
+            try:
+                channel, type, data = json.loads(line.decode('utf-8'))
+            except ValueError:
+                logger.error("could not parse event {!r}".format(line), exc_info=True)
+                continue
+
+            with self._condition:
+                self._add(Event(generation * self.GENERATION_SIZE + spool.tell(), channel, type, data))
+
+    def _rotated(self, spool):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(spool.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _tail(self):
+        try:
+            with open(self.previous_path, 'rb') as previous:
+                generation = self._read_generation(previous)
+                if generation is not None:
+                    self._read_available(previous, generation)
+        except FileNotFoundError:
+            pass
+
+        spool, generation = self._open_for_tailing()
+        while True:
+            self._read_available(spool, generation)
+
+            if self._rotated(spool):
+                # (Lines may have been appended between reaching the end and the rotation.)
+                self._read_available(spool, generation)
+                spool.close()
+                spool, generation = self._open_for_tailing()
+            else:
+                time.sleep(self.POLL_INTERVAL)
+
+    def last_id(self):
+        """Return the ID at the current end of the spool
+
+        The spool is read rather than the backlog, as the tailer may still be
+        replaying old events into the backlog.
+        """
+        self._ensure_tailer()
+        with open(self.path, 'rb') as spool:
+            generation = self._read_generation(spool)
+            size = os.fstat(spool.fileno()).st_size
+        if generation is None:
+            return super().last_id()
+        return generation * self.GENERATION_SIZE + size
+
+    def listen(self, channels, after, timeout):
+        self._ensure_tailer()
+        return super().listen(channels, after, timeout)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                if settings.EVENTS_SPOOL_PATH:
+                    _broker = FileBroker(settings.EVENTS_SPOOL_PATH, settings.EVENTS_SPOOL_MAX_BYTES)
+                else:
+                    _broker = LocalBroker()
+    return _broker
+
+
+# endregion
+
+
+# region Publishing
+
+def _publish(channel, type, data):
+    """Publish an event, logging instead of raising any errors"""
+    if not settings.EVENTS_ENABLED:
+        return
+    try:
+        get_broker().publish(channel, type, data)
+    except Exception:
+        logger.error("could not publish {} event".format(type), exc_info=True)
+
+
+def publish_announcement(announcement):
+    _publish(ANNOUNCEMENTS_CHANNEL, ANNOUNCEMENT_EVENT, {
+        'id': announcement.id,
+        'window': announcement.window_id,
+        'title': announcement.title,
+    })
+
+
+def publish_solve(*, solve, score, unlocked):
+    """Tell a team that one of its members solved a problem
+
+    `unlocked` is a list of rendered problems as sent by `views.submit_flag`.
+    """
+    _publish(team_channel(solve.competitor.team_id), SOLVE_EVENT, {
+        'problem': str(solve.problem_id),
+        'competitor': solve.competitor_id,
+        'score': score,
+        'unlocked': unlocked,
+    })
+
+
+# endregion
+
+
+# region Streaming
+
+def _format(event):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event.id, event.type, json.dumps(event.data))
+
+
+def stream(channels, last_event_id=None):
+    """Yield Server-Sent Events from some channels
+
+    Purpose:
+        The stream ends after `CTFLEX_EVENTS_STREAM_DURATION` seconds, after
+        which browsers reconnect by themselves, sending the ID of the last event
+        they received so that nothing is missed.
+    """
+
+    broker = get_broker()
+    try:
+        after = int(last_event_id)
+    except (TypeError, ValueError):
+        after = broker.last_id()
+
+    deadline = time.monotonic() + settings.EVENTS_STREAM_DURATION
+    yield 'retry: {}\n\n'.format(settings.EVENTS_RETRY_MILLISECONDS)
+
+    while time.monotonic() < deadline:
+        events, after = broker.listen(channels, after, timeout=settings.EVENTS_HEARTBEAT)
+
+        # Send a comment as a heartbeat so proxies don't close idle connections
+        if not events:
+            yield ':\n\n'
+
+        for event in events:
+            yield _format(event)
+
+# endregion
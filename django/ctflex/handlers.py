@@ -0,0 +1,176 @@
+"""Define Python logging handlers and formatters
+
+This module must not import models as logging is configured before Django’s
+app registry is ready.
+"""
+
+import glob
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from django.utils.module_loading import import_string
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects
+
+    The object contains the time, the logger’s name, the message as `event`
+    and the items of the record’s `data` attribute (which you can set by
+    passing `extra={'data': <dictionary>}` to the logger).
+    """
+
+    def format(self, record):
+        data = OrderedDict()
+        data['time'] = datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat()
+        data['logger'] = record.name
+        data['event'] = record.getMessage()
+        data.update(getattr(record, 'data', {}))
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class CompressingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """Rotate a log file once it is big or old enough and gzip rotated files
+
+    Rotated files are named `<filename>.<timestamp>.gz` so that they sort
+    chronologically; only the newest `backup_count` of them are kept (all of
+    them if it is zero).
+
+    Implementation Notes:
+        - Several processes may write to the same file. Like
+          `logging.handlers.WatchedFileHandler`, this handler reopens the file
+          if another process rotated it, and the size is read from the file
+          system instead of this process’s stream.
+    """
+
+    TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+    def __init__(self, filename, *, max_bytes=0, interval=0, backup_count=0,
+                 encoding='utf-8', delay=False):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, 'a', encoding=encoding, delay=delay)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.opened_at = time.time()
+
+    def _reopen_if_moved(self):
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            current = None
+
+        if self.stream is not None:
+            opened = os.fstat(self.stream.fileno())
+            if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                return current
+            self.stream.close()
+            self.stream = None
+
+        self.stream = self._open()
+        self.opened_at = time.time()
+        return os.fstat(self.stream.fileno())
+
+    def shouldRollover(self, record):
+        stat = self._reopen_if_moved()
+        if not stat.st_size:
+            return False
+        return ((self.max_bytes and stat.st_size >= self.max_bytes)
+                or (self.interval and time.time() - self.opened_at >= self.interval))
+
+    def doRollover(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        rotated = '{}.{}'.format(self.baseFilename, time.strftime(self.TIMESTAMP_FORMAT))
+        suffix = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            rotated = '{}.{}-{}'.format(self.baseFilename, time.strftime(self.TIMESTAMP_FORMAT), suffix)
+            suffix += 1
+
+        try:
+            os.rename(self.baseFilename, rotated)
+        except FileNotFoundError:
+            # (Another process rotated the file first.)
+            pass
+        else:
+            with open(rotated, 'rb') as source, gzip.open(rotated + '.gz', 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+            os.remove(rotated)
+
+        if self.backup_count:
+            backups = sorted(glob.glob(glob.escape(self.baseFilename) + '.*.gz'))
+            for backup in backups[:-self.backup_count]:
+                try:
+                    os.remove(backup)
+                except FileNotFoundError:
+                    pass
+
+        self.stream = self._open()
+        self.opened_at = time.time()
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """Hand records to a background thread that emits them with another handler
+
+    Purpose:
+        Emitting a record then only costs putting it on a queue, so slow I/O
+        (like writing and rotating files) happens off the request path.
+
+    Usage:
+        Pass the dotted path of the handler class to use as `target` along
+        with any arguments for it. Any formatter set on this handler is used
+        by the target handler.
+
+    Implementation Notes:
+        - Records are queued as-is, so their arguments and `data` must not be
+          modified after logging them.
+        - If the queue is full, records are dropped instead of blocking; the
+          number of dropped records is logged once the queue drains.
+    """
+
+    def __init__(self, target, *, queue_size=10000, **target_kwargs):
+        self.target = import_string(target)(**target_kwargs)
+        self.dropped = 0
+        super().__init__(queue.Queue(queue_size))
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def setFormatter(self, formatter):
+        super().setFormatter(formatter)
+        self.target.setFormatter(formatter)
+
+    def prepare(self, record):
+        # (Unlike the default, do not format on the calling thread.)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.queue.put_nowait(logging.makeLogRecord({
+                'name': record.name,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': 'dropped {} log records as the queue was full'.format(dropped),
+            }))
+
+    def close(self):
+        self.listener.stop()
+        self.target.close()
+        super().close()
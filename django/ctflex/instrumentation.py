@@ -0,0 +1,216 @@
+"""Define hooks for timing database queries, template rendering and cache calls
+
+Django 1.9 has no `connection.execute_wrapper`, so the first call to
+`add_observer` wraps the relevant methods of Django’s classes once. Until then
+nothing is wrapped, and afterwards threads without observers only pay for one
+thread-local lookup per call.
+
+Observers are callables taking a kind (one of `QUERY`, `TEMPLATE` and
+`CACHE`), a duration in seconds and a detail (the SQL, the template name or
+the cache method name). They are registered per thread, so they only see
+what the current request does.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from ctflex import constants
+
+logger = logging.getLogger(constants.BASE_LOGGER_NAME + '.' + __name__)
+
+QUERY = 'query'
+TEMPLATE = 'template'
+CACHE = 'cache'
+
+# Cache methods to time
+CACHE_METHODS = ('get', 'set', 'add', 'delete', 'get_many', 'set_many', 'delete_many', 'incr', 'decr')
+
+
+# region Hooks
+
+_local = threading.local()
+_install_lock = threading.Lock()
+_installed = False
+
+
+def _timed(kind, function, describe):
+    """Wrap a function to report its duration to the current thread’s observers
+
+    Calls nested inside another call of the same kind (like a cache backend’s
+    `get_many` calling `get`) are only reported as part of the outer call.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        observers = getattr(_local, 'observers', None)
+        if not observers or kind in _local.active:
+            return function(*args, **kwargs)
+
+        _local.active.add(kind)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            _local.active.discard(kind)
+            detail = describe(*args, **kwargs)
+            for observer in tuple(observers):
+                observer(kind, duration, detail)
+
+    return wrapper
+
+
+def _install():
+    global _installed
+    if _installed:
+        return
+
+    with _install_lock:
+        if _installed:
+            return
+
+        from django.core.cache import caches
+        from django.db.backends.utils import CursorWrapper
+        from django.template.backends.django import Template
+
+        describe_query = lambda cursor, sql, *args, **kwargs: sql
+        CursorWrapper.execute = _timed(QUERY, CursorWrapper.execute, describe_query)
+        CursorWrapper.executemany = _timed(QUERY, CursorWrapper.executemany, describe_query)
+
+        # (Only the backend’s template is wrapped, so `{% include %}`s count as
+        #  part of the template including them.)
+        describe_template = lambda template, *args, **kwargs: template.origin.template_name
+        Template.render = _timed(TEMPLATE, Template.render, describe_template)
+
+        cache_class = type(caches['default'])
+        for name in CACHE_METHODS:
+            method = getattr(cache_class, name, None)
+            if method is not None:
+                setattr(cache_class, name, _timed(CACHE, method, lambda *args, name=name, **kwargs: name))
+
+        _installed = True
+
+
+def add_observer(observer):
+    """Start reporting this thread’s queries, renders and cache calls to an observer"""
+    _install()
+    if not hasattr(_local, 'observers'):
+        _local.observers = []
+        _local.active = set()
+    _local.observers.append(observer)
+
+
+def remove_observer(observer):
+    observers = getattr(_local, 'observers', ())
+    if observer in observers:
+        observers.remove(observer)
+
+
+# endregion
+
+
+# region Request Timings
+
+class RequestTimings:
+    """Accumulate where a request spends its time
+
+    Usage:
+        Register an instance with `add_observer`, call `start_view` when the
+        view is about to run and `finish` when the response is ready.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view_start = None
+        self.total = None
+        self.counts = {QUERY: 0, TEMPLATE: 0, CACHE: 0}
+        self.durations = {QUERY: 0.0, TEMPLATE: 0.0, CACHE: 0.0}
+
+    def __call__(self, kind, duration, detail):
+        self.counts[kind] += 1
+        self.durations[kind] += duration
+
+    def start_view(self):
+        self.view_start = time.perf_counter()
+
+    def finish(self):
+        self.total = time.perf_counter() - self.start
+
+    @property
+    def view(self):
+        """Return the time from calling the view until `finish`"""
+        if self.view_start is None or self.total is None:
+            return None
+        return self.total - (self.view_start - self.start)
+
+    def server_timing(self):
+        """Return the value of a `Server-Timing` header describing the timings"""
+        metrics = [
+            'db;dur={:.1f};desc="{} queries"'.format(self.durations[QUERY] * 1000, self.counts[QUERY]),
+            'tpl;dur={:.1f};desc="{} renders"'.format(self.durations[TEMPLATE] * 1000, self.counts[TEMPLATE]),
+            'cache;dur={:.1f};desc="{} calls"'.format(self.durations[CACHE] * 1000, self.counts[CACHE]),
+        ]
+        if self.view is not None:
+            metrics.append('view;dur={:.1f}'.format(self.view * 1000))
+        metrics.append('total;dur={:.1f}'.format(self.total * 1000))
+        return ', '.join(metrics)
+
+
+# endregion
+
+
+# region Latency Histograms
+
+class LatencyHistograms:
+    """Keep a histogram of response times per view
+
+    Implementation Notes:
+        - Buckets have fixed upper bounds, so histograms from several processes
+          can be merged by adding counts; see `manage.py perfreport`.
+        - `dump` writes this process’s histograms to `<directory>/<pid>.json`,
+          replacing the file atomically.
+    """
+
+    # Upper bounds of buckets in milliseconds (the last bucket is unbounded)
+    BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.dumped_at = time.monotonic()
+
+    def record(self, view, seconds):
+        milliseconds = seconds * 1000
+        with self._lock:
+            histogram = self._histograms.get(view)
+            if histogram is None:
+                histogram = self._histograms[view] = {
+                    'counts': [0] * (len(self.BUCKETS) + 1),
+                    'sum': 0.0,
+                }
+            histogram['counts'][bisect_left(self.BUCKETS, milliseconds)] += 1
+            histogram['sum'] += milliseconds
+
+    def snapshot(self):
+        with self._lock:
+            return {view: {'counts': list(histogram['counts']), 'sum': histogram['sum']}
+                    for view, histogram in self._histograms.items()}
+
+    def dump(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{}.json'.format(os.getpid()))
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as outfile:
+            json.dump({'buckets': self.BUCKETS, 'views': self.snapshot()}, outfile)
+        os.replace(temporary, path)
+        self.dumped_at = time.monotonic()
+
+
+histograms = LatencyHistograms()
+
+# endregion
@@ -1,7 +1,10 @@
-"""Define logging-related functionality"""
+"""Define logging-related functionality
+
+Records logged to the IP logger carry their fields as a dictionary in the
+`data` attribute, which `handlers.JsonFormatter` writes out as JSON lines.
+"""
 
 import logging
-from collections import OrderedDict
 from functools import wraps
 
 from ctflex.constants import IP_LOGGER_NAME, BASE_LOGGER_NAME
@@ -10,42 +13,52 @@ from ctflex import queries
 logger = logging.getLogger(BASE_LOGGER_NAME + '.' + __name__)
 ip_logger = logging.getLogger(IP_LOGGER_NAME + '.' + __name__)
 
+# Paths of requests not to log (as they are polled)
+UNLOGGED_PATHS = ('/api/unread_announcements/', '/api/events/')
 
-# region Helpers
-
-def _format_request(request, response=None):
-    info = OrderedDict()
-
-    # Request info
-    info['method'] = request.method
-    info['path'] = request.path[:255]
-    info['is_secure'] = request.is_secure()
-    info['is_ajax'] = request.is_ajax()
 
-    # Don't log polls
-    if info['path'] == '/api/unread_announcements/':
-        return
+# region Helpers
 
-    # User info
-    info['ip'] = request.META.get('REMOTE_ADDR', '')
-    info['referer'] = request.META.get('HTTP_REFERER', '')[:255]
-    info['user_agent'] = request.META.get('HTTP_USER_AGENT', '')[:255]
-    info['language'] = request.META.get('HTTP_ACCEPT_LANGUAGE', '')[:255]
-    info['user'] = request.user if hasattr(request, 'user') and request.user.is_authenticated() else None
-    info['competitor'] = getattr(info['user'], 'competitor', None)
-    info['team'] = getattr(info['competitor'], 'team', None)
-
-    # Redirect info
-    info['status_code'] = None
-    info['redirect'] = None
-    if response:
-        info['status_code'] = response.status_code
+def _request_data(request, response=None):
+    """Return a dictionary describing a request
+
+    Implementation Notes:
+        - Only IDs and raw fields are collected, so no model is queried or
+          stringified. The competitor and team are only included if the
+          request state already loaded them.
+    """
+
+    meta = request.META
+    data = {
+        'method': request.method,
+        'path': request.path[:255],
+        'is_secure': request.is_secure(),
+        'is_ajax': request.is_ajax(),
+        'ip': meta.get('REMOTE_ADDR', ''),
+        'referer': meta.get('HTTP_REFERER', '')[:255],
+        'user_agent': meta.get('HTTP_USER_AGENT', '')[:255],
+        'language': meta.get('HTTP_ACCEPT_LANGUAGE', '')[:255],
+        'user': None,
+        'competitor': None,
+        'team': None,
+    }
+
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated():
+        data['user'] = user.id
+        state = getattr(request, queries.REQUEST_STATE_ATTR, None)
+        if state is not None and 'competitor' in vars(state):
+            competitor = state.competitor
+            if competitor is not None:
+                data['competitor'] = competitor.id
+                data['team'] = competitor.team_id
+
+    if response is not None:
+        data['status_code'] = response.status_code
         if response.status_code in (301, 302):
-            info['redirect'] = response['Location']
+            data['redirect'] = response['Location']
 
-    # Stringify, trim and return
-    message = str(info)[12:-1]
-    return message
+    return data
 
 
 def _catch_errors(function):
@@ -70,41 +83,45 @@ def _catch_errors(function):
 
 @_catch_errors
 def log_request(request, response):
-    message = _format_request(request, response)
-    if message:
-        ip_logger.info("request: {}".format(message))
+    if request.path in UNLOGGED_PATHS:
+        return
+    ip_logger.info("request", extra={'data': _request_data(request, response)})
 
 
 @_catch_errors
 def log_solve(request, solve):
-    ip_logger.info("solve of {!r}: {}".format(solve.problem, _format_request(request)))
+    data = _request_data(request)
+    data['problem'] = str(solve.problem_id)
+    ip_logger.info("solve", extra={'data': data})
 
 
 @_catch_errors
 def log_timer(request, success):
-    success_message = "started" if success else "failed"
-    message = _format_request(request)
-    ip_logger.info("timer {}: {}".format(success_message, message))
+    data = _request_data(request)
+    data['success'] = success
+    ip_logger.info("timer", extra={'data': data})
 
 
 @_catch_errors
 def log_login(sender, request, user, **kwargs):
-    ip_logger.info("login: {}".format(_format_request(request)))
+    data = _request_data(request)
+    data['user'] = user.id
+    ip_logger.info("login", extra={'data': data})
 
 
 @_catch_errors
 def log_logout(sender, request, user, **kwargs):
-    ip_logger.info("logout: {}".format(_format_request(request)))
+    data = _request_data(request)
+    data['user'] = user.id if user is not None else None
+    ip_logger.info("logout", extra={'data': data})
 
 
 @_catch_errors
 def log_registration(request, team, new):
-    eligible = "eligible" if queries.eligible(team) else "ineligible"
-    message = _format_request(request)
-
-    if new:
-        ip_logger.info("register new {} team: {}".format(eligible, message))
-    else:
-        ip_logger.info("join old {} team: {}".format(eligible, message))
+    data = _request_data(request)
+    data['team'] = team.id
+    data['new'] = new
+    data['eligible'] = queries.eligible(team)
+    ip_logger.info("registration", extra={'data': data})
 
 # endregion
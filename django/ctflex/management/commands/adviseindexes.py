@@ -0,0 +1,338 @@
+import itertools
+import random
+import uuid
+from collections import Counter, namedtuple
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from ctflex import diagnostics
+from ctflex import models
+from ctflex.management.commands import helpers
+
+# (How many rows to insert per statement while generating data)
+BATCH_SIZE = 5000
+
+Shape = namedtuple('Shape', 'label tables queryset')
+Candidate = namedtuple('Candidate', 'table columns')
+
+CANDIDATES = (
+    Candidate('ctflex_submission', ('date',)),
+    Candidate('ctflex_submission', ('problem_id', 'flag')),
+    Candidate('ctflex_submission', ('correct', 'date')),
+    Candidate('ctflex_submission', ('competitor_id', 'date')),
+    Candidate('ctflex_solve', ('date',)),
+    Candidate('ctflex_announcement', ('window_id', 'date')),
+    Candidate('ctflex_team', ('standing',)),
+)
+
+
+class _Rollback(Exception):
+    """Roll back the synthetic dataset and candidate indexes"""
+
+
+def _batches(iterable):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def _insert(model, objects):
+    for batch in _batches(objects):
+        model.objects.bulk_create(batch)
+
+
+class Command(BaseCommand):
+    help = ("Generate a large synthetic contest, run the query shapes of CTFlex’s queries, commands "
+            "and admin against it with EXPLAIN ANALYZE, and then try candidate indexes one at a time "
+            "to report which ones pay off. Everything (including the indexes) is rolled back.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('--teams', type=int, default=5000)
+        parser.add_argument('--members', type=int, default=3,
+                            help="Competitors per team.")
+        parser.add_argument('--windows', type=int, default=3)
+        parser.add_argument('--problems', type=int, default=20,
+                            help="Problems per window.")
+        parser.add_argument('--submissions', type=int, default=60,
+                            help="Submissions per team.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', '-r', type=int, default=5,
+                            help="How many times to run each query (the median time is reported).")
+        parser.add_argument('--candidate', '-c', action='append', default=[], metavar='table:column,…',
+                            help="Extra index to try, like 'ctflex_solve:team_id,date' (repeatable).")
+        parser.add_argument('--min-speedup', type=float, default=2.0,
+                            help="Speedup of some query needed for an index to be recommended.")
+        parser.add_argument('--min-saving', type=float, default=0.5,
+                            help="Milliseconds some query must save for an index to be recommended.")
+        parser.add_argument('--output', '-o',
+                            help="File to write a Markdown report to.")
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        if connection.vendor != 'postgresql':
+            raise CommandError("EXPLAIN output is only understood for PostgreSQL")
+
+        candidates = list(CANDIDATES)
+        for spec in options['candidate']:
+            table, _, columns = spec.partition(':')
+            if not columns:
+                raise CommandError("Expected table:column,… but got {!r}".format(spec))
+            candidates.append(Candidate(table, tuple(columns.split(','))))
+
+        report = []
+        try:
+            with transaction.atomic():
+                context = self._populate(random.Random(options['seed']), **options)
+                self._advise(report, context, candidates, **options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as outfile:
+                outfile.write('\n'.join(report) + '\n')
+            self.stdout.write("Wrote report to {}".format(options['output']))
+
+    # region Synthetic Data
+
+    def _populate(self, rng, **options):
+        """Generate a contest and return the objects that queries are run for"""
+
+        prefix = 'advise-' + uuid.uuid4().hex[:6]
+        now = timezone.now()
+        day = timezone.timedelta(days=1)
+        self.stdout.write("Generating {} teams…".format(options['teams']))
+
+        windows = []
+        for number in range(options['windows']):
+            start = now - 7 * day * (options['windows'] - number)
+            window = models.Window(codename='{}_{}'.format(prefix, number).replace('-', '_'),
+                                   verbose_name='{} {}'.format(prefix, number),
+                                   start=start, end=start + 7 * day, personal_timer_duration=day)
+            models.trusted_save(window)
+            windows.append(window)
+
+        problems = {window.id: [models.CtfProblem(name='{}-{}'.format(prefix, number), window=window,
+                                                  points=rng.choice((10, 20, 50, 100, 200)),
+                                                  grader='grader.py')
+                                for number in range(options['problems'])]
+                    for window in windows}
+        _insert(models.CtfProblem, itertools.chain.from_iterable(problems.values()))
+
+        # (`bulk_create` does not set primary keys, so they are looked up afterward.)
+        user_model = get_user_model()
+        _insert(user_model, (user_model(username='{}-{}'.format(prefix, number))
+                             for number in range(options['teams'] * options['members'])))
+        user_ids = list(user_model.objects.filter(username__startswith=prefix + '-')
+                        .order_by('id').values_list('id', flat=True))
+
+        _insert(models.Team, (models.Team(name='{}-{}'.format(prefix, number), passphrase=prefix,
+                                          standing=rng.choice('GGGGGGGGDI'))
+                              for number in range(options['teams'])))
+        team_ids = list(models.Team.objects.filter(name__startswith=prefix + '-')
+                        .order_by('id').values_list('id', flat=True))
+
+        _insert(models.Competitor, (models.Competitor(user_id=user_id, team_id=team_ids[number // options['members']],
+                                                      email='{}-{}@example.com'.format(prefix, user_id),
+                                                      first_name=prefix, last_name=prefix)
+                                    for number, user_id in enumerate(user_ids)))
+        members = {}
+        for competitor_id, team_id in (models.Competitor.objects.filter(user_id__in=user_ids)
+                                       .values_list('id', 'team_id')):
+            members.setdefault(team_id, []).append(competitor_id)
+
+        timers, solves = [], []
+        for team_id, window in itertools.product(team_ids, windows):
+            if rng.random() < 0.5:
+                continue
+            start = window.start + rng.random() * 6 * day
+            timers.append(models.Timer(team_id=team_id, window=window, start=start, end=start + day))
+            for problem in rng.sample(problems[window.id], rng.randint(0, len(problems[window.id]))):
+                solves.append(models.Solve(problem=problem, competitor_id=rng.choice(members[team_id]),
+                                           team_id=team_id, window=window, points=problem.points,
+                                           date=start + rng.random() * day, flag='flag'))
+        _insert(models.Timer, timers)
+        _insert(models.Solve, solves)
+
+        all_problems = list(itertools.chain.from_iterable(problems.values()))
+        submissions = (
+            models.Submission(p_id=problem.id, problem=problem, competitor_id=rng.choice(members[team_id]),
+                              flag='flag{{{}}}'.format(rng.randrange(1000)), correct=rng.random() < 0.1)
+            for team_id in team_ids
+            for problem in (rng.choice(all_problems) for _ in range(options['submissions']))
+        )
+        _insert(models.Submission, submissions)
+
+        _insert(models.Announcement, (models.Announcement(window=window, title=prefix, body=prefix,
+                                                          date=window.start + rng.random() * 7 * day)
+                                      for window in windows for _ in range(20)))
+
+        with connection.cursor() as cursor:
+            # (`auto_now_add` dated every submission now, so spread them over the contest,
+            #  in ID order as they would be in a real one.)
+            competitor_ids = list(itertools.chain.from_iterable(members.values()))
+            ids = models.Submission.objects.filter(competitor_id__in=competitor_ids).aggregate(
+                first=Min('id'), last=Max('id'))
+            first, last = ids['first'], ids['last']
+            cursor.execute(
+                'UPDATE ctflex_submission SET date = %s + (id - %s)::float / %s * %s '
+                'WHERE id BETWEEN %s AND %s AND competitor_id = ANY(%s)',
+                [windows[0].start, first, max(last - first, 1), now - windows[0].start, first, last, competitor_ids],
+            )
+            # (Postgres cannot create indexes on tables with pending deferred foreign key checks.)
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for table in ('auth_user', 'ctflex_team', 'ctflex_competitor', 'ctflex_window', 'ctflex_ctfproblem',
+                          'ctflex_timer', 'ctflex_solve', 'ctflex_submission', 'ctflex_announcement'):
+                cursor.execute('ANALYZE ' + table)
+
+        team_id = Counter(solve.team_id for solve in solves).most_common(1)[0][0] if solves else team_ids[0]
+        window = windows[-1]
+        timer = models.Timer.objects.filter(team_id=team_id, window=window).first()
+        submission = models.Submission.objects.filter(competitor__team_id=team_id).first()
+        return {
+            'team_id': team_id,
+            'window': window,
+            'start': timer.start if timer is not None else window.start,
+            'end': timer.end if timer is not None else window.end,
+            'problem': problems[window.id][0],
+            'problem_ids': [problem.id for problem in problems[window.id]],
+            'flag': submission.flag if submission is not None else 'flag',
+            'day': window.start + 3 * day,
+        }
+
+    # endregion
+
+    # region Advising
+
+    @staticmethod
+    def _shapes(context):
+        """Return the query shapes the app and admin run"""
+
+        team_id, window = context['team_id'], context['window']
+        start, end, day = context['start'], context['end'], context['day']
+        solves = models.Solve.objects.order_by()
+        submissions = models.Submission.objects.order_by()
+        announcements = window.announcement_set.order_by()
+
+        return (
+            Shape('timer', ('ctflex_timer',),
+                  models.Timer.objects.filter(team_id=team_id, window=window).order_by()[:1]),
+            Shape('solved', ('ctflex_solve',),
+                  solves.filter(problem=context['problem'], team_id=team_id).values('id')[:1]),
+            Shape('score in timer', ('ctflex_solve',),
+                  solves.filter(team_id=team_id, window=window, date__gte=start, date__lte=end)
+                  .values('team_id').annotate(score=Sum('points'))),
+            Shape('last solve in timer', ('ctflex_solve',),
+                  solves.filter(team_id=team_id, window=window, date__gte=start, date__lte=end)
+                  .order_by('-date').values('date')[:1]),
+            Shape('unlock check', ('ctflex_solve',),
+                  solves.filter(team_id=team_id, problem_id__in=context['problem_ids'])
+                  .values('team_id').annotate(points=Sum('points'))),
+            Shape('board', ('ctflex_solve',),
+                  solves.filter(window=window).values('team_id').annotate(score=Sum('points'))),
+            Shape('visible teams', ('ctflex_team',),
+                  models.Team.objects.exclude(standing=models.Team.INVISIBLE_STANDING)),
+            Shape('teammates', ('ctflex_competitor',),
+                  models.Competitor.objects.filter(team_id=team_id)),
+            Shape('flag already tried', ('ctflex_submission', 'ctflex_competitor'),
+                  submissions.filter(problem=context['problem'], competitor__team_id=team_id,
+                                     flag=context['flag']).values('id')[:1]),
+            Shape('announcements', ('ctflex_announcement',),
+                  announcements.order_by('-date')),
+            Shape('unread announcements', ('ctflex_announcement',),
+                  announcements.filter(date__gt=day).values('window_id').annotate(count=Count('id'))),
+            Shape('admin: submissions', ('ctflex_submission',),
+                  submissions.order_by('-id')[:100]),
+            Shape('admin: submissions on a day', ('ctflex_submission',),
+                  submissions.filter(date__gte=day, date__lt=day + timezone.timedelta(days=1))
+                  .order_by('-id')[:100]),
+            Shape('admin: correct submissions', ('ctflex_submission',),
+                  submissions.filter(correct=True).order_by('-id')[:100]),
+            Shape('admin: solves on a day', ('ctflex_solve',),
+                  solves.filter(date__gte=day, date__lt=day + timezone.timedelta(days=1)).order_by('-id')[:100]),
+        )
+
+    @staticmethod
+    def _is_covered(cursor, candidate):
+        """Return whether an existing index starts with the candidate’s columns"""
+        columns = list(candidate.columns)
+        return any(
+            (constraint['index'] or constraint['unique']) and constraint['columns'][:len(columns)] == columns
+            for constraint in connection.introspection.get_constraints(cursor, candidate.table).values()
+        )
+
+    def _advise(self, report, context, candidates, **options):
+        write = self.stdout.write
+        shapes = self._shapes(context)
+
+        report.append("# Index advisor report\n")
+        report.append("{teams} teams × {members} competitors, {windows} windows × {problems} problems, "
+                      "{submissions} submissions per team\n".format(**options))
+
+        report.append("## Baseline\n")
+        report.append("| Query | ms | Scans |")
+        report.append("| --- | ---: | --- |")
+        baseline = {}
+        for shape in shapes:
+            milliseconds, plan = diagnostics.measure(shape.queryset, options['repeat'])
+            baseline[shape.label] = milliseconds
+            scans = '; '.join(diagnostics.scan_nodes(plan))
+            write("{:<32} {:>9.3f} ms  {}".format(shape.label, milliseconds, scans))
+            report.append("| {} | {:.3f} | {} |".format(shape.label, milliseconds, scans))
+
+        report.append("\n## Candidates\n")
+        report.append("| Index | Size (kB) | Query | Before (ms) | After (ms) | Used |")
+        report.append("| --- | ---: | --- | ---: | ---: | --- |")
+        recommended = []
+        with connection.cursor() as cursor:
+            for number, candidate in enumerate(candidates):
+                definition = '{} ({})'.format(candidate.table, ', '.join(candidate.columns))
+                if self._is_covered(cursor, candidate):
+                    write("{}: already covered by an existing index".format(definition))
+                    continue
+
+                name = 'ctflex_advisor_{}'.format(number)
+                cursor.execute('CREATE INDEX {} ON {}'.format(name, definition))
+                cursor.execute('ANALYZE ' + candidate.table)
+                cursor.execute('SELECT pg_relation_size(%s::regclass)', [name])
+                size = cursor.fetchone()[0] / 1024
+
+                pays_off = False
+                for shape in shapes:
+                    if candidate.table not in shape.tables:
+                        continue
+                    milliseconds, plan = diagnostics.measure(shape.queryset, options['repeat'])
+                    before = baseline[shape.label]
+                    used = any(name in node for node in diagnostics.scan_nodes(plan))
+                    pays_off |= (used and before - milliseconds >= options['min_saving']
+                                 and before >= milliseconds * options['min_speedup'])
+                    write("{}: {:<32} {:>9.3f} -> {:>9.3f} ms{}".format(
+                        definition, shape.label, before, milliseconds, " (used)" if used else ""))
+                    report.append("| {} | {:.0f} | {} | {:.3f} | {:.3f} | {} |".format(
+                        definition, size, shape.label, before, milliseconds, "yes" if used else "no"))
+
+                cursor.execute('DROP INDEX ' + name)
+                if pays_off:
+                    recommended.append(definition)
+
+        report.append("\n## Recommended\n")
+        report.extend('- `CREATE INDEX ON {}`'.format(definition) for definition in recommended)
+        if not recommended:
+            report.append("No candidate paid off.")
+
+        write("Recommended indexes:" if recommended else "No candidate index paid off.")
+        for definition in recommended:
+            write("  " + definition)
+
+    # endregion
@@ -0,0 +1,182 @@
+import glob
+import json
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ctflex.management.commands import helpers
+from ctflex.models import Competitor, Team
+
+# Events that carry an IP and the requester’s identity
+EVENTS = ('request', 'solve', 'timer', 'login', 'registration')
+
+# Fields of the legacy format, whose lines are reprs of OrderedDicts of a request’s data
+# (Each is searched for separately, so that no expression backtracks across the line.)
+LEGACY_IP = re.compile(r"'ip', '([^']*)'")
+LEGACY_USER_AGENT = re.compile(r"""'user_agent', (['"])(.*?)\1""")
+LEGACY_COMPETITOR = re.compile(r'<Competitor: #(\d+)')
+LEGACY_TEAM = re.compile(r'<Team: #(\d+)')
+
+
+def _parse_json(line):
+    """Return the observation in a JSON line, None if it has none, or raise ValueError"""
+    record = json.loads(line)
+    if record.get('event') not in EVENTS or not record.get('user'):
+        return None
+    return (record.get('ip', ''), record['user'], record.get('competitor'),
+            record.get('team'), record.get('user_agent', ''))
+
+
+def _parse_legacy(line):
+    """Return the observation in a line of the legacy format or raise ValueError
+
+    Legacy lines do not record the user, only the competitor and team.
+    """
+    ip, competitor, team = (LEGACY_IP.search(line), LEGACY_COMPETITOR.search(line), LEGACY_TEAM.search(line))
+    if not (ip and competitor and team):
+        raise ValueError("not a legacy line")
+    user_agent = LEGACY_USER_AGENT.search(line)
+    return (ip.group(1), None, int(competitor.group(1)), int(team.group(1)),
+            user_agent.group(2) if user_agent else '')
+
+
+def _scan(path):
+    """Return the distinct observations in one log file and line counts
+
+    Observations are tuples of (IP, user ID, competitor ID, team ID, user
+    agent), so memory use grows with the number of distinct ones, not with
+    the size of the file. Lines are read as JSON or else in the legacy format.
+    """
+
+    observations = set()
+    lines = unparsed = 0
+
+    with helpers.open_log(path) as infile:
+        for line in infile:
+            lines += 1
+            try:
+                observation = _parse_json(line)
+            except ValueError:
+                try:
+                    observation = _parse_legacy(line)
+                except ValueError:
+                    unparsed += 1
+                    continue
+
+            if observation is not None:
+                observations.add(observation)
+
+    return observations, lines, unparsed
+
+
+class Command(BaseCommand):
+    help = ("Correlate IPs, teams, competitors and user agents from request logs. "
+            "Reads JSON-lines logs and logs in the legacy format the same_ip and team_ip scripts read "
+            "(including rotated and gzipped ones) in parallel and writes same_ip.out and team_ip.out "
+            "along with JSON versions of them.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('paths', nargs='+',
+                            help="Log files or glob patterns (e.g. 'logs/request.log*').")
+        parser.add_argument('--output-dir', '-o', default='.',
+                            help="Directory to write reports to.")
+        parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                            help="Number of files to read in parallel.")
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        paths = sorted({path for pattern in options['paths'] for path in glob.glob(pattern)})
+        if not paths:
+            raise CommandError("No log files matched")
+
+        # Scan files in parallel
+        observations = set()
+        lines = unparsed = 0
+        with ProcessPoolExecutor(max_workers=max(1, options['jobs'])) as executor:
+            for path, (file_observations, file_lines, file_unparsed) in zip(paths, executor.map(_scan, paths)):
+                self.stdout.write("Read {} lines from {}".format(file_lines, path))
+                observations |= file_observations
+                lines += file_lines
+                unparsed += file_unparsed
+
+        if unparsed:
+            self.stderr.write("Skipped {} of {} lines in neither format".format(unparsed, lines))
+
+        # Resolve users whose competitor was not logged
+        missing_users = {user for _, user, competitor, _, _ in observations if competitor is None}
+        competitors = {
+            user: (competitor, team)
+            for user, competitor, team in (Competitor.objects
+                                           .filter(user_id__in=missing_users)
+                                           .values_list('user_id', 'id', 'team_id'))
+        }
+
+        # Build multi-maps
+        by_ip = defaultdict(lambda: defaultdict(lambda: {'competitors': set(), 'user_agents': set()}))
+        by_team = defaultdict(lambda: defaultdict(set))
+        for ip, user, competitor, team, user_agent in observations:
+            if competitor is None:
+                if user not in competitors:
+                    continue
+                competitor, team = competitors[user]
+            by_ip[ip][team]['competitors'].add(competitor)
+            by_ip[ip][team]['user_agents'].add(user_agent)
+            by_team[team][ip].add(competitor)
+
+        names = dict(Team.objects.filter(id__in=by_team).values_list('id', 'name'))
+
+        def label(team):
+            return "#{} {!r}".format(team, names.get(team, ''))
+
+        def ids(competitors):
+            return ','.join(str(competitor) for competitor in sorted(competitors))
+
+        # Write reports
+        output_dir = options['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+
+        with open(os.path.join(output_dir, 'same_ip.out'), 'w') as outfile:
+            for ip, teams in sorted(by_ip.items()):
+                message = "{}: ".format(ip)
+                message2 = ""
+                for team, data in sorted(teams.items()):
+                    message += "{}({}) ; ".format(label(team), ids(data['competitors']))
+                    message2 += "{}: {} ; ".format(label(team), '[' + '],['.join(sorted(data['user_agents'])) + ']')
+                outfile.write(message + "\n" + message2 + "\n\n")
+
+        with open(os.path.join(output_dir, 'team_ip.out'), 'w') as outfile:
+            for team, ips in sorted(by_team.items()):
+                message = "{}: ".format(label(team))
+                for ip, competitors in sorted(ips.items()):
+                    message += "{}({}) ; ".format(ip, ids(competitors))
+                outfile.write(message + "\n")
+
+        with open(os.path.join(output_dir, 'same_ip.json'), 'w') as outfile:
+            json.dump({
+                ip: [{
+                    'team': team,
+                    'name': names.get(team),
+                    'competitors': sorted(data['competitors']),
+                    'user_agents': sorted(data['user_agents']),
+                } for team, data in sorted(teams.items())]
+                for ip, teams in by_ip.items()
+            }, outfile, indent=2, sort_keys=True)
+
+        with open(os.path.join(output_dir, 'team_ip.json'), 'w') as outfile:
+            json.dump({
+                team: {
+                    'name': names.get(team),
+                    'ips': {ip: sorted(competitors) for ip, competitors in ips.items()},
+                }
+                for team, ips in by_team.items()
+            }, outfile, indent=2, sort_keys=True)
+
+        shared = sum(1 for teams in by_ip.values() if len(teams) > 1)
+        self.stdout.write("{} IPs, {} teams, {} IPs shared by several teams".format(len(by_ip), len(by_team), shared))
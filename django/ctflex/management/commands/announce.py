@@ -7,7 +7,7 @@ import yaml
 from django.db import transaction
 
 from ctflex.management.commands import helpers
-from ctflex.models import Announcement, Competitor, CtfProblem, Window
+from ctflex.models import Announcement, CtfProblem, Window
 
 
 class Command(BaseCommand):
@@ -72,9 +72,4 @@ class Command(BaseCommand):
             self.stderr.write("Exception encountered; rolled back transaction")
             raise
 
-        # Mark this announcement as unread by competitors
-        # (This is outside the transaction manager as it is unlikely to fail
-        #  but might take some time.)
-        announcement.competitors.add(*Competitor.objects.all())
-
         self.stdout.write('Successfully created announcement: {}'.format(announcement))
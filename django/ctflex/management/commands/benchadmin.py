@@ -0,0 +1,139 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from ctflex import caches
+from ctflex import diagnostics
+from ctflex import models
+from ctflex.management.commands import helpers
+
+
+class _Rollback(Exception):
+    """Roll back the synthetic submissions"""
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the Submission and Solve admin changelists after inserting many synthetic "
+            "submissions. Everything written is rolled back.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('--submissions', '-n', type=int, default=5000000)
+        parser.add_argument('--competitors', type=int, default=3000)
+        parser.add_argument('--problems', type=int, default=50)
+        parser.add_argument('--repeat', '-r', type=int, default=3,
+                            help="How many times to load each page.")
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+                user, window = self._populate(**options)
+                client = Client()
+                client.force_login(user)
+                self._benchmark(client, window, options['repeat'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _populate(self, **options):
+        """Insert submissions and return a superuser to view them as and their window"""
+
+        prefix = 'benchadmin-' + uuid.uuid4().hex[:6]
+        now = timezone.now()
+        week = timezone.timedelta(days=7)
+
+        window = models.Window(codename=prefix.replace('-', '_'), verbose_name=prefix,
+                               start=now - week, end=now, personal_timer_duration=week)
+        models.trusted_save(window)
+        problems = [models.CtfProblem(name='{}-{}'.format(prefix, number), window=window, points=10,
+                                      grader='grader.py')
+                    for number in range(options['problems'])]
+        models.CtfProblem.objects.bulk_create(problems)
+
+        # (`bulk_create` does not set primary keys, so they are looked up afterward.)
+        user_model = get_user_model()
+        user_model.objects.bulk_create(user_model(username='{}-{}'.format(prefix, number))
+                                       for number in range(options['competitors']))
+        models.Team.objects.bulk_create(models.Team(name='{}-{}'.format(prefix, number), passphrase=prefix)
+                                        for number in range(options['competitors']))
+        users = user_model.objects.filter(username__startswith=prefix + '-').order_by('id')
+        teams = models.Team.objects.filter(name__startswith=prefix + '-').order_by('id')
+        models.Competitor.objects.bulk_create(
+            models.Competitor(user_id=user_id, team_id=team_id, email='{}-{}@example.com'.format(prefix, user_id),
+                              first_name=prefix, last_name=prefix)
+            for user_id, team_id in zip(users.values_list('id', flat=True), teams.values_list('id', flat=True))
+        )
+        competitor_ids = list(models.Competitor.objects.filter(team__in=teams).values_list('id', flat=True))
+
+        self.stdout.write("Inserting {} submissions…".format(options['submissions']))
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                '''
+                INSERT INTO ctflex_submission (p_id, problem_id, competitor_id, date, flag, correct)
+                SELECT problem_id, problem_id, competitor_id, date, flag, random() < 0.1
+                FROM (
+                    SELECT
+                        (%(problems)s::uuid[])[1 + floor(random() * %(problem_count)s)::int] AS problem_id,
+                        (%(competitors)s::int[])[1 + floor(random() * %(competitor_count)s)::int] AS competitor_id,
+                        %(start)s + random() * %(duration)s AS date,
+                        'flag{' || floor(random() * 1000)::int || '}' AS flag
+                    FROM generate_series(1, %(count)s)
+                ) AS generated
+                ''',
+                {
+                    'problems': [str(problem.id) for problem in problems],
+                    'problem_count': len(problems),
+                    'competitors': competitor_ids,
+                    'competitor_count': len(competitor_ids),
+                    'start': window.start,
+                    'duration': week,
+                    'count': options['submissions'],
+                },
+            )
+            cursor.execute('ANALYZE ctflex_submission')
+        self.stdout.write("Inserted in {:.1f} s".format(time.perf_counter() - start))
+
+        # (The catalog is only invalidated on commit, so it is made to reload the new window.)
+        caches.catalog.clear()
+
+        return user_model.objects.create_superuser(prefix, '{}@example.com'.format(prefix), prefix), window
+
+    def _benchmark(self, client, window, repeat):
+        submissions = reverse('admin:ctflex_submission_changelist')
+        solves = reverse('admin:ctflex_solve_changelist')
+        last_id = models.Submission.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        pages = (
+            ('submissions', submissions),
+            ('submissions, page 50', submissions + '?p=49'),
+            ('submissions, keyset', '{}?id__lt={}'.format(submissions, last_id // 2)),
+            ('submissions, correct', submissions + '?correct__exact=1'),
+            ('submissions, window', '{}?window={}'.format(submissions, window.codename)),
+            ('submissions, past 7 days', '{}?date__gte={}'.format(
+                submissions, (timezone.now() - timezone.timedelta(days=7)).date())),
+            ('submissions, search', submissions + '?q=flag%7B1%7D'),
+            ('solves', solves),
+        )
+
+        for label, url in pages:
+            durations = []
+            with diagnostics.diagnose_queries(label) as queries:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    durations.append(time.perf_counter() - start)
+            self.stdout.write("{:<28} {:>8.0f} ms (best of {}) {:>5.1f} queries  status {}".format(
+                label, min(durations) * 1000, repeat, sum(queries.shapes.values()) / repeat,
+                response.status_code))
@@ -0,0 +1,110 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from ctflex import caches
+from ctflex import commands
+from ctflex import models
+from ctflex.management.commands import helpers
+
+
+class Command(BaseCommand):
+    help = ("Stress-test starting timers by having every competitor of many teams load their timer and "
+            "start it at once from concurrent threads, reporting latencies and any team whose cached "
+            "timer disagrees with the database afterward. As the threads use their own connections, "
+            "the synthetic teams and window are committed and deleted afterward rather than rolled back, "
+            "so this refuses to run against a database with competitors unless forced, and the window "
+            "never overlaps an existing one.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('--starts', '-n', type=int, default=5000,
+                            help="How many timer starts to make in total.")
+        parser.add_argument('--team-size', type=int, default=5,
+                            help="How many competitors per team start their timer concurrently.")
+        parser.add_argument('--threads', '-t', type=int, default=50)
+        parser.add_argument('--force', action='store_true',
+                            help="Run even if the database has competitors (who would see the synthetic "
+                                 "window as the current one while the benchmark runs).")
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        if not options['force'] and models.Competitor.objects.exists():
+            raise CommandError("The database has competitors; run this against a throwaway database "
+                               "or pass --force")
+
+        prefix = 'benchtimers-' + uuid.uuid4().hex[:6]
+        try:
+            window, teams = self._populate(prefix, options['starts'] // options['team_size'])
+            self._benchmark(window, teams, **options)
+        finally:
+            models.Team.objects.filter(name__startswith=prefix + '-').delete()
+            models.Window.objects.filter(codename=prefix.replace('-', '_')).delete()
+
+    def _populate(self, prefix, team_count):
+        """Create an ongoing window between the existing ones and teams without competitors"""
+
+        now = timezone.now()
+        start, end = now - timezone.timedelta(hours=1), now + timezone.timedelta(hours=1)
+        for other in models.Window.objects.all():
+            if other.start <= now <= other.end:
+                raise CommandError("Window {!r} is ongoing; run this against a throwaway database".format(
+                    other.codename))
+            elif other.end < now:
+                start = max(start, other.end + timezone.timedelta(seconds=1))
+            else:
+                end = min(end, other.start - timezone.timedelta(seconds=1))
+
+        # (Saved with full cleaning, so that it is validated not to overlap other windows.)
+        window = models.Window(codename=prefix.replace('-', '_'), verbose_name=prefix, start=start, end=end,
+                               personal_timer_duration=timezone.timedelta(minutes=30))
+        window.save()
+
+        models.Team.objects.bulk_create(models.Team(name='{}-{}'.format(prefix, number), passphrase=prefix)
+                                        for number in range(team_count))
+        teams = list(models.Team.objects.filter(name__startswith=prefix + '-'))
+        return window, teams
+
+    def _benchmark(self, window, teams, **options):
+
+        def start(team):
+            try:
+                started = time.perf_counter()
+                # (Load the timer as the game page would before the competitor clicks to start it.)
+                caches.get_timer(team=team, window=window)
+                result = commands.start_timer(team=team, window=window)
+                return time.perf_counter() - started, result
+            finally:
+                connection.close()
+
+        jobs = [team for team in teams for _ in range(options['team_size'])]
+        self.stdout.write("Starting {} timers for {} teams from {} threads…".format(
+            len(jobs), len(teams), options['threads']))
+        wall = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(start, jobs))
+        wall = time.perf_counter() - wall
+
+        latencies = sorted(latency for latency, _ in results)
+        started = sum(1 for _, result in results if result)
+        self.stdout.write("{} starts in {:.1f} s ({:.0f}/s); {} started, {} already running".format(
+            len(results), wall, len(results) / wall, started, len(results) - started))
+        for percentile in (50, 95, 99, 100):
+            index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+            self.stdout.write("p{:<3} {:>8.1f} ms".format(percentile, latencies[index] * 1000))
+
+        timers = set(models.Timer.objects.filter(window=window).values_list('team_id', flat=True))
+        stale = [team.name for team in teams
+                 if team.id in timers and caches.get_timer(team=team, window=window) is None]
+        missing = [team.name for team in teams if team.id not in timers]
+        self.stdout.write("Teams without a timer: {}; teams whose cached timer is stale: {}".format(
+            len(missing), len(stale)))
+        for name in stale[:10]:
+            self.stdout.write("  stale: {}".format(name))
@@ -0,0 +1,112 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ctflex import instrumentation
+from ctflex import models
+from ctflex.management.commands import helpers
+
+
+class _Rollback(Exception):
+    """Roll back everything the benchmark wrote"""
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, kind, duration, detail):
+        if kind == instrumentation.QUERY:
+            self.count += 1
+
+
+class Command(BaseCommand):
+    help = ("Benchmark saving timers, solves and submissions with `save()` (which full cleans) "
+            "and with `trusted_save()`. Everything written is rolled back.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('--count', '-n', type=int, default=500,
+                            help="How many objects to save per model and way of saving.")
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        try:
+            with transaction.atomic():
+                self._benchmark(options['count'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _measure(self, label, saves):
+        counter = _QueryCounter()
+        instrumentation.add_observer(counter)
+        start = time.perf_counter()
+        try:
+            for save in saves:
+                save()
+        finally:
+            elapsed = time.perf_counter() - start
+            instrumentation.remove_observer(counter)
+
+        self.stdout.write("{:<28} {:>8.0f} saves/s {:>6.1f} queries/save".format(
+            label, len(saves) / elapsed, counter.count / len(saves)))
+
+    def _benchmark(self, count):
+        prefix = 'bench-' + uuid.uuid4().hex[:6]
+        now = timezone.now()
+
+        # Set up a window, problems and competitors
+        window = models.Window(codename=prefix.replace('-', '_'), verbose_name=prefix,
+                               start=now - timezone.timedelta(hours=1), end=now + timezone.timedelta(hours=1),
+                               personal_timer_duration=timezone.timedelta(hours=1))
+        models.trusted_save(window)
+
+        problems = []
+        for number in range(2):
+            problem = models.CtfProblem(name='{}-{}'.format(prefix, number), window=window, points=1,
+                                        grader='grader.py', description_raw='benchmark')
+            models.trusted_save(problem)
+            problems.append(problem)
+
+        competitors = []
+        for number in range(2 * count):
+            name = '{}-{}'.format(prefix, number)
+            user = get_user_model().objects.create(username=name)
+            team = models.Team(name=name[:30], passphrase=name[:30])
+            models.trusted_save(team)
+            competitor = models.Competitor(user=user, team=team, email=name + '@example.com',
+                                           first_name=name[:30], last_name=name[:30])
+            models.trusted_save(competitor)
+            competitors.append(competitor)
+        halves = (('save', lambda instance: instance.save(), competitors[:count]),
+                  ('trusted_save', models.trusted_save, competitors[count:]))
+
+        for way, save, half in halves:
+            self._measure('Timer.{}'.format(way), [
+                (lambda competitor=competitor: save(models.Timer(
+                    team=competitor.team, window=window,
+                    start=now, end=now + window.personal_timer_duration)))
+                for competitor in half
+            ])
+
+        for way, save, half in halves:
+            self._measure('Solve.{}'.format(way), [
+                (lambda competitor=competitor: save(models.Solve(
+                    problem=problems[0], competitor=competitor, flag='flag', date=now)))
+                for competitor in half
+            ])
+
+        for way, save, half in halves:
+            self._measure('Submission.{}'.format(way), [
+                (lambda competitor=competitor: save(models.Submission(
+                    p_id=problems[1].id, problem=problems[1], competitor=competitor, flag='flag', correct=False)))
+                for competitor in half
+            ])
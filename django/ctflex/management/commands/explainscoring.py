@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Sum
+
+from ctflex import diagnostics
+from ctflex import models
+from ctflex import queries
+from ctflex.management.commands import helpers
+
+
+class Command(BaseCommand):
+    help = ("Benchmark scoring queries with EXPLAIN ANALYZE, comparing filtering solves through "
+            "competitors and problems with filtering on the team, window and points copied onto solves.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('--team', '-t', type=int,
+                            help="ID of the team to query for (by default, the team with the most solves).")
+        parser.add_argument('--window', '-w',
+                            help="Codename of the window to query for (by default, the current window).")
+        parser.add_argument('--repeat', '-r', type=int, default=5,
+                            help="How many times to run each query (the median time is reported).")
+        parser.add_argument('--plans', '-p', action='store_true', default=False,
+                            help="Print each query’s full plan.")
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        if connection.vendor != 'postgresql':
+            raise CommandError("EXPLAIN output is only understood for PostgreSQL")
+
+        if options['window']:
+            try:
+                window = models.Window.objects.get(codename=options['window'])
+            except models.Window.DoesNotExist:
+                raise CommandError("No window named {!r}".format(options['window']))
+        else:
+            window = queries.get_window()
+
+        if options['team'] is not None:
+            team_id = options['team']
+        else:
+            busiest = (models.Solve.objects.values('team_id').annotate(solves=Count('id'))
+                       .order_by('-solves').first())
+            if busiest is None:
+                raise CommandError("There are no solves to query")
+            team_id = busiest['team_id']
+
+        timer = models.Timer.objects.filter(team_id=team_id, window=window).first()
+        start, end = (timer.start, timer.end) if timer is not None else (window.start, window.end)
+        problem_ids = list(window.ctfproblem_set.values_list('id', flat=True))
+        if not problem_ids:
+            raise CommandError("Window {} has no problems".format(window.codename))
+
+        self.stdout.write("Team #{}, window {}, {} solves in total".format(
+            team_id, window.codename, models.Solve.objects.count()))
+
+        for label, joined, denormalized in self._querysets(team_id, window, start, end, problem_ids):
+            for way, queryset in (('joined', joined), ('denormalized', denormalized)):
+                self._benchmark('{} ({})'.format(label, way), queryset, **options)
+
+    @staticmethod
+    def _querysets(team_id, window, start, end, problem_ids):
+        """Yield labels with equivalent querysets as before and after denormalizing"""
+
+        solves = models.Solve.objects.order_by()
+        by_join = solves.filter(competitor__team_id=team_id, problem__window=window)
+        by_copy = solves.filter(team_id=team_id, window=window)
+
+        yield ('solved',
+               solves.filter(competitor__team_id=team_id, problem_id=problem_ids[0]).values('id')[:1],
+               solves.filter(team_id=team_id, problem_id=problem_ids[0]).values('id')[:1])
+        yield ('score',
+               by_join.values('competitor__team_id').annotate(score=Sum('problem__points')),
+               by_copy.values('team_id').annotate(score=Sum('points')))
+        yield ('score in timer',
+               by_join.filter(date__gte=start, date__lte=end)
+               .values('competitor__team_id').annotate(score=Sum('problem__points')),
+               by_copy.filter(date__gte=start, date__lte=end)
+               .values('team_id').annotate(score=Sum('points')))
+        yield ('last solve in timer',
+               by_join.filter(date__gte=start, date__lte=end).order_by('-date').values('date')[:1],
+               by_copy.filter(date__gte=start, date__lte=end).order_by('-date').values('date')[:1])
+        yield ('unlock check',
+               solves.filter(competitor__team_id=team_id, problem_id__in=problem_ids)
+               .values('competitor__team_id').annotate(points=Sum('problem__points')),
+               solves.filter(team_id=team_id, problem_id__in=problem_ids)
+               .values('team_id').annotate(points=Sum('points')))
+        yield ('board',
+               solves.filter(problem__window=window)
+               .values('competitor__team_id').annotate(score=Sum('problem__points')),
+               solves.filter(window=window)
+               .values('team_id').annotate(score=Sum('points')))
+
+    def _benchmark(self, label, queryset, **options):
+        milliseconds, plan = diagnostics.measure(queryset, options['repeat'])
+        self.stdout.write("{:<36} {:>9.3f} ms  {}".format(
+            label, milliseconds, '; '.join(diagnostics.scan_nodes(plan))))
+
+        if options['plans']:
+            self.stdout.write(diagnostics.explain(queryset, format='TEXT'))
+            self.stdout.write('')
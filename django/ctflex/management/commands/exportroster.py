@@ -0,0 +1,153 @@
+import csv
+import json
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from ctflex import models
+from ctflex import queries
+from ctflex.management.commands import helpers
+
+# Columns that can be exported with the competitor fields they come from
+FIELD_COLUMNS = OrderedDict((
+    ('competitor_id', 'id'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('email', 'email'),
+    ('username', 'user__username'),
+    ('active', 'user__is_active'),
+    ('date_joined', 'user__date_joined'),
+    ('team_id', 'team_id'),
+    ('team_name', 'team__name'),
+    ('school', 'team__school'),
+    ('standing', 'team__standing'),
+    ('country', 'team__country'),
+    ('background', 'team__background'),
+))
+
+# Columns computed per team by `queries.with_standings` with the annotations they come from
+STANDING_COLUMNS = OrderedDict((
+    ('eligible', 'is_eligible'),
+    ('solves', 'solve_count'),
+    ('score', 'overall_score'),
+))
+
+DEFAULT_COLUMNS = ('competitor_id', 'first_name', 'last_name', 'email', 'team_id', 'team_name', 'school',
+                   'eligible', 'score')
+
+
+class Command(BaseCommand):
+    help = ("Export competitors with their users and teams, and optionally their teams’ eligibility, "
+            "solve counts and overall scores, as CSV or JSON lines. Competitors are read in chunks by "
+            "ID, so memory use does not grow with their number. Available columns: {}.".format(
+                ', '.join(list(FIELD_COLUMNS) + list(STANDING_COLUMNS))))
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('--columns', '-c', default=','.join(DEFAULT_COLUMNS),
+                            help="Comma-separated columns to export.")
+        parser.add_argument('--active', action='store_true', default=False,
+                            help="Include only competitors whose user is active.")
+        parser.add_argument('--teams', metavar='FILE',
+                            help="Include only teams named in this file (one name per line).")
+        parser.add_argument('--school', action='append', default=[],
+                            help="Include only teams whose school contains this, case-insensitively (repeatable).")
+        parser.add_argument('--standing', action='append', default=[],
+                            choices=[choice for choice, _ in models.Team.STANDING_CHOICES],
+                            help="Include only teams with this standing (repeatable).")
+        eligibility = parser.add_mutually_exclusive_group()
+        eligibility.add_argument('--eligible', action='store_const', const=True, dest='eligibility')
+        eligibility.add_argument('--ineligible', action='store_const', const=False, dest='eligibility')
+        parser.add_argument('--participated', action='store_true', default=False,
+                            help="Include only teams that solved some problem.")
+        parser.add_argument('--format', '-f', choices=('csv', 'jsonl'), default='csv')
+        parser.add_argument('--output', '-o', default='-',
+                            help="File to write to (by default, standard output).")
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help="How many competitors to read per query.")
+
+    @staticmethod
+    def _teams(options):
+        teams = models.Team.objects.all()
+        if options['teams']:
+            with open(options['teams']) as infile:
+                teams = teams.filter(name__in=[line.strip() for line in infile if line.strip()])
+        if options['school']:
+            school_q = Q()
+            for school in options['school']:
+                school_q |= Q(school__icontains=school)
+            teams = teams.filter(school_q)
+        if options['standing']:
+            teams = teams.filter(standing__in=options['standing'])
+        if options['eligibility'] is True:
+            teams = teams.filter(queries.eligible_q())
+        elif options['eligibility'] is False:
+            teams = teams.exclude(queries.eligible_q())
+        if options['participated']:
+            teams = teams.filter(queries.participated_q())
+        return teams
+
+    @staticmethod
+    def _chunks(competitors, fields, size):
+        """Yield lists of dictionaries of values of fields, reading competitors in order of ID"""
+        last_id = 0
+        while True:
+            rows = [dict(zip(fields, row)) for row in
+                    competitors.filter(id__gt=last_id).order_by('id').values_list(*fields)[:size]]
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1]['id']
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        columns = [column.strip() for column in options['columns'].split(',') if column.strip()]
+        unknown = [column for column in columns if column not in FIELD_COLUMNS and column not in STANDING_COLUMNS]
+        if unknown:
+            raise CommandError("Unknown columns: {}".format(', '.join(unknown)))
+
+        competitors = models.Competitor.objects.filter(team__in=self._teams(options))
+        if options['active']:
+            competitors = competitors.filter(user__is_active=True)
+
+        # (The ID is always read to chunk by it and the team ID to look up standings.)
+        fields = list(OrderedDict.fromkeys(
+            [FIELD_COLUMNS[column] for column in columns if column in FIELD_COLUMNS] + ['id', 'team_id']))
+        standing_columns = [column for column in columns if column in STANDING_COLUMNS]
+
+        outfile = self.stdout if options['output'] == '-' else open(options['output'], 'w', newline='')
+        try:
+            if options['format'] == 'csv':
+                writer = csv.writer(outfile, lineterminator='\n')
+                writer.writerow(columns)
+                write = writer.writerow
+            else:
+                write = lambda row: outfile.write(json.dumps(OrderedDict(zip(columns, row)), default=str) + '\n')
+
+            for rows in self._chunks(competitors, fields, options['chunk_size']):
+                standings = {}
+                if standing_columns:
+                    team_ids = {row['team_id'] for row in rows}
+                    teams = queries.with_standings(models.Team.objects.filter(id__in=team_ids))
+                    for team in teams.values('id', *(STANDING_COLUMNS[column] for column in standing_columns)):
+                        standings[team['id']] = team
+
+                for row in rows:
+                    standing = standings.get(row['team_id'], {})
+                    write([
+                        row[FIELD_COLUMNS[column]] if column in FIELD_COLUMNS
+                        else self._standing_value(column, standing)
+                        for column in columns
+                    ])
+        finally:
+            if outfile is not self.stdout:
+                outfile.close()
+
+    @staticmethod
+    def _standing_value(column, standing):
+        value = standing.get(STANDING_COLUMNS[column])
+        return int(value) if column == 'score' and value is not None else value
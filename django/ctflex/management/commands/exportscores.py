@@ -0,0 +1,135 @@
+import csv
+import json
+from collections import defaultdict
+from functools import reduce
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from ctflex import models
+from ctflex import queries
+from ctflex import settings
+from ctflex.management.commands import helpers
+
+TEAM_COLUMNS = ('team_id', 'team_name', 'school', 'standing', 'country', 'background', 'eligible')
+COMPETITOR_COLUMNS = ('competitor_id', 'first_name', 'last_name', 'email')
+
+
+class Command(BaseCommand):
+    help = ("Export the scores of teams and their competitors in every window, counting solves within "
+            "the team’s timer and all solves, along with normalized overall scores. Teams are "
+            "sorted by overall score within timers and each is followed by its competitors. "
+            "Teams are read and written in chunks, so memory use does not grow with their number.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('--school', action='append', default=[],
+                            help="Include only teams whose school contains this, case-insensitively (repeatable).")
+        parser.add_argument('--exclude-school', action='append', default=[],
+                            help="Exclude teams whose school contains this, case-insensitively (repeatable).")
+        parser.add_argument('--standing', action='append', default=[],
+                            choices=[choice for choice, _ in models.Team.STANDING_CHOICES],
+                            help="Include only teams with this standing (repeatable).")
+        eligibility = parser.add_mutually_exclusive_group()
+        eligibility.add_argument('--eligible', action='store_const', const=True, dest='eligibility')
+        eligibility.add_argument('--ineligible', action='store_const', const=False, dest='eligibility')
+        parser.add_argument('--participated', action='store_true', default=False,
+                            help="Include only teams that solved some problem.")
+        parser.add_argument('--teams-only', action='store_true', default=False,
+                            help="Leave out rows for competitors.")
+        parser.add_argument('--format', '-f', choices=('csv', 'jsonl'), default='csv')
+        parser.add_argument('--output', '-o', default='-',
+                            help="File to write to (by default, standard output).")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="How many teams to read per query.")
+
+    @staticmethod
+    def _teams(options):
+        teams = models.Team.objects.all()
+        if options['school']:
+            teams = teams.filter(reduce(
+                lambda q, school: q | Q(school__icontains=school), options['school'], Q()))
+        for school in options['exclude_school']:
+            teams = teams.exclude(school__icontains=school)
+        if options['standing']:
+            teams = teams.filter(standing__in=options['standing'])
+        if options['eligibility'] is True:
+            teams = teams.filter(queries.eligible_q())
+        elif options['eligibility'] is False:
+            teams = teams.exclude(queries.eligible_q())
+        if options['participated']:
+            teams = teams.filter(queries.participated_q())
+        return teams
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        windows_with_points = queries._windows_with_points()
+
+        def score_values(scores):
+            values = []
+            for window, _ in windows_with_points:
+                values.extend(scores.get(window.id, (0, 0)))
+            for index in (0, 1):
+                values.append(int(settings.SCORE_NORMALIZATION * sum(
+                    scores.get(window.id, (0, 0))[index] / (max_points or 1)
+                    for window, max_points in windows_with_points
+                )))
+            return values
+
+        score_columns = ['{}_{}'.format(window.codename, kind)
+                         for window, _ in windows_with_points for kind in ('in_timer', 'all_time')]
+        score_columns += ['overall_in_timer', 'overall_all_time']
+        columns = ('level',) + TEAM_COLUMNS + COMPETITOR_COLUMNS + tuple(score_columns)
+
+        # (Only the order of team IDs is read up front; teams, competitors and
+        #  scores are then read and written one chunk of teams at a time.)
+        team_ids = queries.team_ids_by_score_in_timer(self._teams(options))
+
+        outfile = self.stdout if options['output'] == '-' else open(options['output'], 'w', newline='')
+        try:
+            if options['format'] == 'csv':
+                writer = csv.writer(outfile, lineterminator='\n')
+                writer.writerow(columns)
+                write = writer.writerow
+            else:
+                write = lambda row: outfile.write(json.dumps(dict(zip(columns, row))) + '\n')
+
+            size = options['chunk_size']
+            for chunk in (team_ids[start:start + size] for start in range(0, len(team_ids), size)):
+                self._write_chunk(chunk, write, score_values, options['teams_only'])
+        finally:
+            if outfile is not self.stdout:
+                outfile.close()
+
+    @staticmethod
+    def _write_chunk(team_ids, write, score_values, teams_only):
+        """Write rows for some teams in the given order, each followed by its competitors"""
+
+        teams = models.Team.objects.in_bulk(team_ids)
+        matrix = queries.score_matrix(team_ids)
+        competitors = defaultdict(list)
+        if not teams_only:
+            for competitor in (models.Competitor.objects.filter(team_id__in=team_ids).order_by('team_id', 'id')
+                               .only('id', 'team_id', 'first_name', 'last_name', 'email').iterator()):
+                competitors[competitor.team_id].append(competitor)
+
+        # Sum competitors’ scores up into their teams’
+        competitor_scores = defaultdict(dict)
+        team_scores = defaultdict(lambda: defaultdict(lambda: (0, 0)))
+        for (team_id, competitor_id, window_id), (in_timer, all_time) in matrix.items():
+            competitor_scores[competitor_id][window_id] = (in_timer, all_time)
+            team_in_timer, team_all_time = team_scores[team_id][window_id]
+            team_scores[team_id][window_id] = (team_in_timer + in_timer, team_all_time + all_time)
+
+        for team_id in team_ids:
+            team = teams[team_id]
+            team_values = [team.id, team.name, team.school, team.standing, team.country, team.background,
+                           queries.eligible(team)]
+            write(['team'] + team_values + [None] * len(COMPETITOR_COLUMNS) + score_values(team_scores[team.id]))
+            for competitor in competitors[team.id]:
+                write(['competitor'] + team_values
+                      + [competitor.id, competitor.first_name, competitor.last_name, competitor.email]
+                      + score_values(competitor_scores[competitor.id]))
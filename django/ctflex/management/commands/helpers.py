@@ -1,5 +1,6 @@
 """Define common functionality and helpers for management commands"""
 
+import gzip
 import sys
 
 from IPython.core import ultratb
@@ -26,6 +27,13 @@ def debug_with_pdb(**options):
         sys.excepthook = ultratb.FormattedTB(mode='Verbose', color_scheme='Linux', call_pdb=1)
 
 
+def open_log(path):
+    """Open a (possibly gzipped) log file for reading text, replacing undecodable bytes"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
 # endregion
 
 
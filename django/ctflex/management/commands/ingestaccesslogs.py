@@ -0,0 +1,193 @@
+import csv
+import glob
+import io
+import os
+import re
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ctflex import models
+from ctflex import queries
+from ctflex.management.commands import helpers
+
+# Line formats by name as pairs of a regular expression and a `strptime` date format
+#
+# Expressions must have an `ip` group and may have `date` and `server` groups.
+# The legacy format is that of the logs `scripts/scanips.py` used to read.
+FORMATS = {
+    'combined': (r'^(?P<ip>\S+) \S+ \S+ \[(?P<date>[^\]]+)\]', '%d/%b/%Y:%H:%M:%S %z'),
+    'legacy': (r"^(?P<server>.+?) - \('(?P<ip>[^']+)'", None),
+}
+
+COLUMNS = ('ip', 'date', 'server', 'problem_id')
+
+# Format `--date` may always be given in
+DEFAULT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _parse_date(value, date_format):
+    """Parse `--date` in the logs’ date format or else in `DEFAULT_DATE_FORMAT`"""
+    formats = [format_ for format_ in (date_format, DEFAULT_DATE_FORMAT) if format_]
+    for format_ in formats:
+        try:
+            return datetime.strptime(value, format_)
+        except ValueError:
+            pass
+    raise CommandError("Could not parse --date {!r} as {}".format(value, ' or '.join(map(repr, formats))))
+
+
+class Command(BaseCommand):
+    help = ("Ingest problem servers’ access logs (including gzipped ones) into the ProblemAccess table in "
+            "batches with COPY, and optionally report which teams accessed a problem’s server before "
+            "solving it, matching accesses to teams by the IPs in the IP index.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('paths', nargs='*',
+                            help="Log files or glob patterns (e.g. 'logs/access.log*').")
+        parser.add_argument('--format', '-f', choices=sorted(FORMATS), default='combined',
+                            help="Line format of the logs.")
+        parser.add_argument('--pattern',
+                            help="Regular expression with an `ip` and optionally `date` and `server` group "
+                                 "to use instead of a predefined format.")
+        parser.add_argument('--date-format',
+                            help="`strptime` format of the `date` group (by default, that of the chosen format).")
+        parser.add_argument('--date',
+                            help="Date to record for lines without a `date` group, in the date format or as "
+                                 "'YYYY-MM-DD HH:MM:SS' (by default, the log file’s modification time).")
+        parser.add_argument('--server', '-s',
+                            help="Server name to record for lines without a `server` group.")
+        parser.add_argument('--map', action='append', default=[], metavar='server=problem',
+                            help="Name of the problem a server name belongs to (repeatable; by default, "
+                                 "servers are matched to problems with the same name, case-insensitively).")
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="How many lines to copy per statement.")
+        parser.add_argument('--report', '-r', metavar='FILE',
+                            help="CSV file to write accesses before solves to.")
+        parser.add_argument('--window', '-w',
+                            help="Codename of the window to restrict the report to.")
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        pattern, date_format = FORMATS[options['format']]
+        pattern = re.compile(options['pattern'] or pattern)
+        date_format = options['date_format'] or date_format
+        if 'ip' not in pattern.groupindex:
+            raise CommandError("The pattern must have an `ip` group")
+        if 'server' not in pattern.groupindex and not options['server']:
+            raise CommandError("Specify --server for lines without a `server` group")
+
+        paths = sorted({path for pattern_ in options['paths'] for path in glob.glob(pattern_)})
+        if options['paths'] and not paths:
+            raise CommandError("No log files matched")
+
+        self._problems = {problem.name.lower(): problem.id
+                          for problem in models.CtfProblem.objects.only('id', 'name')}
+        self._mapping = {}
+        for pair in options['map']:
+            server, _, problem = pair.partition('=')
+            if problem.lower() not in self._problems:
+                raise CommandError("No problem named {!r}".format(problem))
+            self._mapping[server] = self._problems[problem.lower()]
+        self._unmatched = set()
+
+        default_date = _parse_date(options['date'], date_format) if options['date'] else None
+
+        for path in paths:
+            with transaction.atomic():
+                lines, unparsed = self._ingest(path, regex=pattern, strptime_format=date_format,
+                                               default_date=default_date, **options)
+            self.stdout.write("Ingested {} lines from {} ({} unparsed)".format(lines - unparsed, path, unparsed))
+
+        if self._unmatched:
+            self.stdout.write("Servers not matched to a problem: {}".format(', '.join(sorted(self._unmatched))))
+
+        if options['report']:
+            self._report(**options)
+
+    def _problem_id(self, server):
+        if server in self._mapping:
+            return self._mapping[server]
+        problem_id = self._problems.get(server.lower())
+        if problem_id is None:
+            self._unmatched.add(server)
+        self._mapping[server] = problem_id
+        return problem_id
+
+    def _ingest(self, path, *, regex, strptime_format, default_date, **options):
+        """Copy the accesses in one log file, returning the number of lines read and not parsed"""
+
+        if default_date is None:
+            default_date = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+
+        lines = unparsed = copied = 0
+        batch = io.StringIO()
+        writer = csv.writer(batch)
+
+        with helpers.open_log(path) as infile, connection.cursor() as cursor:
+
+            def flush():
+                batch.seek(0)
+                cursor.copy_expert('COPY ctflex_problemaccess ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                    ', '.join(COLUMNS)), batch)
+                batch.seek(0)
+                batch.truncate()
+
+            for line in infile:
+                lines += 1
+                match = regex.search(line)
+                if match is None:
+                    unparsed += 1
+                    continue
+                fields = match.groupdict()
+
+                try:
+                    date = (datetime.strptime(fields['date'], strptime_format)
+                            if fields.get('date') and strptime_format else default_date)
+                except ValueError:
+                    unparsed += 1
+                    continue
+                if timezone.is_naive(date):
+                    date = timezone.make_aware(date)
+
+                server = (fields.get('server') or options['server'])[:100]
+                problem_id = self._problem_id(server)
+                writer.writerow((fields['ip'][:45], date.isoformat(), server,
+                                 problem_id if problem_id is not None else ''))
+
+                copied += 1
+                if copied % options['batch_size'] == 0:
+                    flush()
+            flush()
+
+        return lines, unparsed
+
+    def _report(self, **options):
+        window = None
+        if options['window']:
+            try:
+                window = models.Window.objects.get(codename=options['window'])
+            except models.Window.DoesNotExist:
+                raise CommandError("No window named {!r}".format(options['window']))
+
+        rows = queries.accesses_before_solves(window=window)
+        team_names = dict(models.Team.objects.filter(id__in={row[0] for row in rows}).values_list('id', 'name'))
+        problem_names = dict(models.CtfProblem.objects.values_list('id', 'name'))
+
+        with open(options['report'], 'w', newline='') as outfile:
+            writer = csv.writer(outfile, lineterminator='\n')
+            writer.writerow(('team_id', 'team_name', 'problem', 'solved_at', 'first_access', 'accesses'))
+            for team_id, problem_id, solved_at, first_access, accesses in rows:
+                writer.writerow((team_id, team_names.get(team_id), problem_names.get(problem_id),
+                                 solved_at.isoformat(), first_access.isoformat() if first_access else '',
+                                 accesses))
+
+        without = sum(1 for row in rows if not row[4])
+        self.stdout.write("Wrote {} solves to {} ({} without any access from the team’s IPs beforehand)".format(
+            len(rows), options['report'], without))
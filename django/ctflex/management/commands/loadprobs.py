@@ -14,6 +14,7 @@ from django.db import transaction
 import yaml
 import yaml.parser
 
+from ctflex import caches
 from ctflex import constants
 from ctflex import settings
 from ctflex.management.commands import helpers
@@ -288,6 +289,11 @@ class Command(BaseCommand):
             # Delete unprocessed problems
             self.delete_unprocessed(options)
 
+            # Make teams’ cached problem lists and the catalog be reloaded
+            # (Saving problems already does so, but deleting in bulk does not.)
+            caches.invalidate_problems()
+            caches.invalidate_catalog()
+
         except Exception as err:
             self.stderr.write("Unforeseen exception encountered while saving problems; rolled back transaction")
             raise CommandError(err)
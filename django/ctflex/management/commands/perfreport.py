@@ -0,0 +1,79 @@
+import glob
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ctflex import settings
+from ctflex.management.commands import helpers
+
+PERCENTILES = (50, 95, 99)
+
+
+def _percentile(buckets, counts, percentile):
+    """Return the upper bound of the bucket containing a percentile, in milliseconds"""
+    threshold = sum(counts) * percentile / 100
+    seen = 0
+    for bound, count in zip(buckets, counts):
+        seen += count
+        if seen >= threshold:
+            return '≤{}'.format(bound)
+    return '>{}'.format(buckets[-1])
+
+
+class Command(BaseCommand):
+    help = ("Summarize the per-view latency histograms that PerformanceMiddleware "
+            "dumped from all processes.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('directory', nargs='?', default=None,
+                            help="Directory histograms were dumped to (defaults to CTFLEX_PERF_DUMP_DIR).")
+        parser.add_argument('--sort', '-s', choices=('count', 'mean', 'total'), default='total',
+                            help="What to sort views by.")
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        directory = options['directory'] or settings.PERF_DUMP_DIR
+        if not directory:
+            raise CommandError("No directory given and CTFLEX_PERF_DUMP_DIR is not set")
+        paths = glob.glob(os.path.join(directory, '*.json'))
+        if not paths:
+            raise CommandError("No histograms found in {}".format(directory))
+
+        # Merge histograms from all processes
+        buckets = None
+        views = {}
+        for path in paths:
+            with open(path) as infile:
+                data = json.load(infile)
+            if buckets is None:
+                buckets = data['buckets']
+            elif data['buckets'] != buckets:
+                self.stderr.write("Skipping {} as its buckets differ".format(path))
+                continue
+
+            for view, histogram in data['views'].items():
+                merged = views.setdefault(view, {'counts': [0] * len(histogram['counts']), 'sum': 0.0})
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+                merged['sum'] += histogram['sum']
+
+        # Print a table
+        rows = []
+        for view, histogram in views.items():
+            count = sum(histogram['counts'])
+            if count:
+                rows.append((view, count, histogram['sum'] / count, histogram['sum'], histogram['counts']))
+        sort_index = {'count': 1, 'mean': 2, 'total': 3}[options['sort']]
+        rows.sort(key=lambda row: row[sort_index], reverse=True)
+
+        write = self.stdout.write
+        write("{:<40} {:>8} {:>10} {:>12} ".format('view', 'count', 'mean ms', 'total ms')
+              + ' '.join('{:>8}'.format('p{}'.format(percentile)) for percentile in PERCENTILES))
+        for view, count, mean, total, counts in rows:
+            write("{:<40} {:>8} {:>10.1f} {:>12.0f} ".format(view, count, mean, total)
+                  + ' '.join('{:>8}'.format(_percentile(buckets, counts, percentile))
+                             for percentile in PERCENTILES))
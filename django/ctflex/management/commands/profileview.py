@@ -0,0 +1,229 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import NoReverseMatch, reverse
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+
+from ctflex import correlation
+from ctflex import diagnostics
+from ctflex import events
+from ctflex import models
+from ctflex.management.commands import helpers
+
+
+class _Rollback(Exception):
+    """Roll back everything the profiled requests did"""
+
+
+class _DiscardingBuffer(correlation.ObservationBuffer):
+    """Aggregate IP observations like the real buffer but never write them"""
+
+    def _write(self, observations):
+        pass
+
+
+@contextmanager
+def _isolated():
+    """Keep profiled requests’ side effects outside the database away from real users
+
+    The database is rolled back separately. Within this context, the cache is
+    a throwaway in-memory one, events only reach listeners in this process and
+    IP observations are dropped.
+    """
+    broker, buffer = events._broker, correlation.buffer
+    events._broker, correlation.buffer = events.LocalBroker(), _DiscardingBuffer()
+    try:
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ctflex-profileview',
+        }}):
+            yield
+    finally:
+        events._broker, correlation.buffer = broker, buffer
+
+
+class Sampler:
+    """Sample the stack of a thread at an interval and count collapsed stacks
+
+    Collapsed stacks are lines of semicolon-separated frames followed by a
+    count, as read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ctflex-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def cumulative(self):
+        """Return a Counter of how many samples each function appears in"""
+        counts = Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack.split(';')):
+                counts[function] += count
+        return counts
+
+
+class Command(BaseCommand):
+    help = ("Profile a view in-process by requesting it repeatedly as some user. "
+            "Writes collapsed stacks for flamegraphs (with the sampling profiler) or pstats "
+            "(with cProfile), prints the functions with the most cumulative time and "
+            "reports query counts. Database changes made by the requests are rolled back; "
+            "meanwhile, the cache is replaced by an empty in-memory one, events are not "
+            "published to other processes and IP observations are dropped. Anything else "
+            "the view does outside the database, like sending email directly, is not undone.")
+
+    def add_arguments(self, parser):
+        helpers.add_debug_argument(parser)
+
+        parser.add_argument('url_name',
+                            help="Name of the URL to profile, like 'ctflex:game' or 'ctflex:api:submit_flag'.")
+        parser.add_argument('url_kwargs', nargs='*', metavar='key=value',
+                            help="Keyword arguments for reversing the URL.")
+        parser.add_argument('--user', '-u',
+                            help="Username to make requests as (by default, a throwaway competitor is created).")
+        parser.add_argument('--method', '-m', choices=('GET', 'POST'), default='GET')
+        parser.add_argument('--data', action='append', default=[], metavar='key=value',
+                            help="Form data to send (repeatable).")
+        parser.add_argument('--iterations', '-n', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=1,
+                            help="Requests to make before profiling (to fill caches).")
+        parser.add_argument('--profiler', '-p', choices=('sample', 'cprofile'), default='sample')
+        parser.add_argument('--interval', type=float, default=0.001,
+                            help="Seconds between samples for the sampling profiler.")
+        parser.add_argument('--output-dir', '-o', default='.',
+                            help="Directory to write profiles to.")
+        parser.add_argument('--top', type=int, default=30,
+                            help="How many functions to print.")
+
+    @staticmethod
+    def _pairs(items):
+        try:
+            return dict(item.split('=', 1) for item in items)
+        except ValueError:
+            raise CommandError("Expected key=value pairs but got {}".format(items))
+
+    @staticmethod
+    def _synthetic_user():
+        name = 'profile-' + uuid.uuid4().hex[:8]
+        user = get_user_model().objects.create_user(name, password=name)
+        team = models.Team.objects.create(name=name, passphrase=name)
+        models.Competitor.objects.create(user=user, team=team, email=name + '@example.com',
+                                         first_name=name, last_name=name)
+        return user
+
+    def handle(self, *args, **options):
+
+        helpers.debug_with_pdb(**options)
+
+        try:
+            path = reverse(options['url_name'], kwargs=self._pairs(options['url_kwargs']))
+        except NoReverseMatch as err:
+            raise CommandError(str(err))
+        data = self._pairs(options['data'])
+        os.makedirs(options['output_dir'], exist_ok=True)
+        basename = os.path.join(options['output_dir'], options['url_name'].replace(':', '.'))
+
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']), _isolated():
+                if options['user']:
+                    try:
+                        user = get_user_model().objects.get(username=options['user'])
+                    except get_user_model().DoesNotExist:
+                        raise CommandError("No user named {!r}".format(options['user']))
+                else:
+                    user = self._synthetic_user()
+
+                client = Client()
+                client.force_login(user)
+                request = client.post if options['method'] == 'POST' else client.get
+
+                for _ in range(options['warmup']):
+                    request(path, data)
+
+                self._profile(lambda: request(path, data), basename, **options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _profile(self, make_request, basename, **options):
+        write = self.stdout.write
+        iterations = options['iterations']
+        statuses = Counter()
+
+        with diagnostics.diagnose_queries(options['url_name']) as queries:
+            start = time.perf_counter()
+
+            if options['profiler'] == 'sample':
+                with Sampler(threading.get_ident(), options['interval']) as sampler:
+                    for _ in range(iterations):
+                        statuses[make_request().status_code] += 1
+            else:
+                profile = cProfile.Profile()
+                for _ in range(iterations):
+                    profile.enable()
+                    statuses[make_request().status_code] += 1
+                    profile.disable()
+
+            elapsed = time.perf_counter() - start
+
+        write("{} requests in {:.2f} s ({:.1f} ms each); status codes: {}".format(
+            iterations, elapsed, elapsed / iterations * 1000, dict(statuses)))
+        write("{:.1f} queries per request taking {:.1f} ms".format(
+            sum(queries.shapes.values()) / iterations,
+            sum(queries.durations.values()) / iterations * 1000))
+        write("Most frequent queries per request:")
+        for shape, count in queries.shapes.most_common(10):
+            write("  {:>6.1f}  {}".format(count / iterations, shape[:150]))
+
+        if options['profiler'] == 'sample':
+            path = basename + '.collapsed'
+            with open(path, 'w') as outfile:
+                for stack, count in sampler.stacks.most_common():
+                    outfile.write('{} {}\n'.format(stack, count))
+            write("Wrote collapsed stacks to {}".format(path))
+
+            total = sum(sampler.stacks.values()) or 1
+            write("Functions by share of samples:")
+            for function, count in sampler.cumulative().most_common(options['top']):
+                write("  {:>5.1f}%  {}".format(count / total * 100, function))
+        else:
+            path = basename + '.pstats'
+            profile.dump_stats(path)
+            write("Wrote profile to {}".format(path))
+            stats = io.StringIO()
+            pstats.Stats(profile, stream=stats).sort_stats('cumulative').print_stats(options['top'])
+            write(stats.getvalue())
@@ -0,0 +1,264 @@
+"""Define a registry of operational metrics aggregated across processes
+
+Each process keeps its own values and, at most every
+`CTFLEX_METRICS_DUMP_INTERVAL` seconds, writes them to
+`<CTFLEX_METRICS_SPOOL_DIR>/<pid>.json`. `collect` merges the files of all
+processes and `render` formats the result in Prometheus’ text format for
+`views.metrics_text`.
+
+Limitations:
+    - Files of exited processes keep being included until the spool directory
+      is cleared. That keeps counters from decreasing, but gauges of exited
+      processes linger too.
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ctflex import constants
+from ctflex import settings
+
+logger = logging.getLogger(constants.BASE_LOGGER_NAME + '.' + __name__)
+
+_lock = threading.Lock()
+_registry = OrderedDict()
+_dumped_at = time.monotonic()
+
+
+# region Metric Types
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        if name in _registry:
+            raise ValueError("A metric named {!r} already exists".format(name))
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry[name] = self
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("Metric {!r} takes labels {}".format(self.name, self.labelnames))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        """Return a list of pairs of label values and values (the caller must hold the lock)"""
+        return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _maybe_dump()
+
+
+class Gauge(_Metric):
+    """Hold a value that can go up and down
+
+    Values from different processes are added up unless `aggregate` is 'max'.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), *, aggregate='sum'):
+        super().__init__(name, documentation, labelnames)
+        if aggregate == 'max':
+            self.merge = max
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+        _maybe_dump()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _maybe_dump()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    # Upper bounds of buckets in seconds (an unbounded bucket is implicit)
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), *, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(self.buckets)
+            histogram['counts'][index] += 1
+            histogram['sum'] += value
+        _maybe_dump()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes to run"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        return [[list(key), {'counts': list(value['counts']), 'sum': value['sum']}]
+                for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(a, b):
+        return {'counts': [x + y for x, y in zip(a['counts'], b['counts'])], 'sum': a['sum'] + b['sum']}
+
+
+# endregion
+
+
+# region Aggregation
+
+def _snapshot():
+    with _lock:
+        return {name: metric.snapshot() for name, metric in _registry.items()}
+
+
+def dump():
+    """Write this process’s values to the spool directory"""
+    global _dumped_at
+    _dumped_at = time.monotonic()
+
+    directory = settings.METRICS_SPOOL_DIR
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '{}.json'.format(os.getpid()))
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as outfile:
+        json.dump(_snapshot(), outfile)
+    os.replace(temporary, path)
+
+
+def _maybe_dump():
+    if time.monotonic() - _dumped_at < settings.METRICS_DUMP_INTERVAL:
+        return
+    try:
+        dump()
+    except Exception:
+        logger.error("could not dump metrics", exc_info=True)
+
+
+atexit.register(_maybe_dump)
+
+
+def collect():
+    """Return the values of all metrics merged across processes
+
+    The result maps metric names to dictionaries mapping tuples of label
+    values to values.
+    """
+
+    if settings.METRICS_SPOOL_DIR:
+        dump()
+        snapshots = []
+        for path in glob.glob(os.path.join(settings.METRICS_SPOOL_DIR, '*.json')):
+            try:
+                with open(path) as infile:
+                    snapshots.append(json.load(infile))
+            except (OSError, ValueError):
+                logger.warning("could not read metrics from {}".format(path), exc_info=True)
+    else:
+        snapshots = [_snapshot()]
+
+    merged = OrderedDict((name, {}) for name in _registry)
+    for snapshot in snapshots:
+        for name, values in snapshot.items():
+            metric = _registry.get(name)
+            if metric is None:
+                continue
+            for key, value in values:
+                key = tuple(key)
+                current = merged[name].get(key)
+                merged[name][key] = value if current is None else metric.merge(current, value)
+    return merged
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + '}'
+
+
+def render(merged):
+    """Return merged values in Prometheus’ text exposition format"""
+    lines = []
+    for name, values in merged.items():
+        metric = _registry[name]
+        lines.append('# HELP {} {}'.format(name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(name, metric.type))
+
+        for key, value in sorted(values.items()):
+            if metric.type != 'histogram':
+                lines.append('{}{} {}'.format(name, _format_labels(metric.labelnames, key), value))
+                continue
+
+            cumulative = 0
+            bounds = [str(bound) for bound in metric.buckets] + ['+Inf']
+            for bound, count in zip(bounds, value['counts']):
+                cumulative += count
+                labels = _format_labels(metric.labelnames, key, [('le', bound)])
+                lines.append('{}_bucket{} {}'.format(name, labels, cumulative))
+            labels = _format_labels(metric.labelnames, key)
+            lines.append('{}_sum{} {}'.format(name, labels, value['sum']))
+            lines.append('{}_count{} {}'.format(name, labels, cumulative))
+
+    return '\n'.join(lines) + '\n'
+
+
+# endregion
+
+
+# region Metrics
+
+submissions = Counter('ctflex_submissions_total', "Flag submissions by result", ('result',))
+grade_seconds = Histogram('ctflex_grade_seconds', "Time taken to grade a flag")
+board_compute_seconds = Histogram('ctflex_board_compute_seconds', "Time taken to recompute a scoreboard",
+                                  buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60))
+board_cache = Counter('ctflex_board_cache_total', "Scoreboard cache lookups by result", ('result',))
+timer_cache = Counter('ctflex_timer_cache_total', "Timer cache lookups by result", ('result',))
+timer_starts = Counter('ctflex_timer_starts_total', "Attempts to start a timer by result", ('result',))
+announcement_polls = Counter('ctflex_announcement_polls_total', "Unread announcement polls by response",
+                             ('response',))
+
+# endregion
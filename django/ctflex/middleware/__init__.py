@@ -1,12 +1,19 @@
 """Define middleware"""
 
 import logging
+import random
+import time
 from importlib import import_module
 
+from django.core.exceptions import MiddlewareNotUsed
 from ratelimit.exceptions import Ratelimited
 
 from ctflex.middleware.utils import browsers
 from ctflex import constants
+from ctflex import correlation
+from ctflex import diagnostics
+from ctflex import instrumentation
+from ctflex import queries
 from ctflex import settings
 from ctflex import views
 from ctflex import loggers
@@ -87,7 +94,123 @@ class CloudflareRemoteAddrMiddleware:
             request.META[REMOTE_ADDR] = request.META.get(HTTP_CF_CONNECTING_IP, '')
 
 
+class RequestStateMiddleware:
+    """Attach a lazily-loaded `queries.RequestState` to each request
+
+    This middleware must come after Django’s `AuthenticationMiddleware`.
+    """
+
+    def process_request(self, request):
+        setattr(request, queries.REQUEST_STATE_ATTR, queries.RequestState(request))
+
+
 class RequestLoggingMiddleware:
     def process_response(self, request, response):
         loggers.log_request(request, response)
         return response
+
+
+class PerformanceMiddleware:
+    """Time queries, template rendering, cache calls and views of sampled requests
+
+    Purpose:
+        Timings are added as a `Server-Timing` header (for staff or if DEBUG
+        is on) and recorded in per-view latency histograms, which are dumped
+        to `CTFLEX_PERF_DUMP_DIR` for `manage.py perfreport`.
+
+    Usage:
+        Put this middleware first so that its timings cover other middleware,
+        and set `CTFLEX_PERF_SAMPLE_RATE` to the fraction of requests to time.
+    """
+
+    TIMINGS_ATTR = '_ctflex_timings'
+
+    def process_request(self, request):
+        if random.random() >= settings.PERF_SAMPLE_RATE:
+            return
+        timings = instrumentation.RequestTimings()
+        setattr(request, self.TIMINGS_ATTR, timings)
+        instrumentation.add_observer(timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = getattr(request, self.TIMINGS_ATTR, None)
+        if timings is not None:
+            timings.start_view()
+
+    def process_exception(self, request, exception):
+        # (Response middleware is skipped if rendering the error fails too,
+        #  which would leave the observer attached to the thread for later requests.)
+        timings = getattr(request, self.TIMINGS_ATTR, None)
+        if timings is not None:
+            instrumentation.remove_observer(timings)
+
+    def process_response(self, request, response):
+        timings = getattr(request, self.TIMINGS_ATTR, None)
+        if timings is None:
+            return response
+
+        instrumentation.remove_observer(timings)
+        timings.finish()
+
+        try:
+            match = request.resolver_match
+            view = match.view_name if match is not None else '<unresolved>'
+            instrumentation.histograms.record(view, timings.total)
+
+            user = getattr(request, 'user', None)
+            if settings.DEBUG or (user is not None and user.is_staff):
+                response['Server-Timing'] = timings.server_timing()
+
+            histograms = instrumentation.histograms
+            if (settings.PERF_DUMP_DIR
+                    and time.monotonic() - histograms.dumped_at >= settings.PERF_DUMP_INTERVAL):
+                histograms.dump(settings.PERF_DUMP_DIR)
+        except Exception:
+            logger.error("could not record timings", exc_info=True)
+
+        return response
+
+
+class IpIndexMiddleware:
+    """Feed competitors’ IPs and browsers into the index in `ctflex.correlation`
+
+    Only requests that already loaded the competitor are indexed (see
+    `correlation.observe`), so this never adds queries to a request.
+
+    This middleware must come after `CloudflareRemoteAddrMiddleware` and
+    `RequestStateMiddleware`.
+    """
+
+    def process_response(self, request, response):
+        try:
+            correlation.observe(request)
+        except Exception:
+            logger.error("could not index request", exc_info=True)
+        return response
+
+
+class QueryDiagnosticsMiddleware:
+    """Log slow and repeated queries per view with `ctflex.diagnostics`
+
+    Unless `CTFLEX_QUERY_DIAGNOSTICS` is set, this middleware removes itself
+    when the server starts, so it costs nothing.
+    """
+
+    DIAGNOSTICS_ATTR = '_ctflex_query_diagnostics'
+
+    def __init__(self):
+        if not settings.QUERY_DIAGNOSTICS:
+            raise MiddlewareNotUsed()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        observer = diagnostics.QueryDiagnostics(match.view_name if match is not None else request.path)
+        setattr(request, self.DIAGNOSTICS_ATTR, observer)
+        instrumentation.add_observer(observer)
+
+    def process_response(self, request, response):
+        observer = getattr(request, self.DIAGNOSTICS_ATTR, None)
+        if observer is not None:
+            instrumentation.remove_observer(observer)
+            observer.report()
+        return response
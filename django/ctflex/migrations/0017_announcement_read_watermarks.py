@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Min
+from django.utils import timezone
+
+
+def unread_to_watermarks(apps, schema_editor):
+    """Set each competitor’s watermark to just before their oldest unread announcement"""
+    Competitor = apps.get_model('ctflex', 'Competitor')
+    oldest_unread_dates = (Competitor.objects
+                           .annotate(oldest_unread=Min('unread_announcements__date'))
+                           .filter(oldest_unread__isnull=False)
+                           .values_list('id', 'oldest_unread'))
+    for id, oldest_unread in oldest_unread_dates:
+        (Competitor.objects
+         .filter(id=id)
+         .update(announcements_read_at=oldest_unread - timezone.timedelta(microseconds=1)))
+
+
+def watermarks_to_unread(apps, schema_editor):
+    Announcement = apps.get_model('ctflex', 'Announcement')
+    Competitor = apps.get_model('ctflex', 'Competitor')
+    for announcement in Announcement.objects.all():
+        announcement.competitors.add(*Competitor.objects.filter(announcements_read_at__lt=announcement.date))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ctflex', '0016_remove_team_banned'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='competitor',
+            name='announcements_read_at',
+            field=models.DateTimeField(default=timezone.now, editable=False),
+        ),
+        migrations.RunPython(unread_to_watermarks, watermarks_to_unread),
+        migrations.RemoveField(
+            model_name='announcement',
+            name='competitors',
+        ),
+        migrations.AlterIndexTogether(
+            name='announcement',
+            index_together=set([('window', 'date')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ctflex', '0017_announcement_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IpObservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip', models.CharField(max_length=45)),
+                ('browser', models.CharField(max_length=50)),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('competitor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ctflex.Competitor')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ctflex.Team')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='ipobservation',
+            unique_together=set([('ip', 'competitor', 'browser')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='ipobservation',
+            index_together=set([('ip', 'team')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Enforce in the database invariants that `trusted_save` skips validating"""
+
+    dependencies = [
+        ('ctflex', '0018_ipobservation'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'ALTER TABLE ctflex_window ADD CONSTRAINT ctflex_window_start_before_end CHECK (start < "end")',
+            'ALTER TABLE ctflex_window DROP CONSTRAINT ctflex_window_start_before_end',
+        ),
+        migrations.RunSQL(
+            'ALTER TABLE ctflex_timer ADD CONSTRAINT ctflex_timer_start_not_after_end CHECK (start <= "end")',
+            'ALTER TABLE ctflex_timer DROP CONSTRAINT ctflex_timer_start_not_after_end',
+        ),
+        migrations.RunSQL(
+            "ALTER TABLE ctflex_team ADD CONSTRAINT ctflex_team_standing_valid CHECK (standing IN ('G', 'D', 'I'))",
+            'ALTER TABLE ctflex_team DROP CONSTRAINT ctflex_team_standing_valid',
+        ),
+    ]
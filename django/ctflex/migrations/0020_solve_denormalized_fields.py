@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """Copy team, window and points onto solves
+
+    Teams that solved a problem more than once (e.g. by two members at once)
+    keep only their earliest solve of it, as the next migration makes
+    (problem, team) unique.
+
+    The fields are made required in the next migration, since Postgres cannot
+    alter a table with pending deferred foreign key checks from the backfill.
+    """
+
+    dependencies = [
+        ('ctflex', '0019_check_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solve',
+            name='team',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='ctflex.Team'),
+        ),
+        migrations.AddField(
+            model_name='solve',
+            name='window',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='ctflex.Window'),
+        ),
+        migrations.AddField(
+            model_name='solve',
+            name='points',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            '''
+            UPDATE ctflex_solve AS solve
+            SET team_id = competitor.team_id, window_id = problem.window_id, points = problem.points
+            FROM ctflex_competitor AS competitor, ctflex_ctfproblem AS problem
+            WHERE competitor.id = solve.competitor_id AND problem.id = solve.problem_id
+            ''',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            '''
+            DELETE FROM ctflex_solve AS solve
+            USING ctflex_solve AS earlier
+            WHERE earlier.problem_id = solve.problem_id AND earlier.team_id = solve.team_id
+                AND (earlier.date, earlier.id) < (solve.date, solve.id)
+            ''',
+            migrations.RunSQL.noop,
+        ),
+    ]
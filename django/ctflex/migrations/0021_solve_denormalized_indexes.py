@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """Require the copied solve fields and index them for scoring"""
+
+    dependencies = [
+        ('ctflex', '0020_solve_denormalized_fields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='solve',
+            name='team',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='ctflex.Team'),
+        ),
+        migrations.AlterField(
+            model_name='solve',
+            name='window',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='ctflex.Window'),
+        ),
+        migrations.AlterField(
+            model_name='solve',
+            name='points',
+            field=models.IntegerField(editable=False),
+        ),
+        migrations.AlterUniqueTogether(
+            name='solve',
+            unique_together=set([('problem', 'competitor'), ('problem', 'team')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='solve',
+            index_together=set([('team', 'window', 'date'), ('window', 'date')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Index submissions for the repeated-flag check and for browsing by date"""
+
+    dependencies = [
+        ('ctflex', '0021_solve_denormalized_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='submission',
+            index_together=set([('problem', 'flag')]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ctflex', '0022_submission_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip', models.CharField(max_length=45)),
+                ('date', models.DateTimeField()),
+                ('server', models.CharField(max_length=100)),
+                ('problem', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ctflex.CtfProblem')),
+            ],
+            options={
+                'verbose_name_plural': 'problem accesses',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='problemaccess',
+            index_together=set([('problem', 'ip', 'date'), ('ip', 'date')]),
+        ),
+    ]
@@ -6,9 +6,11 @@ Such a separation exists to avoid circular imports.
 import logging
 
 from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import m2m_changed, post_delete, post_save
 
 from ctflex.models.models import *
 
+from ctflex import caches
 from ctflex import signals
 from ctflex import loggers
 from ctflex.constants import BASE_LOGGER_NAME
@@ -17,3 +19,15 @@ logger = logging.getLogger(BASE_LOGGER_NAME + '.' + __name__)
 
 signals.unique_connect(user_logged_in, loggers.log_login)
 signals.unique_connect(user_logged_out, loggers.log_logout)
+
+for signal in (post_save, post_delete):
+    signals.unique_connect(signal, caches.solve_changed_handler, sender=Solve)
+    signals.unique_connect(signal, caches.window_changed_handler, sender=Window)
+    signals.unique_connect(signal, caches.problem_changed_handler, sender=CtfProblem)
+    signals.unique_connect(signal, caches.announcement_changed_handler, sender=Announcement)
+signals.unique_connect(post_save, caches.competitor_saved_handler, sender=Competitor)
+signals.unique_connect(post_save, caches.timer_saved_handler, sender=Timer)
+signals.unique_connect(post_delete, caches.timer_deleted_handler, sender=Timer)
+signals.unique_connect(m2m_changed, caches.announcement_problems_changed_handler,
+                       sender=Announcement.problems.through)
+
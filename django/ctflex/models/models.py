@@ -13,6 +13,8 @@ from django.contrib.staticfiles.templatetags.staticfiles import static
 from django.core import validators
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import ExpressionWrapper, F, Value
+from django.db.models.functions import Least
 from django.db.models.signals import post_save, pre_save
 from django.utils import timezone
 from django.utils.functional import cached_property
@@ -102,6 +104,34 @@ def cleaned(cls):
     return cls
 
 
+# (Attribute set on instances being saved by `trusted_save`)
+TRUSTED_SAVE_ATTR = '_ctflex_trusted_save'
+
+
+def trusted_save(instance, **kwargs):
+    """Save an instance without running `full_clean` first
+
+    Purpose:
+        `pre_save_validate_handler` full cleans every save, which in hot write
+        paths runs queries that the caller has made redundant (like checking
+        for a duplicate solve right after checking for one).
+
+    Usage:
+        Only call this from internal code that sets every field cleaners would
+        otherwise sync (like dates and timer ends) and that has established the
+        invariants validators would check. The database still enforces unique
+        and check constraints, so be ready to handle an `IntegrityError`.
+        Forms and the admin MUST keep using plain `save()`.
+
+        Keyword arguments are passed on to `save()`.
+    """
+    setattr(instance, TRUSTED_SAVE_ATTR, True)
+    try:
+        instance.save(**kwargs)
+    finally:
+        delattr(instance, TRUSTED_SAVE_ATTR)
+
+
 # Validator for restricting a field to word characters
 word_characters = validators.RegexValidator(
     regex=r'^\w*$',
@@ -221,6 +251,9 @@ class Competitor(models.Model):
 
     created_at = models.DateTimeField(default=timezone.now, editable=False)
     email = models.EmailField(unique=True)
+
+    # Announcements dated after this are unread
+    announcements_read_at = models.DateTimeField(default=timezone.now, editable=False)
     first_name = models.CharField(max_length=30)
     last_name = models.CharField(max_length=30)
 
@@ -285,6 +318,20 @@ class Competitor(models.Model):
         validate_team_has_space,
     )
 
+    ''' Change Tracking '''
+
+    # (Value of `team_id` as loaded from the database)
+    _loaded_team_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_team_id = instance.__dict__.get('team_id')
+        return instance
+
+    def team_changed(self):
+        return self._loaded_team_id is None or self._loaded_team_id != self.team_id
+
 
 @unique_receiver(post_save, sender=Competitor)
 def competitor_post_save_sync_to_user_handler(sender, instance, **kwargs):
@@ -341,8 +388,13 @@ class Window(models.Model):
 
     ''' Properties '''
 
+    # (`ctflex.caches.Catalog` sets this on the windows it loads to save a query.)
+    _number = None
+
     def number(self):
-        return Window.objects.filter(start__lt=self.start).count() + 1
+        if self._number is None:
+            self._number = Window.objects.filter(start__lt=self.start).count() + 1
+        return self._number
 
     def started(self):
         return self.start <= timezone.now()
@@ -372,23 +424,66 @@ class Window(models.Model):
         if self.codename == settings.OVERALL_WINDOW_CODENAME:
             raise ValidationError("The window codename cannot be {!r}".format(settings.OVERALL_WINDOW_CODENAME))
 
-    def sync_timers(self):
-        """Make timers update their end times per changes in the personal window duration
+    def validate_timers_are_within_window(self):
+        """Raise a ValidationError if any timer would lie outside the window
 
-        Purpose:
-          - Make timers update their end based on the window's personal_timer_duration;
-          - Raise a ValidationError if the timers would be outside the window if modified;
+        Timers’ ends are recomputed after saving (see
+        `window_post_save_sync_timers_handler`) and never exceed the window’s
+        end, so only their starts need checking, which one query does.
         """
-        for timer in self.timer_set.all():
-            timer.save()
+        if not self.pk or not self.times_changed():
+            return
+        starts = self.timer_set.aggregate(earliest=models.Min('start'), latest=models.Max('start'))
+        if starts['earliest'] is not None and (starts['earliest'] < self.start or starts['latest'] > self.end):
+            raise ValidationError("Some timers would lie outside the window", code='timers_are_within_window')
 
     MODEL_CLEANERS = (
         validate_windows_dont_overlap,
         validate_timedelta_is_positive,
         validate_window_is_not_named_overall,
-        sync_timers,
+        validate_timers_are_within_window,
     )
 
+    ''' Change Tracking '''
+
+    # (Values of `start`, `end` and `personal_timer_duration` as loaded from the database)
+    _loaded_times = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_times = (instance.start, instance.end, instance.personal_timer_duration)
+        return instance
+
+    def times_changed(self):
+        return self._loaded_times != (self.start, self.end, self.personal_timer_duration)
+
+    def timer_ends_changed(self):
+        return self._loaded_times is None or self._loaded_times[1:] != (self.end, self.personal_timer_duration)
+
+
+@unique_receiver(post_save, sender=Window)
+def window_post_save_sync_timers_handler(sender, instance, created, **kwargs):
+    """Recompute the ends of a window’s timers if its end or timer duration changed
+
+    Purpose:
+        This is done with one UPDATE instead of saving each timer.
+
+    Implementation Notes:
+        - As `update()` sends no signals, the IDs of the teams whose timers
+          changed are left in `_resynced_team_ids` for
+          `ctflex.caches.window_changed_handler` to invalidate cached timers.
+    """
+
+    if not created and instance.timer_ends_changed():
+        instance._resynced_team_ids = list(instance.timer_set.values_list('team_id', flat=True))
+        instance.timer_set.update(end=Least(
+            ExpressionWrapper(F('start') + instance.personal_timer_duration, output_field=models.DateTimeField()),
+            Value(instance.end, output_field=models.DateTimeField()),
+        ))
+
+    instance._loaded_times = (instance.start, instance.end, instance.personal_timer_duration)
+
 
 @cleaned
 class Timer(models.Model):
@@ -578,7 +673,14 @@ class Solve(models.Model):
     """
 
     class Meta:
-        unique_together = ('problem', 'competitor')
+        unique_together = (
+            ('problem', 'competitor'),
+            ('problem', 'team'),
+        )
+        index_together = (
+            ('team', 'window', 'date'),
+            ('window', 'date'),
+        )
 
     problem = models.ForeignKey(CtfProblem)
     competitor = models.ForeignKey(Competitor)
@@ -586,6 +688,14 @@ class Solve(models.Model):
     date = models.DateTimeField()
     flag = models.CharField(max_length=MAX_FLAG_SIZE, blank=False)
 
+    ''' Denormalized Fields '''
+
+    # (Copied from the competitor and problem by `solve_pre_save_denormalize_handler`
+    #  so that scoring queries need no joins)
+    team = models.ForeignKey(Team, editable=False)
+    window = models.ForeignKey(Window, editable=False)
+    points = models.IntegerField(editable=False)
+
     def __str__(self):
         return "prob={} team={} date={}".format(self.problem, self.competitor.team, self.date)
 
@@ -596,7 +706,7 @@ class Solve(models.Model):
             self.date = timezone.now()
 
     def validate_teams_are_unique(self):
-        if Solve.objects.filter(problem=self.problem, competitor__team=self.competitor.team).exclude(
+        if Solve.objects.filter(problem=self.problem, team_id=self.competitor.team_id).exclude(
                 pk=self.id).exists():
             raise ValidationError(
                 "A team can solve a problem only once",
@@ -630,6 +740,68 @@ class Solve(models.Model):
     )
 
 
+@unique_receiver(pre_save, sender=Solve)
+def solve_pre_save_denormalize_handler(sender, instance, **kwargs):
+    """Copy a solve’s team, window and points from its competitor and problem
+
+    Implementation Notes:
+        - This receiver is connected before `pre_save_validate_handler`, so
+          the copied fields are set before the solve is full cleaned.
+        - It also runs for `trusted_save`.
+    """
+    instance.team_id = instance.competitor.team_id
+    instance.window_id = instance.problem.window_id
+    instance.points = instance.problem.points
+
+
+@unique_receiver(post_save, sender=Competitor)
+def competitor_post_save_sync_solves_handler(sender, instance, created, **kwargs):
+    """Move a competitor’s solves along if they changed teams
+
+    Implementation Notes:
+        - A team may solve a problem only once, so if the new team already
+          solved one of the problems, the earlier of the two solves is kept
+          and the other deleted.
+        - `update()` sends no signals, so the teams the solves moved away from
+          are recorded in `_moved_from_team_ids` for `caches` to invalidate.
+        - Solves are only looked at if the team changed since the competitor
+          was loaded, so that other saves (e.g. marking announcements read)
+          make no queries.
+    """
+    changed = not created and instance.team_changed()
+    instance._loaded_team_id = instance.team_id
+    if not changed:
+        return
+
+    moving = instance.solve_set.exclude(team_id=instance.team_id)
+    moved_from = set(moving.values_list('team_id', flat=True))
+    if not moved_from:
+        return
+
+    existing = {solve.problem_id: solve for solve in
+                Solve.objects.filter(team_id=instance.team_id, problem_id__in=moving.values('problem_id'))}
+    for solve in moving.filter(problem_id__in=list(existing)):
+        other = existing[solve.problem_id]
+        (other if solve.date < other.date else solve).delete()
+
+    moving.update(team_id=instance.team_id)
+    instance._moved_from_team_ids = moved_from
+
+
+@unique_receiver(post_save, sender=CtfProblem)
+def problem_post_save_sync_solves_handler(sender, instance, created, **kwargs):
+    """Update the window and points of a problem’s solves if they changed
+
+    Scores always count the problem’s current points (as they did before
+    points were copied onto solves), so fixing a problem’s points rescores
+    existing solves too.
+    """
+    if not created:
+        (instance.solve_set
+         .exclude(window_id=instance.window_id, points=instance.points)
+         .update(window_id=instance.window_id, points=instance.points))
+
+
 @cleaned
 class Submission(models.Model):
     """Log a flag submission attempt
@@ -646,13 +818,17 @@ class Submission(models.Model):
       simply set is_active flag of a user to False instead of deleting the objects.
     """
 
+    class Meta:
+        # (For checking whether a flag was already tried)
+        index_together = ('problem', 'flag')
+
     id = models.AutoField(primary_key=True)
     p_id = models.UUIDField()
     problem = models.ForeignKey(CtfProblem, on_delete=models.SET_NULL,
                                 null=True, blank=True, editable=False)
     competitor = models.ForeignKey(Competitor, on_delete=models.SET_NULL, null=True)
 
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
     flag = models.CharField(max_length=MAX_FLAG_SIZE, blank=True)
     correct = models.NullBooleanField()
 
@@ -699,10 +875,11 @@ def pre_save_validate_handler(sender, instance, *args, **kwargs):
     Limitations:
         - Calling update() on a query does not trigger save() and thus still
           doesn't trigger full_clean().
+        - Saving with `trusted_save` skips full_clean() on purpose.
 
     Author: Yatharth
     """
-    if sender._meta.app_label == APP_NAME:
+    if sender._meta.app_label == APP_NAME and not getattr(instance, TRUSTED_SAVE_ATTR, False):
         instance.full_clean()
 
 
@@ -716,14 +893,19 @@ def pre_save_validate_handler(sender, instance, *args, **kwargs):
 
 @cleaned
 class Announcement(models.Model):
-    """Represent an announcement for a window (and maybe some problems)"""
+    """Represent an announcement for a window (and maybe some problems)
+
+    Whether a competitor has read an announcement is not stored per announcement;
+    instead, announcements dated after `Competitor.announcements_read_at` are unread.
+    """
+
+    class Meta:
+        index_together = ('window', 'date')
 
     ''' Structural Fields '''
 
     id = models.AutoField(primary_key=True)
     window = models.ForeignKey(Window, on_delete=models.CASCADE)
-    competitors = models.ManyToManyField(Competitor, related_name='unread_announcements',
-                                         blank=True)
     problems = models.ManyToManyField(CtfProblem, blank=True)
 
     ''' Data Fields '''
@@ -782,6 +964,70 @@ class Announcement(models.Model):
         sync_html,
     )
 
+
+class IpObservation(models.Model):
+    """Aggregate how often a competitor was seen on an IP with a browser
+
+    Purpose:
+        This model indexes which IPs teams and competitors share so that
+        cheating can be spotted during a contest; see the 'IP Correlation'
+        queries in `ctflex.queries`.
+
+    Implementation Notes:
+        - Rows are upserted in batches by `ctflex.correlation` with raw SQL,
+          so saving does not go through `full_clean`.
+        - `team` is copied from the competitor so that lookups by team do not
+          need a join.
+    """
+
+    class Meta:
+        unique_together = ('ip', 'competitor', 'browser')
+        index_together = ('ip', 'team')
+
+    ip = models.CharField(max_length=45)
+    competitor = models.ForeignKey(Competitor, on_delete=models.CASCADE)
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
+    browser = models.CharField(max_length=50)
+
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "{} competitor=#{} team=#{} browser={!r}".format(
+            self.ip, self.competitor_id, self.team_id, self.browser)
+
+
+class ProblemAccess(models.Model):
+    """Record a request to a problem’s server from its access logs
+
+    Purpose:
+        Joined with `IpObservation` and `Solve`, these show which teams
+        accessed a problem’s server before solving it; see
+        `ctflex.queries.accesses_before_solves`.
+
+    Implementation Notes:
+        - Rows are copied in batches by the `ingestaccesslogs` command with
+          COPY, so saving does not go through `full_clean`.
+        - `server` keeps the name from the log, since `problem` is only set
+          if the server could be matched to a problem.
+    """
+
+    class Meta:
+        verbose_name_plural = "problem accesses"
+        index_together = (
+            ('problem', 'ip', 'date'),
+            ('ip', 'date'),
+        )
+
+    ip = models.CharField(max_length=45)
+    date = models.DateTimeField()
+    server = models.CharField(max_length=100)
+    problem = models.ForeignKey(CtfProblem, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return "{} server={!r} @{}".format(self.ip, self.server, self.date)
+
 # endregion
 
 # region Permissions and Groups (old)
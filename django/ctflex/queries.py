@@ -6,21 +6,146 @@ from functools import partial
 from os.path import join
 
 from django.core.cache import cache
-from django.db.models import Sum
+from django.db import connection
+from django.db.models import (BooleanField, Case, Count, ExpressionWrapper, F, FloatField, Max, Min, Q, Sum,
+                              Value, When)
 from django.utils import timezone
+from django.utils.functional import cached_property
 
+from ctflex import caches
 from ctflex import constants
 from ctflex import hashers
+from ctflex import metrics
 from ctflex import models
 from ctflex import settings
 
 logger = logging.getLogger(constants.BASE_LOGGER_NAME + '.' + __name__)
 
 
+# region Request State
+
+_COMPETITOR_MEMO_ATTR = '_ctflex_competitor'
+REQUEST_STATE_ATTR = 'ctflex_state'
+
+
+def get_competitor(user):
+    """Return a user’s competitor (with its team) or None
+
+    Implementation Notes:
+      - The result is memoized on the user object, which Django loads anew
+        for every request.
+      - The competitor is also cached as `user.competitor` so that code
+        accessing it directly does not query the database again.
+    """
+
+    try:
+        return getattr(user, _COMPETITOR_MEMO_ATTR)
+    except AttributeError:
+        pass
+
+    competitor = None
+    if user.is_authenticated():
+        competitor = (models.Competitor.objects
+                      .select_related('team')
+                      .filter(user=user)
+                      .first())
+        if competitor is not None:
+            setattr(user, models.Competitor.user.field.rel.name, competitor)
+
+    setattr(user, _COMPETITOR_MEMO_ATTR, competitor)
+    return competitor
+
+
+class RequestState:
+    """Memoize the requesting user’s competitor, team, timers and solves
+
+    Purpose:
+        Many parts of a request (context processors, views, template tags and
+        ratelimiting) need the competitor, team or timer. This object loads all
+        of them together once and shares them.
+
+    Usage:
+        `RequestStateMiddleware` attaches an instance to each request; get it
+        with `request_state(request)`.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self._timers = {}
+
+    @cached_property
+    def competitor(self):
+        return get_competitor(self.request.user)
+
+    def loaded_competitor(self):
+        """Return the competitor if something already loaded it, without loading it"""
+        return self.__dict__.get('competitor')
+
+    @cached_property
+    def team(self):
+        return self.competitor.team if self.competitor is not None else None
+
+    def timer(self, window):
+        if window.id not in self._timers:
+            self._timers[window.id] = (caches.get_timer(team=self.team, window=window)
+                                       if self.team is not None else None)
+        return self._timers[window.id]
+
+    def has_timer(self, window):
+        return self.timer(window) is not None
+
+    def has_active_timer(self, window):
+        return self.has_timer(window) and self.timer(window).active()
+
+    @cached_property
+    def team_solves(self):
+        """Return all the team’s solves, latest first, loaded with one query"""
+        if self.team is None:
+            return ()
+        return tuple(models.Solve.objects
+                     .filter(team=self.team)
+                     .select_related('problem', 'competitor__user')
+                     .order_by('-date'))
+
+    @cached_property
+    def solved_problem_ids(self):
+        return frozenset(solve.problem_id for solve in self.team_solves)
+
+    def solves(self, window):
+        window_id = window.id if window is not None else None
+        return [solve for solve in self.team_solves if solve.window_id == window_id]
+
+    def score(self, window=None):
+        """Return the team’s score like `score`, but from the memoized solves"""
+        if window is not None:
+            return sum(solve.points for solve in self.solves(window))
+        return _normalize(
+            team=self.team,
+            score_function=lambda *, team, window: self.score(window),
+            windows_with_points=_windows_with_points(),
+        )
+
+    def is_team(self, team):
+        """Return whether a team is the requesting competitor’s team"""
+        return team is not None and self.team is not None and team.id == self.team.id
+
+
+def request_state(request):
+    """Return the request’s `RequestState`, creating it if necessary"""
+    state = getattr(request, REQUEST_STATE_ATTR, None)
+    if state is None:
+        state = RequestState(request)
+        setattr(request, REQUEST_STATE_ATTR, state)
+    return state
+
+
+# endregion
+
+
 # region General
 
 def is_competitor(user):
-    return user.is_authenticated() and hasattr(user, models.Competitor.user.field.rel.name)
+    return get_competitor(user) is not None
 
 
 def is_competitor_or_superuser(user):
@@ -29,26 +154,26 @@ def is_competitor_or_superuser(user):
 
 def get_window(codename=None):
     if codename:
-        return models.Window.objects.get(codename=codename)
+        return caches.catalog.window(codename)
     else:
-        return models.Window.objects.current()
+        return caches.catalog.current_window()
 
 
 def all_windows():
-    return models.Window.objects.order_by('start')
+    return caches.catalog.windows()
 
 
 def competitor_key(group, request):
     """Key function for ratelimiting based on competitor"""
-    return str(request.user.competitor.id)
+    return str(request_state(request).competitor.id)
 
 
 def solved(problem, team):
-    return models.Solve.objects.filter(problem=problem, competitor__team=team).exists()
+    return models.Solve.objects.filter(problem=problem, team=team).exists()
 
 
 def solves(*, team, window):
-    return models.Solve.objects.filter(competitor__team=team, problem__window=window)
+    return models.Solve.objects.filter(team=team, window=window)
 
 
 def announcements(window):
@@ -56,9 +181,12 @@ def announcements(window):
 
 
 def unread_announcements_count(*, window, user):
-    if not is_competitor(user):
+    competitor = get_competitor(user)
+    if competitor is None:
         return 0
-    return user.competitor.unread_announcements.filter(window=window).count()
+    return (window.announcement_set
+            .filter(date__gt=competitor.announcements_read_at)
+            .count())
 
 
 def window_name(window):
@@ -70,8 +198,12 @@ def window_name(window):
 
 # region Problems List
 
-def _is_unlocked(team, problem):
-    """Compute whether a team has unlocked a problem"""
+def _is_unlocked(team, problem, *, ignored_solve=None):
+    """Compute whether a team has unlocked a problem
+
+    If `ignored_solve` is given, that solve is not counted, which allows
+    determining whether a problem was unlocked before the solve happened.
+    """
 
     # If a problem does not define any dependencies, it’s unlocked by default
     if problem.deps is None:
@@ -82,7 +214,9 @@ def _is_unlocked(team, problem):
     problems = problem.deps[constants.DEPS_PROBS_FIELD]
 
     # Get the list of solved problems
-    solves = models.Solve.objects.filter(competitor__team=team, problem__id__in=problems)
+    solves = models.Solve.objects.filter(team=team, problem_id__in=problems)
+    if ignored_solve is not None:
+        solves = solves.exclude(pk=ignored_solve.pk)
 
     # (If no problems have been solved, the dependencies can’t have been met.)
     if not solves.exists():
@@ -97,18 +231,42 @@ def _is_unlocked(team, problem):
         return True
 
     # Return whether the sum of the solved problems’ points exceeds the threshold
-    return solves.aggregate(Sum('problem__points'))['problem__points__sum'] >= threshold
+    return solves.aggregate(Sum('points'))['points__sum'] >= threshold
+
+
+def _sorted_problems(problems):
+    """Sort problems first by points and then (case-insensitively) by their name"""
+    return sorted(problems,
+                  key=lambda problem: (problem.sort_last, problem.points, problem.name.lower()))
 
 
 def problem_list(*, team, window):
-    """Return sorted list of unlocked problems
+    """Return sorted list of unlocked problems"""
+    unlocked_problems = (problem for problem in caches.catalog.problems(window)
+                         if _is_unlocked(team, problem))
+    return _sorted_problems(unlocked_problems)
+
+
+def unlocked_problems(solve):
+    """Return sorted list of problems that a solve just unlocked for its team
 
-    Problems are first sorted by points and then (case-insensitively) by their name.
+    Implementation Notes:
+      - Only problems listing the solved problem as a dependency are considered,
+        since `_is_unlocked` only ever counts solves of the listed problems.
     """
-    unlocked_problems = (problem for problem in models.CtfProblem.objects.filter(window=window)
-                         if _is_unlocked(team, problem))
-    return sorted(unlocked_problems,
-                  key=lambda problem: (problem.sort_last, problem.points, problem.name.lower()))
+
+    team = solve.competitor.team
+    solved_id = str(solve.problem_id)
+
+    dependents = (
+        problem for problem in caches.catalog.problems(solve.problem.window)
+        if problem.deps is not None
+        and solved_id in map(str, problem.deps[constants.DEPS_PROBS_FIELD])
+    )
+    return _sorted_problems(
+        problem for problem in dependents
+        if _is_unlocked(team, problem) and not _is_unlocked(team, problem, ignored_solve=solve)
+    )
 
 
 # endregion
@@ -152,51 +310,93 @@ eligible = lambda team: (
 )
 
 
-# endregion
+def eligible_q():
+    """Return a Q object selecting the teams that `eligible` is true for"""
+    return Q(
+        standing=models.Team.GOOD_STANDING,
+        country=models.Team.US_COUNTRY,
+        background=models.Team.SCHOOL_BACKGROUND,
+    )
 
 
-# region Scores
+def participated_q():
+    """Return a Q object selecting teams that solved some problem"""
+    return Q(id__in=models.Solve.objects.values('team_id'))
 
 
-def _solves_in_timer(*, team, window):
-    """Return 1+ solves within the team’s timer
+def with_standings(teams):
+    """Annotate teams with `is_eligible`, `solve_count` and `overall_score`
 
     Implementation Notes:
-      - If there was no timer, None will be returned.
+      - `overall_score` is `score(team=team)` computed in SQL (as a float)
+        by weighting each solve’s points by its window’s normalization factor.
+      - No other join must be added to the result, as it would multiply the
+        solves being counted and summed.
     """
 
-    if not team.has_timer(window):
-        return None
-    timer = team.timer(window)
+    factors = [
+        When(solve__window_id=window.id, then=ExpressionWrapper(
+            F('solve__points') * (settings.SCORE_NORMALIZATION / (max_points or 1)),
+            output_field=FloatField(),
+        ))
+        for window, max_points in _windows_with_points()
+    ]
+    return teams.annotate(
+        is_eligible=Case(When(eligible_q(), then=Value(True)), default=Value(False),
+                         output_field=BooleanField()),
+        solve_count=Count('solve'),
+        overall_score=Sum(Case(*factors, default=Value(0.0), output_field=FloatField())),
+    )
+
+
+# endregion
+
 
+# region Scores
+
+
+def _scores_in_timer(window=None):
+    """Return how the teams scored within their timers
+
+    The result maps (team ID, window ID) to pairs of the points solved within
+    the team’s timer for the window and of the time taken since the beginning
+    of the timer to solve the last of those problems. Combinations without
+    such solves are left out.
+
+    Implementation Notes:
+      - If `window` is None, all windows are included.
+      - All teams are scored with one grouped query over the denormalized
+        team, window and points of solves, so that the board does not make
+        queries per team.
+    """
     solves = models.Solve.objects.filter(
-        competitor__team=team,
-        problem__window=window,
-        date__gte=timer.start,
-        date__lte=timer.end,
+        team__timer__window=F('window'),
+        date__gte=F('team__timer__start'),
+        date__lte=F('team__timer__end'),
     )
+    if window is not None:
+        solves = solves.filter(window=window)
 
-    if not solves.exists():
-        return None
-
-    return solves
+    rows = (solves
+            .order_by()
+            .values('team_id', 'window_id')
+            .annotate(score=Sum('points'), last_solve=Max('date'), timer_start=Min('team__timer__start')))
+    return {
+        (row['team_id'], row['window_id']): (row['score'], row['last_solve'] - row['timer_start'])
+        for row in rows
+    }
 
 
-def _score_in_timer(*, team, window):
-    solves = _solves_in_timer(team=team, window=window)
-    if solves is None:
-        return 0
-    return solves.aggregate(score=Sum('problem__points'))['score'] or 0
+def _score_in_timer(scores, *, team, window):
+    score_, _ = scores.get((team.id, window.id), (0, None))
+    return score_
 
 
 def _max_score(window):
-    problems = window.ctfproblem_set
-    if not problems.exists():
-        return 0
-    return problems.aggregate(score=Sum('points'))['score'] or 0
+    return sum(problem.points for problem in caches.catalog.problems(window))
 
 
-def _last_solve_in_timer_time(*, team, window):
+def _last_solve_in_timer_time(scores, *, team, window):
     """Return the longest time taken to solve a problem during the team’s timer
 
     Implementation Notes:
@@ -206,18 +406,14 @@ def _last_solve_in_timer_time(*, team, window):
 
     if window is None:
         window = get_window()
-
-    solves = _solves_in_timer(team=team, window=window)
-
-    if solves is None:
+    if window is None:
         return timezone.timedelta.max
 
-    last_solve_date = solves.order_by('-date').first().date
-    timer = team.timer(window)
-    return last_solve_date - timer.start
+    _, last_solve_time = scores.get((team.id, window.id), (0, timezone.timedelta.max))
+    return last_solve_time
 
 
-def _team_ranking_key(window, team_with_score):
+def _team_ranking_key(window, scores, team_with_score):
     """Return key for team based on rank
 
     The basis for ranking is, in order:
@@ -229,18 +425,14 @@ def _team_ranking_key(window, team_with_score):
     team, score_ = team_with_score
     return (
         -score_,
-        _last_solve_in_timer_time(team=team, window=window),
+        _last_solve_in_timer_time(scores, team=team, window=window),
         team.name.lower(),
     )
 
 
-def _board_cache_key(window):
-    return constants.BOARD_CACHE_KEY_PREFIX + window_name(window)
-
-
-def _teams_with_score_window(window):
+def _teams_with_score_window(window, scores):
     return (
-        (team, _score_in_timer(team=team, window=window))
+        (team, _score_in_timer(scores, team=team, window=window))
         for team in (models.Team.objects
                      .exclude(standing=models.Team.INVISIBLE_STANDING)
                      .iterator())
@@ -258,7 +450,7 @@ def _normalize(*, team, score_function, windows_with_points):
     ))
 
 
-def _teams_with_score_overall():
+def _teams_with_score_overall(scores):
     """Return teams with overall scores
 
     Overall scores are the sum of the normalized scores for each round.
@@ -268,7 +460,8 @@ def _teams_with_score_overall():
     return (
         (
             team,
-            _normalize(team=team, score_function=_score_in_timer, windows_with_points=windows_with_points),
+            _normalize(team=team, score_function=partial(_score_in_timer, scores),
+                       windows_with_points=windows_with_points),
         )
         for team in (models.Team.objects
                      .exclude(standing=models.Team.INVISIBLE_STANDING)
@@ -281,26 +474,32 @@ def _board_uncached(window):
 
     logger.debug("computing board for {}".format(window))
 
-    teams_with_score = _teams_with_score_window(window) if window is not None else _teams_with_score_overall()
-    ranked = sorted(teams_with_score, key=partial(_team_ranking_key, window))
-    board = tuple((i + 1, team, score_) for i, (team, score_) in enumerate(ranked))
+    with metrics.board_compute_seconds.time():
+        # (The overall board breaks ties by the current window, so it needs every window’s scores.)
+        scores = _scores_in_timer(window)
+        teams_with_score = (_teams_with_score_window(window, scores) if window is not None
+                            else _teams_with_score_overall(scores))
+        ranked = sorted(teams_with_score, key=partial(_team_ranking_key, window, scores))
+        board = tuple((i + 1, team, score_) for i, (team, score_) in enumerate(ranked))
 
-    cache.set(_board_cache_key(window), board, settings.BOARD_CACHE_DURATION)
+    cache.set(caches.board_cache_key(window), board, settings.BOARD_CACHE_DURATION)
     return board
 
 
 def board_cached(window=None):
-    board = cache.get(_board_cache_key(window))
+    board = cache.get(caches.board_cache_key(window))
     if board is None:
+        metrics.board_cache.inc(result='miss')
         board = _board_uncached(window)
     else:
+        metrics.board_cache.inc(result='hit')
         logger.debug("using cache for board for {}".format(window_name(window)))
     return board
 
 
 def _score_window(*, team, window):
     return (solves(team=team, window=window)
-            .aggregate(score=Sum('problem__points'))['score'] or 0)
+            .aggregate(score=Sum('points'))['score'] or 0)
 
 
 def score(*, team, window=None):
@@ -314,6 +513,74 @@ def score(*, team, window=None):
         )
 
 
+def team_ids_by_score_in_timer(teams):
+    """Return the IDs of some teams ordered by overall score within their timers, best first
+
+    Ties are broken by ID. Scores are normalized like `_normalize`, so this
+    order agrees with the overall in-timer scores `score_matrix` yields.
+
+    Implementation Notes:
+      - Only IDs are returned, so that callers can then read teams in chunks.
+    """
+    factors = [(window.id, settings.SCORE_NORMALIZATION / (max_points or 1))
+               for window, max_points in _windows_with_points()]
+    team_sql, team_params = teams.values('id').query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT team.id
+            FROM ({}) AS team
+            LEFT JOIN (
+                SELECT solve.team_id, SUM(solve.points * factor.factor) AS score
+                FROM ctflex_solve AS solve
+                JOIN ctflex_timer AS timer
+                    ON timer.team_id = solve.team_id AND timer.window_id = solve.window_id
+                    AND solve.date BETWEEN timer.start AND timer."end"
+                JOIN unnest(%s::int[], %s::float[]) AS factor (window_id, factor)
+                    ON factor.window_id = solve.window_id
+                GROUP BY solve.team_id
+            ) AS score ON score.team_id = team.id
+            ORDER BY FLOOR(COALESCE(score.score, 0)) DESC, team.id
+            '''.format(team_sql),
+            list(team_params) + [[window_id for window_id, _ in factors], [factor for _, factor in factors]],
+        )
+        return [team_id for team_id, in cursor]
+
+
+def score_matrix(team_ids):
+    """Return the points each competitor of some teams solved per window
+
+    The result maps (team ID, competitor ID, window ID) to pairs of the points
+    solved within the team’s timer for the window and of all points solved.
+    Combinations without solves are left out.
+
+    Implementation Notes:
+      - One grouped query computes the whole matrix by joining solves to
+        their team’s timer for the window.
+    """
+    team_ids = list(team_ids)
+    if not team_ids:
+        return {}
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT solve.team_id, solve.competitor_id, solve.window_id,
+                   SUM(CASE WHEN solve.date BETWEEN timer.start AND timer."end" THEN solve.points ELSE 0 END),
+                   SUM(solve.points)
+            FROM ctflex_solve AS solve
+            LEFT JOIN ctflex_timer AS timer
+                ON timer.team_id = solve.team_id AND timer.window_id = solve.window_id
+            WHERE solve.team_id = ANY(%s)
+            GROUP BY solve.team_id, solve.competitor_id, solve.window_id
+            ''',
+            [team_ids],
+        )
+        return {(team_id, competitor_id, window_id): (in_timer, all_time)
+                for team_id, competitor_id, window_id, in_timer, all_time in cursor}
+
+
 # endregion
 
 
@@ -355,3 +622,73 @@ def format_problem(problem, team):
     return data
 
 # endregion
+
+
+# region IP Correlation
+
+def shared_ips(*, min_teams=2):
+    """Return a dictionary mapping IPs used by at least `min_teams` teams to their team IDs"""
+    ips = (models.IpObservation.objects
+           .values('ip')
+           .annotate(teams=Count('team', distinct=True))
+           .filter(teams__gte=min_teams)
+           .values('ip'))
+
+    teams_by_ip = {}
+    for ip, team_id in (models.IpObservation.objects
+                        .filter(ip__in=ips)
+                        .values_list('ip', 'team_id')
+                        .distinct()):
+        teams_by_ip.setdefault(ip, set()).add(team_id)
+    return teams_by_ip
+
+
+def teams_sharing_ips(team):
+    """Return the IDs of other teams that used an IP the team used"""
+    ips = models.IpObservation.objects.filter(team=team).values('ip')
+    return set(models.IpObservation.objects
+               .filter(ip__in=ips)
+               .exclude(team=team)
+               .values_list('team_id', flat=True)
+               .distinct())
+
+
+def competitors_on_many_ips(*, min_ips):
+    """Return a dictionary mapping IDs of competitors seen on at least `min_ips` IPs to their number"""
+    return dict(models.IpObservation.objects
+                .values('competitor')
+                .annotate(ips=Count('ip', distinct=True))
+                .filter(ips__gte=min_ips)
+                .values_list('competitor', 'ips'))
+
+
+def accesses_before_solves(*, window=None):
+    """Return how often each solving team accessed the problem’s server beforehand
+
+    The result is a list of tuples of a team ID, a problem ID, the date of the
+    solve, the date of the team’s first access to the problem’s server (or
+    None) and the number of accesses before solving, ordered by solve date.
+
+    Implementation Notes:
+      - Accesses are attributed to teams by the IPs in `IpObservation`, so an
+        IP shared by several teams counts for each of them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT solve.team_id, solve.problem_id, solve.date, MIN(access.date), COUNT(access.id)
+            FROM ctflex_solve AS solve
+            LEFT JOIN (SELECT DISTINCT team_id, ip FROM ctflex_ipobservation) AS observation
+                ON observation.team_id = solve.team_id
+            LEFT JOIN ctflex_problemaccess AS access
+                ON access.problem_id = solve.problem_id AND access.ip = observation.ip
+                AND access.date <= solve.date
+            WHERE %(window_id)s IS NULL OR solve.window_id = %(window_id)s
+            GROUP BY solve.id, solve.team_id, solve.problem_id, solve.date
+            ORDER BY solve.date
+            ''',
+            {'window_id': window.id if window is not None else None},
+        )
+        return cursor.fetchall()
+
+# endregion
@@ -20,6 +20,8 @@ _SETTINGS = (
 
     ('SECRET_KEY', None, 'SECRET_KEY'),
 
+    ('CACHES', {}, 'CACHES'),
+
     # How many competitors can be in one team
     ('MAX_TEAM_SIZE', 5, None),
 
@@ -36,6 +38,34 @@ _SETTINGS = (
     # How long to cache scoreboard for
     ('BOARD_CACHE_DURATION', 100, None),
 
+    # How long to cache a team’s problem list on the game page for
+    # (The cache is invalidated explicitly, so this can be long.)
+    ('GAME_CACHE_DURATION', 60 * 60, None),
+
+    # How long to cache it for instead if the cache backend is per-process
+    # (Invalidation then only reaches the process that solved a problem or
+    #  loaded problems, so this should be short.)
+    ('UNSHARED_GAME_CACHE_DURATION', 5, None),
+
+    # How many seconds a process may use its in-memory windows and problems
+    # before checking the shared cache for changes
+    ('CATALOG_CHECK_INTERVAL', 1, None),
+
+    # How many seconds a process may use its in-memory windows and problems
+    # at most before reloading them even if the cache says they did not change
+    # (Changes are only announced to other processes if the cache backend is
+    #  shared, so this bounds how stale they can be with a per-process one.)
+    ('CATALOG_MAX_AGE', 60, None),
+
+    # How long to cache teams’ timers for
+    # (The cache is invalidated explicitly, so this can be long.)
+    ('TIMER_CACHE_DURATION', 60 * 60, None),
+
+    # How long to cache that a team has no timer for
+    # (Starting a timer only updates the cache of the process that started it
+    #  unless the cache backend is shared, so this should be short.)
+    ('NO_TIMER_CACHE_DURATION', 10, None),
+
     # Out of how many points to normalize each round’s score
     ('SCORE_NORMALIZATION', 1000, None),
 
@@ -43,6 +73,62 @@ _SETTINGS = (
     ('NORECAPTCHA_SITE_KEY', '6LeIxAcTAAAAAJcZVRqyHh71UMIEGNQ_MXjiZKhI', 'NORECAPTCHA_SITE_KEY'),
     ('NORECAPTCHA_SECRET_KEY', '6LeIxAcTAAAAAGG-vFI1TnRWxMZNFuojJ4WifJWe', 'NORECAPTCHA_SECRET_KEY'),
 
+    ### Events
+
+    # Whether to push announcements and team events to browsers with Server-Sent Events
+    # (Each open tab holds a connection, so this requires an asynchronous
+    #  Gunicorn worker class such as 'gevent'.)
+    ('EVENTS_ENABLED', False, None),
+
+    # File through which events reach all server processes
+    # (If not set, events only reach clients connected to the publishing process.)
+    ('EVENTS_SPOOL_PATH', None, None),
+
+    # Size at which to start a new spool file, keeping only the previous one
+    # (A client that reconnects after missing more events than that misses some.)
+    ('EVENTS_SPOOL_MAX_BYTES', 16 * 1024 * 1024, None),
+
+    # How often to send a heartbeat on idle streams, in seconds
+    ('EVENTS_HEARTBEAT', 15, None),
+
+    # How long to keep a stream open before making the client reconnect, in seconds
+    ('EVENTS_STREAM_DURATION', 5 * 60, None),
+
+    # How long clients should wait before reconnecting, in milliseconds
+    ('EVENTS_RETRY_MILLISECONDS', 3000, None),
+
+    ### Monitoring
+
+    # How often to write buffered IP observations to the database, in seconds
+    ('IP_INDEX_FLUSH_INTERVAL', 30, None),
+
+    # How many distinct buffered IP observations trigger writing them early
+    ('IP_INDEX_FLUSH_SIZE', 500, None),
+
+    # Fraction of requests `PerformanceMiddleware` times
+    ('PERF_SAMPLE_RATE', 0.1, None),
+
+    # Directory to periodically dump per-view latency histograms to (or None)
+    ('PERF_DUMP_DIR', None, None),
+
+    # How often to dump latency histograms, in seconds
+    ('PERF_DUMP_INTERVAL', 60, None),
+
+    # Whether `QueryDiagnosticsMiddleware` logs slow and repeated queries
+    ('QUERY_DIAGNOSTICS', False, None),
+
+    # How long a query must take to be logged as slow, in seconds
+    ('SLOW_QUERY_SECONDS', 0.1, None),
+
+    # How many times a statement may run in one request before being logged as repeated
+    ('REPEATED_QUERY_THRESHOLD', 10, None),
+
+    # Directory through which processes share metrics (or None to only report this process’s)
+    ('METRICS_SPOOL_DIR', None, None),
+
+    # How often each process writes its metrics to the spool directory, in seconds
+    ('METRICS_DUMP_INTERVAL', 5, None),
+
     ### Metadata
 
     # Name used for site in emails sent out
@@ -9,18 +9,28 @@ jQuery(document).ready(function () {
     updateCount(url);
 
     setInterval(function () {
+        // (If `events.js` is receiving pushed announcements, polling is unnecessary.)
+        if (window.ctflex_events && window.ctflex_events.readyState === EventSource.OPEN) {
+            return;
+        }
         updateCount(url)
     }, 1000 * 20);
 });
 
 function updateCount(url) {
 
+    // (The server sends an ETag and jQuery sends it back with `ifModified`,
+    //  so a 304 without a body is received if nothing changed.)
     $.ajax({
         url: url,
-        type: "POST",
-        data: {},
+        type: "GET",
+        ifModified: true,
+
+        success: function (response, status) {
+            if (status === "notmodified" || !response || response.count === undefined) {
+                return;
+            }
 
-        success: function (response) {
             var announcebar = jQuery("#unread-announcements-badge");
             if (response.count > 0) {
                 if (parseInt(announcebar.html()) < response.count) {
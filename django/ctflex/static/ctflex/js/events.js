@@ -0,0 +1,31 @@
+// Receive announcements and team events pushed by the server (see `ctflex.events`)
+// (The browser reconnects by itself whenever the server ends the stream.)
+
+jQuery(document).ready(function () {
+    if (!window.EventSource) {
+        return;
+    }
+
+    var source = new EventSource("/api/events/");
+    window.ctflex_events = source;
+
+    source.addEventListener("announcement", function (event) {
+        updateCount("/api/unread_announcements/");
+    });
+
+    source.addEventListener("solve", function (event) {
+        var data = JSON.parse(event.data);
+
+        // Only update the game page showing the solved problem
+        if (typeof mark_solved === "undefined" || !document.getElementById(data.problem)) {
+            return;
+        }
+
+        jQuery("#navbar-score").text(data.score);
+        if (mark_solved(data.problem)) {
+            var name = jQuery("#" + data.problem + " .problem-title").text();
+            jQuery.notify("Your team solved " + name + "!", "success");
+        }
+        insert_unlocked(data.unlocked);
+    });
+});
@@ -1,21 +1,62 @@
 jQuery(document).ready(function () {
+    Array.prototype.forEach.call(jQuery(".problem"), bind_problem);
+});
 
 
-    Array.prototype.forEach.call(jQuery(".problem"), function (prob) {
+// Attach event handlers to a problem's elements
+function bind_problem(prob) {
 
-        jQuery(".problem-header", prob).on('click', function (event) {
-            if (!$(event.target).closest('.header-link').length) {
-                jQuery(".problem-body", prob).toggle('show');
-            }
-        });
+    jQuery(".problem-header", prob).on('click', function (event) {
+        if (!$(event.target).closest('.header-link').length) {
+            jQuery(".problem-body", prob).toggle('show');
+        }
+    });
 
-        // Hint visibility toggling
-        jQuery(".hint-button", prob).on('click', function (event) {
-            jQuery('.hint-content', prob).toggle('show');
-        });
+    // Hint visibility toggling
+    jQuery(".hint-button", prob).on('click', function (event) {
+        jQuery('.hint-content', prob).toggle('show');
     });
+}
 
-});
+
+// Show a problem as solved, returning whether it was not already shown so
+function mark_solved(problem_id) {
+    var status = jQuery("#" + problem_id + " .problem-solved-status");
+    if (!status.length || status.text() === "Solved") {
+        return false;
+    }
+
+    status.text("Solved");
+    jQuery("#" + problem_id + " .problem-form").html(function (index, html) {
+        return "<p>Your team has already solved this problem!</p>";
+    });
+    return true;
+}
+
+
+// Insert problems unlocked by a solve without reloading the page
+function insert_unlocked(unlocked) {
+    if (!unlocked || !unlocked.length) {
+        return;
+    }
+
+    // (Problems may arrive twice, from both the response and `events.js`.)
+    var inserted = 0;
+    unlocked.forEach(function (problem) {
+        if (document.getElementById(problem.id)) {
+            return;
+        }
+        var prob = jQuery(problem.html).filter(".problem").get(0);
+        jQuery("#no-problems").remove();
+        jQuery("#problems").append(prob);
+        bind_problem(prob);
+        inserted++;
+    });
+
+    if (inserted) {
+        jQuery.notify("You unlocked " + inserted + " new problem" + (inserted > 1 ? "s" : "") + "!", "info");
+    }
+}
 
 
 // Submit function for flag submission forms
@@ -35,18 +76,18 @@ function submit_flag(problem_id) {
             success: function (response) {
                 if (response.status <= 0) {
                     jQuery("#" + problem_id + " .problem-body").toggle('show');
-                    jQuery("#" + problem_id + " .problem-header").html(function (index, html) {
-                        return html.replace(/Unsolved/, 'Solved');
-                    });
-                    jQuery("#" + problem_id + " .problem-form").html(function (index, html) {
-                        return "<p>Your team has already solved this problem!</p>";
-                    })
+                    mark_solved(problem_id);
                 }
 
                 if (response.status === 0) {
-                    jQuery("#navbar-score").text(function (i, value) {
-                        return parseInt(value) + parseInt(jQuery("#" + problem_id + " .problem-points").text());
-                    });
+                    if (response.score !== undefined) {
+                        jQuery("#navbar-score").text(response.score);
+                    } else {
+                        jQuery("#navbar-score").text(function (i, value) {
+                            return parseInt(value) + parseInt(jQuery("#" + problem_id + " .problem-points").text());
+                        });
+                    }
+                    insert_unlocked(response.unlocked);
                 }
 
                 var prefix = response.status === 0 ? "Success! " : response.status === 1 ? "Incorrect! " : "";
@@ -0,0 +1,27 @@
+"""Define template tags for the admin"""
+
+from django import template
+from django.contrib.admin.views.main import PAGE_VAR
+
+register = template.Library()
+
+
+# Orderings under which filtering on `id__lt` continues after the last row shown
+_KEYSET_ORDERINGS = ('-id', '-pk')
+
+
+@register.simple_tag()
+def keyset_next_url(cl):
+    """Return the changelist URL for rows older than the last one shown (or '' if there are none)
+
+    No URL is returned if the changelist is sorted by another column, as the
+    rows after the last one shown then are not those with smaller IDs.
+    """
+    ordering = cl.queryset.query.order_by
+    if not ordering or ordering[0] not in _KEYSET_ORDERINGS:
+        return ''
+
+    results = list(cl.result_list)
+    if len(results) < cl.list_per_page:
+        return ''
+    return cl.get_query_string({'id__lt': results[-1].pk}, [PAGE_VAR])
@@ -8,9 +8,25 @@ register = template.Library()
 
 # region Simple Proxies to Queries
 
+def _state_for(context, team):
+    """Return the request’s state if the team is the requesting competitor’s, or None
+
+    The requesting team’s solves are loaded once and shared by all tags in a
+    request, instead of being queried for every problem or window.
+    """
+    request = context.get('request')
+    if request is None:
+        return None
+    state = queries.request_state(request)
+    return state if state.is_team(team) else None
+
+
 @register.simple_tag(takes_context=True)
 def score(context, team):
     window = context.get('window', queries.get_window())
+    state = _state_for(context, team)
+    if state is not None:
+        return state.score(window)
     return queries.score(team=team, window=window)
 
 
@@ -19,8 +35,11 @@ def format_problem(problem, team):
     return queries.format_problem(problem, team)
 
 
-@register.simple_tag()
-def solved(problem, team):
+@register.simple_tag(takes_context=True)
+def solved(context, problem, team):
+    state = _state_for(context, team)
+    if state is not None:
+        return problem.id in state.solved_problem_ids
     return queries.solved(problem, team)
 
 
@@ -32,6 +51,9 @@ def eligible(team):
 @register.simple_tag(takes_context=True)
 def solves(context, team):
     window = context.get('window', queries.get_window())
+    state = _state_for(context, team)
+    if state is not None:
+        return state.solves(window)
     return queries.solves(team=team, window=window).order_by('-date')
 
 
@@ -0,0 +1,116 @@
+"""Check that teammates racing to start a timer or solve a problem cannot corrupt state
+
+Each test has every competitor of several teams hit the same write path at
+once from their own threads (and so their own database connections) and then
+checks the database and cache for duplicates or stale values.
+"""
+
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from ctflex import caches
+from ctflex import commands
+from ctflex import correlation
+from ctflex import models
+
+
+class ConcurrencyTests(TransactionTestCase):
+
+    TEAMS = 5
+    TEAM_SIZE = 5
+
+    def setUp(self):
+        patcher = mock.patch.object(correlation, 'buffer', mock.Mock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        cache.clear()
+        caches.catalog.clear()
+
+        now = timezone.now()
+        self.window = models.Window(codename='concurrency', verbose_name='Concurrency',
+                                    start=now - timezone.timedelta(hours=1), end=now + timezone.timedelta(hours=1),
+                                    personal_timer_duration=timezone.timedelta(minutes=30))
+        models.trusted_save(self.window)
+        self.problem = models.CtfProblem(name='concurrency', window=self.window, points=10,
+                                         grader='grader.py', description_raw='Find the flag.')
+        models.trusted_save(self.problem)
+
+        self.teams = [self._team() for _ in range(self.TEAMS)]
+
+    ''' Fixtures '''
+
+    def _team(self):
+        name = 'cc-' + uuid.uuid4().hex[:8]
+        team = models.Team(name=name, passphrase=name)
+        models.trusted_save(team)
+        for number in range(self.TEAM_SIZE):
+            username = '{}-{}'.format(name, number)
+            user = get_user_model().objects.create_user(username, password=username)
+            models.trusted_save(models.Competitor(user=user, team=team, email=username + '@example.com',
+                                                  first_name=username, last_name=username))
+        return team
+
+    def _race(self, function, jobs):
+        """Call a function on all jobs at once from one thread each, returning the results in order"""
+
+        barrier = threading.Barrier(len(jobs))
+
+        def run(job):
+            try:
+                barrier.wait()
+                return function(job)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            return list(executor.map(run, jobs))
+
+    ''' Tests '''
+
+    def test_start_timer(self):
+
+        def start(team):
+            # (Load the timer first, as the game page would, so that its absence is cached.)
+            caches.get_timer(team=team, window=self.window)
+            return commands.start_timer(team=team, window=self.window)
+
+        jobs = [team for team in self.teams for _ in range(self.TEAM_SIZE)]
+        results = self._race(start, jobs)
+
+        for team in self.teams:
+            started = [result for job, result in zip(jobs, results) if job == team and result]
+            self.assertEqual(len(started), 1, "{} started {} timers".format(team, len(started)))
+
+            timer = models.Timer.objects.get(team=team, window=self.window)
+            cached = caches.get_timer(team=team, window=self.window)
+            self.assertIsNotNone(cached, "the cached timer of {} is stale".format(team))
+            self.assertEqual(cached.id, timer.id)
+
+    def test_submit_flag(self):
+        for team in self.teams:
+            commands.start_timer(team=team, window=self.window)
+
+        def submit(competitor):
+            try:
+                return commands.submit_flag(prob_id=self.problem.id, competitor=competitor, flag='flag')[0]
+            except commands.ProblemAlreadySolvedException:
+                return None
+
+        competitors = list(models.Competitor.objects.select_related('user', 'team'))
+        with mock.patch.object(commands, '_grade', return_value=(True, "Correct!")):
+            results = self._race(submit, competitors)
+
+        for team in self.teams:
+            outcomes = [result for competitor, result in zip(competitors, results) if competitor.team_id == team.id]
+            self.assertEqual(outcomes.count(True), 1, "{} solved the problem {} times".format(team, outcomes.count(True)))
+            self.assertEqual(outcomes.count(None), self.TEAM_SIZE - 1)
+            self.assertEqual(models.Solve.objects.filter(team=team, problem=self.problem).count(), 1)
@@ -0,0 +1,131 @@
+"""Check that hot views make no more queries for a big contest than for a small one
+
+Each test requests a view with cold caches, grows the contest by more teams,
+competitors, problems and solves, and requests it again. Any query made per
+row (an N+1) makes the counts differ and fails the test.
+"""
+
+import uuid
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from ctflex import caches
+from ctflex import commands
+from ctflex import correlation
+from ctflex import models
+from ctflex import settings
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class QueryCountTests(TestCase):
+
+    # How many teams and problems to add when growing the contest
+    GROWTH = 10
+
+    def setUp(self):
+        # (Buffered IP observations would otherwise be written whenever a flush is due,
+        # and at exit after the test database is gone.)
+        patcher = mock.patch.object(correlation, 'buffer', mock.Mock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.now = timezone.now()
+        self.window = models.Window(codename='querycount', verbose_name='Query Count',
+                                    start=self.now - timezone.timedelta(hours=1),
+                                    end=self.now + timezone.timedelta(hours=1),
+                                    personal_timer_duration=timezone.timedelta(hours=1))
+        models.trusted_save(self.window)
+
+        self.problems = [self._problem() for _ in range(3)]
+        self.competitor = self._competitor()
+        self._solve(self.competitor, self.problems[0])
+        self.client.force_login(self.competitor.user)
+
+    ''' Fixtures '''
+
+    def _problem(self):
+        problem = models.CtfProblem(name='problem-' + uuid.uuid4().hex[:8], window=self.window, points=10,
+                                    grader='grader.py', description_raw='Find the flag.')
+        models.trusted_save(problem)
+        return problem
+
+    def _competitor(self):
+        name = 'qc-' + uuid.uuid4().hex[:8]
+        user = get_user_model().objects.create_user(name, password=name)
+        team = models.Team(name=name, passphrase=name)
+        models.trusted_save(team)
+        competitor = models.Competitor(user=user, team=team, email=name + '@example.com',
+                                       first_name=name, last_name=name)
+        models.trusted_save(competitor)
+        models.trusted_save(models.Timer(team=team, window=self.window,
+                                         start=self.now - timezone.timedelta(minutes=30),
+                                         end=self.now + timezone.timedelta(minutes=30)))
+        return competitor
+
+    def _solve(self, competitor, problem):
+        models.trusted_save(models.Solve(problem=problem, competitor=competitor, flag='flag',
+                                         date=self.now - timezone.timedelta(minutes=10)))
+
+    def _grow(self):
+        problems = [self._problem() for _ in range(self.GROWTH)]
+        for _ in range(self.GROWTH):
+            competitor = self._competitor()
+            for problem in problems[:3]:
+                self._solve(competitor, problem)
+
+    ''' Assertions '''
+
+    def _count_queries(self, request):
+        """Return how many queries a request makes with cold caches"""
+
+        # (Invalidation waits for commits, which never happen inside a test.)
+        cache.clear()
+        caches.catalog.clear()
+
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assertQueriesDoNotGrow(self, request_small, request_large=None):
+        small = self._count_queries(request_small)
+        self._grow()
+        large = self._count_queries(request_large or request_small)
+        self.assertEqual(small, large, "{} queries before growing the contest but {} after".format(small, large))
+
+    ''' Views '''
+
+    def test_game(self):
+        url = reverse('ctflex:game', kwargs={'window_codename': self.window.codename})
+        self.assertQueriesDoNotGrow(lambda: self.client.get(url))
+
+    def test_board(self):
+        url = reverse('ctflex:scoreboard', kwargs={'window_codename': self.window.codename})
+        self.assertQueriesDoNotGrow(lambda: self.client.get(url))
+
+    def test_overall_board(self):
+        url = reverse('ctflex:scoreboard', kwargs={'window_codename': settings.OVERALL_WINDOW_CODENAME})
+        self.assertQueriesDoNotGrow(lambda: self.client.get(url))
+
+    def test_submit_flag_correct(self):
+
+        def submit(problem):
+            url = reverse('ctflex:api:submit_flag', kwargs={'prob_id': problem.id})
+            return lambda: self.client.post(url, {'flag': 'right'})
+
+        with mock.patch.object(commands, '_grade', return_value=(True, "Correct!")):
+            self.assertQueriesDoNotGrow(submit(self.problems[1]), submit(self.problems[2]))
+
+    def test_submit_flag_incorrect(self):
+        url = reverse('ctflex:api:submit_flag', kwargs={'prob_id': self.problems[1].id})
+
+        flags = iter(('wrong', 'still wrong'))
+        with mock.patch.object(commands, '_grade', return_value=(False, "Nope")):
+            self.assertQueriesDoNotGrow(lambda: self.client.post(url, {'flag': next(flags)}))
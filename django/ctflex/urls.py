@@ -15,6 +15,8 @@ WINDOW_CODE_TOKEN = r'(?:(?P<window_codename>\w+)/)'
 api_urls = [
     url(r'^submit_flag/(?P<prob_id>{})/$'.format(UUID_REGEX), views.submit_flag, name='submit_flag'),
     url(r'^unread_announcements/$', views.unread_announcements, name='unread_announcements'),
+    url(r'^events/$', views.stream_events, name='events'),
+    url(r'^metrics/$', views.metrics_text, name='metrics'),
 ]
 
 windowed_urls = [
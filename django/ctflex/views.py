@@ -8,24 +8,30 @@ from functools import wraps
 from django.contrib import messages
 from django.contrib.auth import authenticate, login as auth_login
 from django.contrib.auth import views as auth_views
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import user_passes_test
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
-from django.db import transaction
-from django.http import JsonResponse, HttpResponseRedirect, Http404
-from django.http.response import HttpResponseNotAllowed
+from django.db import connection, transaction
+from django.http import HttpResponse, JsonResponse, HttpResponseRedirect, Http404, StreamingHttpResponse
+from django.http.response import HttpResponseNotAllowed, HttpResponseNotModified
 from django.shortcuts import render, redirect, render_to_response
 from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
 from django.views.decorators.cache import never_cache
-from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
 from django.views.decorators.debug import sensitive_post_parameters
 from ratelimit.decorators import ratelimit
 from ratelimit.utils import is_ratelimited
 
+from ctflex import caches
 from ctflex import commands
+from ctflex import events
 from ctflex import forms
 from ctflex import loggers
+from ctflex import metrics
 from ctflex import models
 from ctflex import queries
 from ctflex import settings
@@ -46,10 +52,11 @@ def default_context(request):
     `settings.py`; therefore, it should not be manually included.
     """
     return {
-        'team': request.user.competitor.team if queries.is_competitor(request.user) else None,
+        'team': queries.request_state(request).team,
         'contact_email': settings.CONTACT_EMAIL,
         'js_context': '{}',
         'incubating': settings.INCUBATING,
+        'events_enabled': settings.EVENTS_ENABLED,
     }
 
 
@@ -298,7 +305,7 @@ def team_public_detail(request, *, team_id):
         raise Http404()
 
     context = {
-        'windows': queries.all_windows().reverse(),
+        'windows': queries.all_windows()[::-1],
         'other_team': other_team,
         'total_score': queries.score(team=other_team, window=None),
         'score_normalization': settings.SCORE_NORMALIZATION,
@@ -311,8 +318,8 @@ def team_public_detail(request, *, team_id):
 def account(request):
     """View the account/team details page."""
     context = {
-        'members_left': settings.MAX_TEAM_SIZE - request.user.competitor.team.size(),
-        'windows': queries.all_windows().reverse(),
+        'members_left': settings.MAX_TEAM_SIZE - queries.request_state(request).team.size(),
+        'windows': queries.all_windows()[::-1],
     }
     return render(request, 'ctflex/misc/account.html', context)
 
@@ -328,7 +335,7 @@ def start_timer(request):
     """Start a team’s timer and redirect to the game"""
 
     window = queries.get_window()
-    team = request.user.competitor.team
+    team = queries.request_state(request).team
 
     success = commands.start_timer(team=team, window=window)
 
@@ -349,6 +356,8 @@ def submit_flag(request, *, prob_id):
     # Define constants
     STATUS_FIELD = 'status'
     MESSAGE_FIELD = 'message'
+    SCORE_FIELD = 'score'
+    UNLOCKED_FIELD = 'unlocked'
     ALREADY_SOLVED_STATUS = -1
     CORRECT_STATUS = 0
     INCORRECT_STATUS = 1
@@ -370,7 +379,8 @@ def submit_flag(request, *, prob_id):
 
     # Process data from the request
     flag = request.POST.get('flag', '')
-    competitor = request.user.competitor
+    competitor = queries.request_state(request).competitor
+    data = {}
 
     # Grade, catching errors
     try:
@@ -402,20 +412,101 @@ def submit_flag(request, *, prob_id):
         if correct:
             loggers.log_solve(request, solve)
 
-    return JsonResponse({
-        STATUS_FIELD: status,
-        MESSAGE_FIELD: message
-    })
+            # Send the new score and any newly unlocked problems so that
+            # the client can update the game page without reloading it
+            try:
+                data[SCORE_FIELD] = queries.score(team=competitor.team, window=solve.problem.window)
+                data[UNLOCKED_FIELD] = [
+                    {
+                        'id': str(problem.id),
+                        'html': render_to_string('ctflex/game/problem.snippet.html', {
+                            'raw_prob': problem,
+                            'team': competitor.team,
+                            'max_flag_size': MAX_FLAG_SIZE,
+                        }, request=request),
+                    }
+                    for problem in queries.unlocked_problems(solve)
+                ]
+            except Exception:
+                logger.exception("could not render unlocked problems for {!r}".format(solve))
+            else:
+                events.publish_solve(solve=solve, score=data[SCORE_FIELD], unlocked=data[UNLOCKED_FIELD])
+
+    data[STATUS_FIELD] = status
+    data[MESSAGE_FIELD] = message
+    return JsonResponse(data)
 
 
 @never_cache
-@limited_http_methods('POST')
+@limited_http_methods('GET', 'POST')
 def unread_announcements(request):
+    """Return the number of unread announcements in the current window
+
+    Purpose:
+        Every open tab polls this view, so it avoids the database whenever
+        nothing could have changed since the client’s last poll.
+
+    Usage:
+        Clients SHOULD send back the `version` from their previous response,
+        either as a `version` parameter or, for GETs, through `If-None-Match`.
+        If it is still current, the response will omit `count` (or be a 304).
+    """
+
+    VERSION_FIELD = 'version'
+    COUNT_FIELD = 'count'
+
+    params = request.GET if request.method == 'GET' else request.POST
     window = queries.get_window()
-    count = queries.unread_announcements_count(window=window, user=request.user)
-    return JsonResponse({
-        'count': count,
-    })
+    version = caches.announcements_version(window)
+    etag = '"{}"'.format(version)
+
+    if request.method == 'GET' and request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        metrics.announcement_polls.inc(response='not_modified')
+        response = HttpResponseNotModified()
+    elif params.get(VERSION_FIELD) == version:
+        metrics.announcement_polls.inc(response='unchanged')
+        response = JsonResponse({VERSION_FIELD: version})
+    else:
+        metrics.announcement_polls.inc(response='count')
+        response = JsonResponse({
+            VERSION_FIELD: version,
+            COUNT_FIELD: queries.unread_announcements_count(window=window, user=request.user),
+        })
+
+    response['ETag'] = etag
+    return response
+
+
+@never_cache
+@limited_http_methods('GET')
+@competitors_only()
+def stream_events(request):
+    """Stream announcements and the team’s events as Server-Sent Events"""
+
+    if not settings.EVENTS_ENABLED:
+        raise Http404()
+
+    channels = {
+        events.ANNOUNCEMENTS_CHANNEL,
+        events.team_channel(queries.request_state(request).team.id),
+    }
+    last_event_id = request.META.get('HTTP_LAST_EVENT_ID')
+
+    # Release the database connection as the stream may stay open for long
+    connection.close()
+
+    response = StreamingHttpResponse(events.stream(channels, last_event_id),
+                                     content_type='text/event-stream')
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@never_cache
+@staff_member_required
+def metrics_text(request):
+    """Return operational metrics of all processes in Prometheus’ text format"""
+    return HttpResponse(metrics.render(metrics.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 # endregion
@@ -423,15 +514,21 @@ def unread_announcements(request):
 # region Complex GETs
 
 @never_cache
+@ensure_csrf_cookie
 @limited_http_methods('GET')
 @defaulted_window()
 @competitors_or_superusers_only()
 def game(request, *, window_codename):
-    """Display problems"""
+    """Display problems
+
+    The problem list is rendered from a per-team cache (see `caches.game_version`),
+    so it is only computed lazily if the cached fragment is stale.
+    """
 
     # Process request
     superuser = request.user.is_superuser
-    team = request.user.competitor.team
+    state = queries.request_state(request)
+    team = state.team
     try:
         window = queries.get_window(window_codename)
     except models.Window.DoesNotExist:
@@ -439,8 +536,10 @@ def game(request, *, window_codename):
 
     # Initialize context
     context = windowed_context(window)
-    context['prob_list'] = queries.problem_list(team=team, window=window)
+    context['prob_list'] = SimpleLazyObject(lambda: queries.problem_list(team=team, window=window))
     context['max_flag_size'] = MAX_FLAG_SIZE
+    context['game_cache_duration'] = caches.game_cache_duration()
+    context['game_cache_version'] = caches.game_version(team)
     js_context = {}
 
     if not window.started() and not superuser:
@@ -459,12 +558,12 @@ def game(request, *, window_codename):
         context['can_compete_in_current_window'] = (
             current_window.ongoing()
             and (
-                not team.has_timer(window)
-                or team.has_active_timer(window)
+                not state.has_timer(window)
+                or state.has_active_timer(window)
             )
         )
 
-    elif not team.has_timer(window) and not superuser:
+    elif not state.has_timer(window) and not superuser:
         template_name = 'ctflex/game/inactive.html'
 
         js_context[COUNTDOWN_ENDTIME_KEY] = window.end.isoformat()
@@ -472,7 +571,7 @@ def game(request, *, window_codename):
             window.personal_timer_duration.total_seconds() * 1000
         )
 
-    elif not team.has_active_timer(window) and not superuser:
+    elif not state.has_active_timer(window) and not superuser:
         template_name = 'ctflex/game/expired.html'
 
     else:
@@ -481,7 +580,7 @@ def game(request, *, window_codename):
         if superuser:
             messages.warning(request, "You are viewing this window as a superuser.")
         else:
-            js_context[COUNTDOWN_ENDTIME_KEY] = team.timer(window).end.isoformat()
+            js_context[COUNTDOWN_ENDTIME_KEY] = state.timer(window).end.isoformat()
 
     context['js_context'] = json.dumps(js_context)
     return render(request, template_name, context)
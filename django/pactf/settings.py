@@ -54,6 +54,9 @@ class _Django(Configuration):
 
     # (Order matters a lot here.)
     MIDDLEWARE_CLASSES = (
+        # (Disabled by default; comes first so that it times other middleware.)
+        # 'ctflex.middleware.PerformanceMiddleware',
+
         # Django Defaults
         'django.contrib.sessions.middleware.SessionMiddleware',
         'django.middleware.common.CommonMiddleware',
@@ -67,6 +70,9 @@ class _Django(Configuration):
         # Local
         # 'ctflex.middleware.RequestLoggingMiddleware',
         'ctflex.middleware.CloudflareRemoteAddrMiddleware',
+        'ctflex.middleware.RequestStateMiddleware',
+        'ctflex.middleware.IpIndexMiddleware',
+        'ctflex.middleware.QueryDiagnosticsMiddleware',
 
         # Django Extensions
         'django.middleware.common.BrokenLinkEmailsMiddleware',
@@ -205,6 +211,11 @@ class _Django(Configuration):
     CTFLEX_LOG_LEVEL = values.Value('INFO', environ_prefix=None)
     DJANGO_LOG_LEVEL = values.Value('WARNING', environ_prefix=None)
 
+    # Rotate the request log once it reaches this many bytes or seconds (0 to never)
+    REQUEST_LOG_MAX_BYTES = values.IntegerValue(64 * 1024 * 1024, environ_prefix=None)
+    REQUEST_LOG_INTERVAL = values.IntegerValue(24 * 60 * 60, environ_prefix=None)
+    REQUEST_LOG_BACKUP_COUNT = values.IntegerValue(0, environ_prefix=None)
+
     @classmethod
     def set_logging(cls):
         cls.LOGGING = {
@@ -223,17 +234,22 @@ class _Django(Configuration):
                 },
                 'time': {
                     'format': '%(asctime)s %(message)s'
-                }
+                },
+                'json': {
+                    '()': 'ctflex.handlers.JsonFormatter',
+                },
             },
 
             'handlers': {
-                # TODO(Yatharth): rotating
-
                 'request_file': {
                     'level': 'INFO',
-                    'class': 'logging.FileHandler',
+                    'class': 'ctflex.handlers.BackgroundHandler',
+                    'target': 'ctflex.handlers.CompressingRotatingFileHandler',
                     'filename': join(BASE_DIR, 'logs', 'request.log'),
-                    'formatter': 'time',
+                    'max_bytes': cls.REQUEST_LOG_MAX_BYTES,
+                    'interval': cls.REQUEST_LOG_INTERVAL,
+                    'backup_count': cls.REQUEST_LOG_BACKUP_COUNT,
+                    'formatter': 'json',
                 },
                 'ctflex_file': {
                     'level': cls.CTFLEX_LOG_LEVEL,
@@ -279,7 +295,7 @@ class _Django(Configuration):
                 ctflex.constants.IP_LOGGER_NAME: {
                     'level': 'INFO',
                     'handlers': ['request_file'],
-                    'propogate': False,
+                    'propagate': False,
                 }
             },
         }
@@ -353,6 +369,19 @@ class _Gunicorn:
     # Number of worker processes Gunicorn should spawn
     GUNICORN_NUM_WORKERS = values.IntegerValue(1, environ_prefix=None)
 
+    # Kind of worker Gunicorn should use
+    # (Streaming events with CTFLEX_EVENTS_ENABLED needs an asynchronous worker like
+    #  'gevent', which must be installed separately, to hold many idle connections.)
+    GUNICORN_WORKER_CLASS = values.Value('sync', environ_prefix=None)
+
+    # Maximum number of simultaneous connections per asynchronous worker
+    GUNICORN_WORKER_CONNECTIONS = values.IntegerValue(5000, environ_prefix=None)
+
+    # Seconds after which silent workers are restarted
+    # (For asynchronous workers, this only concerns the worker's main loop,
+    #  so it need not exceed the length of streamed responses.)
+    GUNICORN_TIMEOUT = values.IntegerValue(30, environ_prefix=None)
+
 
 class _CTFlex(_Django, Configuration):
     """Configure CTFlex"""
@@ -370,6 +399,14 @@ class _CTFlex(_Django, Configuration):
     CTFLEX_INCUBATING = values.BooleanValue(False, environ_prefix=None)
     CTFLEX_BOARD_CACHE_DURATION = values.IntegerValue(100, environ_prefix=None)
 
+    CTFLEX_EVENTS_ENABLED = values.BooleanValue(False, environ_prefix=None)
+    CTFLEX_EVENTS_SPOOL_PATH = values.Value(join(BASE_DIR, 'run', 'events.spool'), environ_prefix=None)
+
+    CTFLEX_PERF_SAMPLE_RATE = values.FloatValue(0.1, environ_prefix=None)
+    CTFLEX_PERF_DUMP_DIR = values.Value(join(BASE_DIR, 'run', 'perf'), environ_prefix=None)
+    CTFLEX_METRICS_SPOOL_DIR = values.Value(join(BASE_DIR, 'run', 'metrics'), environ_prefix=None)
+    CTFLEX_QUERY_DIAGNOSTICS = values.BooleanValue(False, environ_prefix=None)
+
     NORECAPTCHA_VERIFY_URL = values.Value('https://www.google.com/recaptcha/api/siteverify', environ_prefix=None)
 
     ''' Problems and Staticfiles '''
@@ -437,6 +474,16 @@ class Prod(_Base):
     NORECAPTCHA_SITE_KEY = values.Value('6Ldt_h0TAAAAAHZi1Mk455UT0-XNmDkyKoJMH3wW', environ_prefix=None)
     NORECAPTCHA_SECRET_KEY = values.SecretValue(environ_prefix=None)
 
+    ''' Caching '''
+
+    # (All Gunicorn workers must share the cache for CTFlex’s invalidation to reach them.)
+    CACHES = values.DictValue({
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyLibMCCache',
+            'LOCATION': '127.0.0.1:11211',
+        }
+    })
+
     ''' Logging '''
 
     ADMINS = values.ListValue([
@@ -492,4 +539,6 @@ class FakeProd(Prod):
 
     STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
 
+    CACHES = _Django.CACHES
+
     TEMPLATE_STRING_IF_INVALID = 'DEBUG WARNING: undefined template variable [%s] not found'
@@ -26,6 +26,9 @@ class Command(BaseCommand):
             '{}:application'.format(DJANGO_WSGI_MODULE),
             '--name={}'.format(constants.PROJECT_NAME),
             '--workers={}'.format(settings.GUNICORN_NUM_WORKERS),
+            '--worker-class={}'.format(settings.GUNICORN_WORKER_CLASS),
+            '--worker-connections={}'.format(settings.GUNICORN_WORKER_CONNECTIONS),
+            '--timeout={}'.format(settings.GUNICORN_TIMEOUT),
             '--user={}'.format(settings.GUNICORN_USER),
             '--group={}'.format(settings.GUNICORN_GROUP),
             '--log-level=debug',